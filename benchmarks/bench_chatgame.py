@@ -0,0 +1,376 @@
+"""
+Micro-benchmarks for the chatgame data layer.
+
+Seeds the database configured through the usual DATABASE_* environment variables
+with synthetic users, sessions and messages, then calls every public function in
+`chatgame.chat` repeatedly and records throughput and latency percentiles.
+
+The schema from `sql/dbinit.sql` must already be loaded. Point DATABASE_NAME at a
+scratch database, the benchmark writes (and by default removes) its own rows.
+
+Usage:
+    python benchmarks/bench_chatgame.py --users 200 --sessions 2 --messages 200
+    python benchmarks/bench_chatgame.py --output new.json --compare old.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+
+# Allow running as `python benchmarks/bench_chatgame.py` from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatgame
+from utils.MySQLHandler import get_db_handler
+
+SYSTEM_USER_ID = "00000000-0000-0000-0000-000000000000"
+BATCH_SIZE = 1000  # Rows per executemany batch while seeding
+STARTING_POINTS = 1_000_000  # Balance of every seeded user, so transfers never run out
+
+
+class Dataset:
+    """Identifiers of the rows seeded for one benchmark run."""
+
+    def __init__(self, run_id: str) -> None:
+        self.run_id = run_id
+        self.users: List[Tuple[str, str]] = []  # (user_id, discord_id)
+        self.characters: List[str] = []
+        self.sessions: List[Tuple[str, str, str]] = []  # (session_id, user_id, character_id)
+        self.registered: List[str] = []  # discord ids created by register_user
+        self.granted = 0  # Points paid out by the System user through grant_points
+
+
+def _batched(rows: List[Tuple], size: int = BATCH_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _by_shard(rows: Iterable[Tuple], user_index: int = 0):
+    """Group rows by the shard of the user in column `user_index`, yielding (shard handler, rows)."""
+    db = get_db_handler()
+    groups: Dict[int, List[Tuple]] = defaultdict(list)
+    for row in rows:
+        groups[db.shards.index(db.for_user(row[user_index]))].append(row)
+    for index, group in groups.items():
+        yield db.shards[index], group
+
+
+def seed(users: int, sessions: int, messages: int, characters: int) -> Dataset:
+    """
+    Insert the synthetic dataset.
+
+    Args:
+        users: Number of users to create.
+        sessions: Number of sessions per user.
+        messages: Number of messages per session.
+        characters: Number of characters to create.
+
+    Returns:
+        The identifiers of everything that was inserted.
+    """
+    db = get_db_handler()
+    data = Dataset(uuid.uuid4().hex[:8])
+
+    data.characters = [str(uuid.uuid4()) for _ in range(characters)]
+    db.execute_many(
+        "INSERT INTO Virtual_Character (character_id, name, description, settings, creator_id) "
+        "VALUES (%s, %s, %s, %s, %s)",
+        [(cid, f"bench-{data.run_id}-{i}", "Benchmark character.", "You are a benchmark character.", SYSTEM_USER_ID)
+         for i, cid in enumerate(data.characters)])
+
+    data.users = [(str(uuid.uuid4()), f"bench-{data.run_id}-{i}") for i in range(users)]
+    for batch in _batched([(uid, did, did, random.choice(data.characters), STARTING_POINTS)
+                           for uid, did in data.users]):
+        db.execute_many(
+            "INSERT INTO User (user_id, discord_id, username, current_character, points_balance) "
+            "VALUES (%s, %s, %s, %s, %s)", batch)
+
+    # Sessions, messages, memory and affinity live on the users' shards
+    for user_id, _ in data.users:
+        for _ in range(sessions):
+            data.sessions.append((str(uuid.uuid4()), user_id, random.choice(data.characters)))
+    for shard, rows in _by_shard(data.sessions, user_index=1):
+        for batch in _batched(rows):
+            shard.execute_many(
+                "INSERT INTO Chat_Session (session_id, user_id, character_id) VALUES (%s, %s, %s)", batch)
+
+    pairs = sorted({(user_id, character_id) for _, user_id, character_id in data.sessions})
+    for shard, rows in _by_shard(pairs):
+        for batch in _batched([(u, c, "Benchmark memory.") for u, c in rows]):
+            shard.execute_many("INSERT INTO Memory (user_id, character_id, summary_text) VALUES (%s, %s, %s)", batch)
+        for batch in _batched([(u, c, 50) for u, c in rows]):
+            shard.execute_many("INSERT INTO Affinity (user_id, character_id, value) VALUES (%s, %s, %s)", batch)
+    for batch in _batched([(u, c, "select", "benchmark") for u, c in pairs]):
+        db.execute_many(
+            "INSERT INTO Interaction (user_id, character_id, action, context) VALUES (%s, %s, %s, %s)", batch)
+
+    transactions = [(str(uuid.uuid4()), user_id, random.choice(data.users)[0], 1)
+                    for user_id, _ in data.users for _ in range(5)]
+    for batch in _batched(transactions):
+        db.execute_many(
+            "INSERT INTO Transaction (transaction_id, sender_id, receiver_id, amount) VALUES (%s, %s, %s, %s)", batch)
+
+    for shard, sessions_on_shard in _by_shard(data.sessions, user_index=1):
+        rows = []
+        for session_id, user_id, _ in sessions_on_shard:
+            for i in range(messages):
+                from_user = user_id if i % 2 == 0 else None
+                rows.append((session_id, str(uuid.uuid4()), from_user, f"benchmark message {i} " * 8))
+                if len(rows) >= BATCH_SIZE:
+                    shard.execute_many(
+                        "INSERT INTO Message (session_id, message_id, from_user, content) VALUES (%s, %s, %s, %s)",
+                        rows)
+                    rows = []
+        if rows:
+            shard.execute_many(
+                "INSERT INTO Message (session_id, message_id, from_user, content) VALUES (%s, %s, %s, %s)", rows)
+
+    return data
+
+
+def cleanup(data: Dataset) -> None:
+    """Delete every row created by the benchmark, children before parents."""
+    db = get_db_handler()
+    users = [(uid,) for uid, _ in data.users]
+    users += [(row["user_id"],) for did in data.registered
+              for row in [db.fetch_one("SELECT user_id FROM User WHERE discord_id = %s", (did,))] if row]
+    characters = [(cid,) for cid in data.characters]
+
+    # Rows on the users' shards
+    for shard, rows in _by_shard(users):
+        for query in ("DELETE FROM Message WHERE session_id IN "
+                      "(SELECT session_id FROM Chat_Session WHERE user_id = %s)",
+                      "DELETE FROM Chat_Session WHERE user_id = %s",
+                      "DELETE FROM Memory WHERE user_id = %s",
+                      "DELETE FROM Affinity WHERE user_id = %s",
+                      "DELETE FROM Customization WHERE user_id = %s"):
+            for batch in _batched(rows):
+                shard.execute_many(query, batch)
+
+    # Rows on the main database
+    for query in ("DELETE FROM Interaction WHERE user_id = %s",
+                  "DELETE FROM Transaction WHERE sender_id = %s OR receiver_id = %s",
+                  "DELETE FROM Points_Counter WHERE user_id = %s",
+                  "DELETE FROM LLM_Usage WHERE user_id = %s",
+                  "DELETE FROM LLM_Usage_Daily WHERE user_id = %s",
+                  "DELETE FROM User WHERE user_id = %s"):
+        for batch in _batched(users):
+            db.execute_many(query, [row * query.count("%s") for row in batch])
+    db.execute_many("DELETE FROM Virtual_Character WHERE character_id = %s", characters)
+
+    # Give the System user back what grant_points paid out
+    if data.granted:
+        db.execute("INSERT INTO Points_Counter (user_id, slot, delta) VALUES (%s, 0, %s) "
+                   "ON DUPLICATE KEY UPDATE delta = delta + VALUES(delta)", (SYSTEM_USER_ID, data.granted))
+
+
+def build_cases(data: Dataset) -> Dict[str, Callable[[], Awaitable[Any]]]:
+    """
+    Build one zero-argument coroutine factory per chatgame function.
+
+    Args:
+        data: The seeded dataset to draw arguments from.
+
+    Returns:
+        Mapping of benchmark name to coroutine factory.
+    """
+    def user():
+        return random.choice(data.users)
+
+    def session():
+        return random.choice(data.sessions)
+
+    def register():
+        discord_id = f"bench-{data.run_id}-r{len(data.registered)}"
+        data.registered.append(discord_id)
+        return chatgame.register_user(discord_id, discord_id)
+
+    def transfer():
+        sender, receiver = random.sample(data.users, 2)
+        return chatgame.transfer_points(sender[0], receiver[0], 1)
+
+    def grant():
+        data.granted += 1
+        return chatgame.grant_points(user()[0], 1)
+
+    def character_name():
+        return f"bench-{data.run_id}-{random.randrange(len(data.characters))}"
+
+    return {
+        "get_user_id"             : lambda: chatgame.get_user_id(user()[1]),
+        "register_user"           : register,
+        "get_chat_context"        : lambda: chatgame.get_chat_context(session()[0]),
+        "get_latest_session"      : lambda: chatgame.get_latest_session(*session()[1:]),
+        "create_new_session"      : lambda: chatgame.create_new_session(*session()[1:]),
+        "update_affinity"         : lambda: chatgame.update_affinity(*session()[1:], random.randint(0, 100)),
+        "update_memory"           : lambda: chatgame.update_memory(*session()[1:], "Updated benchmark memory."),
+        "get_current_character"   : lambda: chatgame.get_current_character(user()[0]),
+        "change_current_character": lambda: chatgame.change_current_character(user()[0],
+                                                                              random.choice(data.characters)),
+        "get_created_characters"  : lambda: chatgame.get_created_characters(SYSTEM_USER_ID),
+        "get_character_history"   : lambda: chatgame.get_character_history(user()[0]),
+        "get_points_balance"      : lambda: chatgame.get_points_balance(user()[0]),
+        "get_points_history"      : lambda: chatgame.get_points_history(user()[0]),
+        "get_character_info"      : lambda: chatgame.get_character_info(random.choice(data.characters)),
+        "create_new_message"      : lambda: chatgame.create_new_message(session()[0], "benchmark reply",
+                                                                        None, from_user=False),
+        "get_username"            : lambda: chatgame.get_username(user()[0]),
+        "search_messages"         : lambda: chatgame.search_messages(user()[0], "benchmark message"),
+        "export_user_history"     : lambda: chatgame.export_user_history(user()[0], io.BytesIO()),
+        "find_character"          : lambda: chatgame.find_character(character_name()),
+        "find_character_fuzzy"    : lambda: chatgame.find_character(character_name()[:-1] + "x"),
+        "transfer_points"         : transfer,
+        "grant_points"            : grant,
+    }
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+async def run_case(factory: Callable[[], Awaitable[Any]], iterations: int, warmup: int) -> Dict[str, float]:
+    """
+    Time one benchmark case.
+
+    Args:
+        factory: Returns a fresh coroutine for every call.
+        iterations: Number of measured calls.
+        warmup: Number of unmeasured calls made first.
+
+    Returns:
+        Throughput and latency statistics in milliseconds.
+    """
+    for _ in range(warmup):
+        await factory()
+
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        await factory()
+        samples.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+
+    samples.sort()
+    return {
+        "iterations" : iterations,
+        "ops_per_sec": round(iterations / elapsed, 2) if elapsed else 0.0,
+        "mean_ms"    : round(sum(samples) / len(samples), 3),
+        "p50_ms"     : round(percentile(samples, 50), 3),
+        "p90_ms"     : round(percentile(samples, 90), 3),
+        "p99_ms"     : round(percentile(samples, 99), 3),
+        "max_ms"     : round(samples[-1], 3),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: Dict[str, Any], previous_path: str, threshold: float) -> bool:
+    """
+    Print per-case deltas against a previous results file.
+
+    Args:
+        current: Results of this run.
+        previous_path: Path of an earlier JSON results file.
+        threshold: Relative p50 slowdown (e.g. 0.2 for 20%) counted as a regression.
+
+    Returns:
+        True if any case regressed beyond the threshold.
+    """
+    with open(previous_path) as f:
+        previous = json.load(f)
+
+    regressed = False
+    print(f"\nComparison against {previous_path} ({previous['meta'].get('commit', '?')}):")
+    for name, stats in current["results"].items():
+        old = previous["results"].get(name)
+        if not old or not old["p50_ms"]:
+            continue
+        delta = (stats["p50_ms"] - old["p50_ms"]) / old["p50_ms"]
+        flag = "REGRESSION" if delta > threshold else ""
+        regressed = regressed or bool(flag)
+        print(f"  {name:<26} p50 {old['p50_ms']:>8.3f} -> {stats['p50_ms']:>8.3f} ms ({delta:+.1%}) {flag}")
+    return regressed
+
+
+async def main(args: argparse.Namespace) -> int:
+    random.seed(args.seed)
+    get_db_handler().initialize()
+
+    print(f"Seeding {args.users} users x {args.sessions} sessions x {args.messages} messages...")
+    t0 = time.perf_counter()
+    data = seed(args.users, args.sessions, args.messages, args.characters)
+    seed_time = time.perf_counter() - t0
+
+    results = {}
+    try:
+        cases = build_cases(data)
+        selected = args.only or list(cases)
+        for name in selected:
+            results[name] = await run_case(cases[name], args.iterations, args.warmup)
+            print(f"  {name:<26} {results[name]['ops_per_sec']:>9.1f} ops/s  "
+                  f"p50 {results[name]['p50_ms']:.3f} ms  p99 {results[name]['p99_ms']:.3f} ms")
+    finally:
+        if not args.keep_data:
+            cleanup(data)
+
+    report = {
+        "meta"   : {
+            "commit"          : git_commit(),
+            "timestamp"       : time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python"          : platform.python_version(),
+            "users"           : args.users,
+            "sessions"        : args.sessions,
+            "messages"        : args.messages,
+            "characters"      : args.characters,
+            "iterations"      : args.iterations,
+            "seed_time_sec"   : round(seed_time, 2),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the chatgame data layer against a local MySQL.")
+    parser.add_argument("--users", type=int, default=100, help="number of seeded users")
+    parser.add_argument("--sessions", type=int, default=2, help="sessions per user")
+    parser.add_argument("--messages", type=int, default=100, help="messages per session")
+    parser.add_argument("--characters", type=int, default=10, help="number of seeded characters")
+    parser.add_argument("--iterations", type=int, default=200, help="measured calls per function")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured calls per function")
+    parser.add_argument("--only", nargs="*", help="benchmark only these functions")
+    parser.add_argument("--seed", type=int, default=5200, help="random seed")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown counted as a regression")
+    parser.add_argument("--keep-data", action="store_true", help="do not delete the seeded rows")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
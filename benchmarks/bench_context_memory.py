@@ -0,0 +1,140 @@
+"""
+Memory and GC cost of conversation histories held in memory.
+
+Builds the histories of many sessions the way `get_chat_context` does, once with the
+former representation (a list of OpenAI-style dicts, the author prefix copied into every
+user message) and once with `MessageHistory` (slotted `ChatMessage` records in a bounded
+deque, interned roles and author prefixes). Reports the traced memory, the garbage collections
+triggered while building, the time of a full `gc.collect()` with the histories alive (slotted
+records stay tracked by the collector, while dicts of strings are not), and the time to build
+the OpenAI `messages` lists.
+Runs offline: no database or OpenAI access is needed.
+
+Usage:
+    python benchmarks/bench_context_memory.py
+    python benchmarks/bench_context_memory.py --sessions 10000 --messages 100 --output context_memory.json
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ChatContext import MessageHistory  # noqa: E402
+
+
+def make_rows(sessions: int, messages: int, seed: int) -> List[List[Dict[str, Any]]]:
+    """Message rows as returned by the database: alternating user and character messages."""
+    rng = random.Random(seed)
+    words = ["hello", "there", "how", "are", "you", "today", "the", "weather", "is", "nice", "indeed"]
+    rows = []
+    for s in range(sessions):
+        user_id = str(100000000000000000 + s % 1000)
+        count = rng.randint(1, messages)
+        rows.append([{
+            "from_user": user_id if i % 2 == 0 else None,
+            "content"  : " ".join(rng.choice(words) for _ in range(rng.randint(3, 40))),
+        } for i in range(count)])
+    return rows
+
+
+def build_dicts(rows: List[List[Dict[str, Any]]], max_length: int) -> List[Any]:
+    histories = []
+    for session in rows:
+        history = []
+        for message in session:
+            author_id = message["from_user"]
+            if author_id:
+                history.append({"role": "user", "content": f"user{author_id[-3:]}<{author_id}>\n" + message["content"]})
+            else:
+                history.append({"role": "assistant", "content": message["content"]})
+        histories.append(history[-max_length:])
+    return histories
+
+
+def build_slots(rows: List[List[Dict[str, Any]]], max_length: int) -> List[Any]:
+    histories = []
+    for session in rows:
+        history = MessageHistory(max_length=max_length)
+        for message in session:
+            author_id = message["from_user"]
+            if author_id:
+                history.append("user", message["content"], author=f"user{author_id[-3:]}<{author_id}>\n")
+            else:
+                history.append("assistant", message["content"])
+        histories.append(history)
+    return histories
+
+
+def measure(name: str, build: Callable, to_openai: Callable, rows: List[List[Dict[str, Any]]],
+            max_length: int) -> Dict[str, Any]:
+    gc.collect()
+    collections = sum(stats["collections"] for stats in gc.get_stats())
+    tracemalloc.start()
+    started = time.perf_counter()
+    histories = build(rows, max_length)
+    build_s = time.perf_counter() - started
+    collections = sum(stats["collections"] for stats in gc.get_stats()) - collections
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    gc_times = []
+    for _ in range(5):
+        started = time.perf_counter()
+        gc.collect()
+        gc_times.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for history in histories:
+        to_openai(history)
+    render_s = time.perf_counter() - started
+
+    result = {
+        "memory_mb"  : round(memory / 2 ** 20, 1),
+        "peak_mb"    : round(peak / 2 ** 20, 1),
+        "build_ms"   : round(build_s * 1000, 1),
+        "build_gcs"  : collections,
+        "gc_ms"      : round(min(gc_times) * 1000, 1),
+        "render_ms"  : round(render_s * 1000, 1),
+        "gc_tracked" : len(gc.get_objects()),
+    }
+    del histories
+    print(f"{name:<8} " + "  ".join(f"{key}={value}" for key, value in result.items()))
+    return result
+
+
+def main(args: argparse.Namespace) -> None:
+    rows = make_rows(args.sessions, args.messages, args.seed)
+    print(f"{args.sessions} sessions, up to {args.messages} messages each, "
+          f"{sum(len(session) for session in rows)} messages")
+
+    results = {
+        "dicts": measure("dicts", build_dicts, lambda history: list(history), rows, args.max_length),
+        "slots": measure("slots", build_slots, lambda history: history.to_openai(), rows, args.max_length),
+    }
+    print(f"memory: {results['slots']['memory_mb'] / max(results['dicts']['memory_mb'], 0.1):.2f}x of dicts, "
+          f"gc: {results['slots']['gc_ms'] / max(results['dicts']['gc_ms'], 0.1):.2f}x of dicts")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the memory and GC cost of conversation histories.")
+    parser.add_argument("--sessions", type=int, default=10000, help="number of session histories held in memory")
+    parser.add_argument("--messages", type=int, default=100, help="maximum messages per session")
+    parser.add_argument("--max-length", type=int, default=100, help="history length limit")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
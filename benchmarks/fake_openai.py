@@ -0,0 +1,173 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint.
+
+Answers `POST /v1/chat/completions` with a structured `ChatResponse` payload, so
+`client.beta.chat.completions.parse` in `utils.chatgpt` works unchanged when the
+client is pointed at it through `OPENAI_BASE_URL`. Latency (including a slow tail,
+to exercise OPENAI_HEDGING), server errors and 429 rate limits are injected
+according to the command line options.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8089 --latency-ms 800 --jitter-ms 300 --rate-limit-rate 0.02
+    python benchmarks/fake_openai.py --latency-ms 800 --tail-rate 0.05 --tail-ms 10000
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict
+
+from aiohttp import web
+
+
+class FakeOpenAIConfig:
+    """Behaviour of the fake server."""
+
+    def __init__(
+            self,
+            latency_ms: float = 500.0,
+            jitter_ms: float = 200.0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            retry_after: float = 1.0,
+            tail_rate: float = 0.0,
+            tail_ms: float = 10000.0) -> None:
+        """
+        Args:
+            latency_ms: Median response latency.
+            jitter_ms: Standard deviation of the latency (clamped at zero).
+            tail_rate: Probability of a slow response, delayed by an extra `tail_ms`.
+            tail_ms: Extra latency of slow responses.
+            error_rate: Probability of answering with HTTP 500.
+            rate_limit_rate: Probability of answering with HTTP 429.
+            retry_after: Value of the Retry-After header on 429 responses, in seconds.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+
+
+class FakeOpenAIServer:
+    """aiohttp application mimicking the chat completions API."""
+
+    def __init__(self, config: FakeOpenAIConfig) -> None:
+        self.config = config
+        self.stats = {"requests": 0, "completed": 0, "errors": 0, "rate_limited": 0, "slow": 0, "cancelled": 0}
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat/completions", self.handle_completion)
+        self.app.router.add_post("/chat/completions", self.handle_completion)
+        self.app.router.add_get("/stats", self.handle_stats)
+
+    def _latency(self) -> float:
+        latency = max(0.0, random.gauss(self.config.latency_ms, self.config.jitter_ms))
+        if random.random() < self.config.tail_rate:
+            self.stats["slow"] += 1
+            latency += self.config.tail_ms
+        return latency / 1000
+
+    @staticmethod
+    def _error(message: str, error_type: str) -> Dict[str, Any]:
+        return {"error": {"message": message, "type": error_type, "param": None, "code": None}}
+
+    async def handle_completion(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        body = await request.json()
+        try:
+            await asyncio.sleep(self._latency())
+        except asyncio.CancelledError:
+            # The client gave up, e.g. a hedged request that lost the race
+            self.stats["cancelled"] += 1
+            raise
+
+        roll = random.random()
+        if roll < self.config.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return web.json_response(
+                self._error("Rate limit reached (fake)", "rate_limit_exceeded"),
+                status=429, headers={"Retry-After": str(self.config.retry_after)})
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response(self._error("Internal error (fake)", "server_error"), status=500)
+
+        messages = body.get("messages", [])
+        last = messages[-1]["content"] if messages else ""
+        content = {
+            "message": f"(fake reply) {str(last)[-200:]}",
+            "actions": [
+                {"type": "affinity", "value": str(random.randint(40, 60))},
+                {"type": "memory", "value": "The user talked to me during a load test."},
+            ],
+        }
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        self.stats["completed"] += 1
+        return web.json_response({
+            "id"     : f"chatcmpl-{uuid.uuid4().hex}",
+            "object" : "chat.completion",
+            "created": int(time.time()),
+            "model"  : body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index"        : 0,
+                "message"      : {"role": "assistant", "content": json.dumps(content), "refusal": None},
+                "logprobs"     : None,
+                "finish_reason": "stop",
+            }],
+            "usage"  : {
+                "prompt_tokens"    : prompt_tokens,
+                "completion_tokens": 40,
+                "total_tokens"     : prompt_tokens + 40,
+            },
+        })
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8089) -> None:
+        """Start serving in the current event loop."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="median response latency")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="latency standard deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="probability of HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="probability of a slow response")
+    parser.add_argument("--tail-ms", type=float, default=10000.0, help="extra latency of slow responses")
+    return parser.parse_args()
+
+
+def config_from_args(args: argparse.Namespace) -> FakeOpenAIConfig:
+    return FakeOpenAIConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        tail_rate=args.tail_rate,
+        tail_ms=args.tail_ms)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = FakeOpenAIServer(config_from_args(args))
+    print(f"Fake OpenAI listening on http://{args.host}:{args.port}/v1")
+    web.run_app(server.app, host=args.host, port=args.port, print=None)
@@ -0,0 +1,289 @@
+"""
+End-to-end load generator for the chat plugin.
+
+Drives `plugins/commands/chat.py::handle_logger` through NoneBot's real event
+dispatch (`nonebot.message.handle_event`) with synthetic Discord
+`GuildMessageCreateEvent`s at a target arrival rate. Replies are captured by a
+loopback bot instead of being posted to Discord, and OpenAI traffic goes to the
+local fake server from `benchmarks/fake_openai.py`, so the run is fully offline.
+A local MySQL loaded with `sql/dbinit.sql` is still required.
+
+Reports throughput, end-to-end reply latency, DB queries per turn, event-loop lag and
+the chat plugin's admission control counters (shed turns get a "busy" fallback reply).
+
+Usage:
+    python benchmarks/loadgen.py --rate 20 --duration 60 --users 50 --latency-ms 800
+    python benchmarks/loadgen.py --rate 50 --duration 30 --rate-limit-rate 0.05 --output load.json
+    python benchmarks/loadgen.py --rate 20 --duration 120 --tail-rate 0.05 --tail-ms 8000 --hedging
+"""
+import argparse
+import asyncio
+import contextvars
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+
+DEFAULT_CHARACTER_ID = "00000000-0000-0000-0000-000000000001"  # King Husky, seeded by sql/dbinit.sql
+FIRST_USER_SNOWFLAKE = 900_000_000_000_000_000  # Synthetic Discord ids start here
+TYPING_TEXT = "*typing...*"
+
+# Per-turn query counter, inherited by every task NoneBot spawns for the event
+_turn_queries: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("turn_queries", default=None)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples) + 0.5)) - 1))
+    return samples[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean" : round(sum(samples) / len(samples), 3),
+        "p50"  : round(percentile(samples, 50), 3),
+        "p90"  : round(percentile(samples, 90), 3),
+        "p99"  : round(percentile(samples, 99), 3),
+        "max"  : round(samples[-1], 3),
+    }
+
+
+def count_queries() -> None:
+    """
+    Wrap the query methods of every handler, the main database's and the shards', so every
+    call is attributed to the running turn. Streamed reads count once per query: `fetch_iter`
+    goes through `fetch_batches`.
+    """
+    from utils.MySQLHandler import MySQLQueryMixin
+
+    for name in ("execute", "execute_many", "fetch_one", "fetch_all", "fetch_batches"):
+        method = getattr(MySQLQueryMixin, name)
+
+        @wraps(method)
+        def counted(*args, __method=method, **kwargs):
+            counter = _turn_queries.get()
+            if counter is not None:
+                counter[0] += 1
+            return __method(*args, **kwargs)
+
+        setattr(MySQLQueryMixin, name, counted)
+
+
+async def sample_loop_lag(samples: List[float], interval: float = 0.01) -> None:
+    """Record how late the event loop wakes up a sleeping task, in milliseconds."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected) * 1000)
+
+
+class LoadResults:
+    """Measurements collected while the load is running."""
+
+    def __init__(self) -> None:
+        self.started: Dict[str, float] = {}  # Discord message id -> dispatch time
+        self.reply_latency_ms: List[float] = []
+        self.queries_per_turn: List[float] = []
+        self.loop_lag_ms: List[float] = []
+        self.replies = 0
+        self.fallback_replies = 0
+        self.dispatch_errors = 0
+
+
+def make_bot_class():
+    from nonebot.adapters.discord import Bot
+
+    class LoopbackBot(Bot):
+        """Discord bot that records outgoing messages instead of calling the Discord API."""
+
+        results: LoadResults
+
+        async def send(self, event, message, **kwargs: Any) -> None:
+            text = str(message)
+            if text == TYPING_TEXT:
+                return
+            started = self.results.started.get(str(event.id))
+            if started is not None:
+                self.results.reply_latency_ms.append((time.perf_counter() - started) * 1000)
+            self.results.replies += 1
+            if not text.startswith("(fake reply)"):
+                self.results.fallback_replies += 1
+
+        async def call_api(self, api: str, **data: Any) -> Any:
+            return None
+
+    return LoopbackBot
+
+
+def make_event(message_id: int, discord_id: int, content: str):
+    from nonebot.adapters.discord import GuildMessageCreateEvent
+    from nonebot.compat import type_validate_python
+
+    return type_validate_python(GuildMessageCreateEvent, {
+        "id"              : message_id,
+        "channel_id"      : 1,
+        "guild_id"        : 1,
+        "author"          : {"id": discord_id, "username": f"load{discord_id}", "discriminator": "0",
+                             "global_name": f"load{discord_id}", "avatar": None},
+        "content"         : content,
+        "timestamp"       : datetime.datetime.now(datetime.timezone.utc),
+        "edited_timestamp": None,
+        "tts"             : False,
+        "mention_everyone": False,
+        "mentions"        : [],
+        "mention_roles"   : [],
+        "attachments"     : [],
+        "embeds"          : [],
+        "pinned"          : False,
+        "type"            : 0,
+    })
+
+
+async def ensure_users(count: int, character_id: str) -> List[int]:
+    """Register `count` synthetic users and point them at `character_id`."""
+    import chatgame
+
+    discord_ids = []
+    for i in range(count):
+        discord_id = FIRST_USER_SNOWFLAKE + i
+        try:
+            user_id = await chatgame.get_user_id(str(discord_id))
+        except chatgame.UserNotFoundError:
+            await chatgame.register_user(str(discord_id), f"load{i}")
+            user_id = await chatgame.get_user_id(str(discord_id))
+        await chatgame.change_current_character(user_id, character_id)
+        discord_ids.append(discord_id)
+    return discord_ids
+
+
+async def dispatch(bot, event, results: LoadResults) -> None:
+    from nonebot.message import handle_event
+
+    counter = [0]
+    _turn_queries.set(counter)
+    results.started[str(event.id)] = time.perf_counter()
+    try:
+        await handle_event(bot, event)
+    except Exception:
+        results.dispatch_errors += 1
+    results.queries_per_turn.append(counter[0])
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    import nonebot
+    from nonebot.adapters.discord import Adapter
+    from nonebot.adapters.discord.config import BotInfo
+
+    nonebot.init(driver="~httpx+~websockets", discord_bots=[], command_start=["!"])
+    driver = nonebot.get_driver()
+    driver.register_adapter(Adapter)
+    nonebot.load_plugin("plugins.commands.chat")
+
+    count_queries()
+
+    results = LoadResults()
+    bot_class = make_bot_class()
+    bot_class.results = results
+    bot = bot_class(nonebot.get_adapter(Adapter), "1", BotInfo(token="loadgen"))
+
+    discord_ids = await ensure_users(args.users, args.character)
+    message_ids = itertools.count(FIRST_USER_SNOWFLAKE * 2)
+
+    lag_task = asyncio.create_task(sample_loop_lag(results.loop_lag_ms))
+    turns = []
+    started = time.perf_counter()
+    deadline = started + args.duration
+    while time.perf_counter() < deadline:
+        event = make_event(next(message_ids), random.choice(discord_ids), f"load test message {len(turns)}")
+        turns.append(asyncio.create_task(dispatch(bot, event, results)))
+        # Poisson arrivals at the target rate
+        await asyncio.sleep(random.expovariate(args.rate))
+    await asyncio.gather(*turns)
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+
+    return {
+        "config"          : {k: v for k, v in vars(args).items() if k != "output"},
+        "turns"           : len(turns),
+        "elapsed_sec"     : round(elapsed, 2),
+        "throughput_tps"  : round(results.replies / elapsed, 2),
+        "replies"         : results.replies,
+        "fallback_replies": results.fallback_replies,
+        "dispatch_errors" : results.dispatch_errors,
+        "reply_latency_ms": summarize(results.reply_latency_ms),
+        "queries_per_turn": summarize(results.queries_per_turn),
+        "loop_lag_ms"     : summarize(results.loop_lag_ms),
+        "admission"       : sys.modules["plugins.commands.chat"].admission.snapshot(),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    server = FakeOpenAIServer(FakeOpenAIConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        tail_rate=args.tail_rate,
+        tail_ms=args.tail_ms))
+    await server.start(port=args.openai_port)
+
+    # Must be set before utils.chatgpt builds its client
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    if args.hedging:
+        os.environ["OPENAI_HEDGING"] = "on"
+
+    try:
+        report = await run_load(args)
+    finally:
+        await server.stop()
+    report["openai"] = server.stats
+
+    from utils.chatgpt import hedge_policy
+    if hedge_policy is not None:
+        report["hedging"] = hedge_policy.snapshot()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Drive handle_logger with synthetic Discord messages.")
+    parser.add_argument("--rate", type=float, default=10.0, help="target arrival rate in messages/sec")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to generate load for")
+    parser.add_argument("--users", type=int, default=20, help="number of synthetic users")
+    parser.add_argument("--character", default=DEFAULT_CHARACTER_ID, help="character the users chat with")
+    parser.add_argument("--openai-port", type=int, default=8089, help="port for the fake OpenAI server")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="fake OpenAI median latency")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="fake OpenAI latency standard deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake OpenAI HTTP 500 probability")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fake OpenAI HTTP 429 probability")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fake OpenAI slow response probability")
+    parser.add_argument("--tail-ms", type=float, default=10000.0, help="fake OpenAI extra latency of slow responses")
+    parser.add_argument("--hedging", action="store_true", help="enable hedged OpenAI requests (OPENAI_HEDGING)")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,148 @@
+"""
+Import-time report for the bot's startup path, with a regression budget.
+
+Imports each target module in a fresh interpreter under `python -X importtime`,
+and reports its total import time and the heaviest modules it pulls in. Nothing
+connects to the database or OpenAI: those are deferred to the startup hook.
+
+Budgets live in `benchmarks/startup_budget.json` as milliseconds per target. With
+`--check` the script exits with status 1 when a target exceeds its budget, so it can
+run in CI. Targets that fail to import (e.g. a missing adapter) are reported and skipped.
+
+Usage:
+    python benchmarks/startup_report.py
+    python benchmarks/startup_report.py --check
+    python benchmarks/startup_report.py chatgame utils.chatgpt --top 15 --output startup.json
+    python benchmarks/startup_report.py --write-budget
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(ROOT, "benchmarks", "startup_budget.json")
+DEFAULT_TARGETS = ["chatgame", "utils.chatgpt", "plugins.commands.chat", "main"]
+BUDGET_HEADROOM = 1.5  # --write-budget allows this factor over the measured time
+
+# "import time: self [us] | cumulative | imported package"
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(output: str) -> List[Dict[str, Any]]:
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        One entry per imported module with `self_ms`, `cumulative_ms` and nesting `depth`.
+    """
+    modules = []
+    for line in output.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            modules.append({
+                "module"       : match.group(4),
+                "self_ms"      : int(match.group(1)) / 1000,
+                "cumulative_ms": int(match.group(2)) / 1000,
+                "depth"        : (len(match.group(3)) - 1) // 2,
+            })
+    return modules
+
+
+def measure(target: str) -> Optional[List[Dict[str, Any]]]:
+    """Import `target` in a fresh interpreter and return the parsed timings, or None on failure."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+        print(f"{target}: import failed ({error})", file=sys.stderr)
+        return None
+    return parse_importtime(result.stderr)
+
+
+def report(target: str, repeat: int, top: int) -> Optional[Dict[str, Any]]:
+    """Measure a target `repeat` times and summarize it by the median run."""
+    runs = []
+    for _ in range(repeat):
+        modules = measure(target)
+        if modules is None:
+            return None
+        runs.append(modules)
+
+    totals = [next(m["cumulative_ms"] for m in modules if m["module"] == target) for modules in runs]
+    median_run = runs[totals.index(statistics.median_low(totals))]
+
+    # Attribute self time to top-level packages (e.g. all of openai.* to "openai")
+    packages: Dict[str, float] = {}
+    for module in median_run:
+        package = module["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + module["self_ms"]
+
+    return {
+        "total_ms"    : statistics.median(totals),
+        "modules"     : len(median_run),
+        "top_packages": sorted(packages.items(), key=lambda item: -item[1])[:top],
+    }
+
+
+def main(args: argparse.Namespace) -> int:
+    budgets: Dict[str, float] = {}
+    if os.path.exists(BUDGET_FILE):
+        with open(BUDGET_FILE) as f:
+            budgets = json.load(f)
+
+    results = {}
+    over_budget = []
+    for target in args.targets:
+        result = report(target, args.repeat, args.top)
+        if result is None:
+            continue
+        results[target] = result
+
+        budget = budgets.get(target)
+        status = ""
+        if budget is not None:
+            status = f" (budget {budget:.0f}ms)"
+            if result["total_ms"] > budget:
+                status += " OVER BUDGET"
+                over_budget.append(target)
+        print(f"{target}: {result['total_ms']:.1f}ms, {result['modules']} modules{status}")
+        for package, ms in result["top_packages"]:
+            print(f"    {package:<30} {ms:8.1f}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.write_budget:
+        budgets.update({target: round(result["total_ms"] * BUDGET_HEADROOM) for target, result in results.items()})
+        with open(BUDGET_FILE, "w") as f:
+            json.dump(budgets, f, indent=2)
+            f.write("\n")
+        print(f"Budgets written to {BUDGET_FILE}")
+
+    if args.check and over_budget:
+        print(f"Over budget: {', '.join(over_budget)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Report per-module import time of the bot's startup path.")
+    parser.add_argument("targets", nargs="*", default=DEFAULT_TARGETS, help="modules to import")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per target, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of heaviest packages to list")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if a target is over budget")
+    parser.add_argument("--write-budget", action="store_true",
+                        help=f"set the budgets to {BUDGET_HEADROOM}x the measured times")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -1,11 +1,10 @@
-from utils.MySQLHandler import MySQLHandler
-
 from chatgame.chat import *
 from chatgame.exceptions import *
+from chatgame.startup import warm_up
+from chatgame.usage import get_usage_meter, usage_report
+from chatgame.purge import purge_user, schedule_purge, resume_purges, purge_jobs
+from chatgame.packs import import_characters, pack_format
 
-# init Database
-db_handler = MySQLHandler.get_instance()
-db_handler.initialize()
-
-# Execute SQL initialization file
-# db_handler.execute_file("./sql/dbinit.sql")
+# The database connects lazily on first use, or ahead of time through `warm_up()`
+# (run from the bot's startup hook). Execute SQL initialization file with:
+# get_db_handler().execute_file("./sql/dbinit.sql")
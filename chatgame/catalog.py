@@ -0,0 +1,313 @@
+import bisect
+import logging
+import threading
+import time
+from os import getenv
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.MySQLHandler import get_db_handler
+
+logger = logging.getLogger("chatgame.catalog")
+
+CATALOG_COLUMNS = "character_id, name, description, settings, creator_id, creation_time"
+
+# Seconds after which `refresh` reloads the catalog even if no characters were added, picking
+# up characters other processes changed in place
+CATALOG_MAX_AGE = float(getenv("CATALOG_MAX_AGE_SECONDS", "3600"))
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# A pending catalog change: ("upsert", character row) or ("remove", character ID)
+Change = Tuple[str, Any]
+
+
+class _CatalogSnapshot:
+    """Immutable set of lookup structures; replaced as a whole so readers never see a partial update."""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]) -> None:
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, str] = {}  # exact name -> id
+        self.by_folded: Dict[str, str] = {}  # case-folded name -> id
+        self.trigrams: Dict[str, Set[str]] = defaultdict(set)  # trigram -> ids
+        for row in rows:
+            character = dict(row)
+            character_id = character["character_id"]
+            folded = character["name"].casefold()
+            self.by_id[character_id] = character
+            self.by_name[character["name"]] = character_id
+            self.by_folded[folded] = character_id
+            for gram in _trigrams(folded):
+                self.trigrams[gram].add(character_id)
+        self.sorted_folded: List[str] = sorted(self.by_folded)
+
+    def apply(self, changes: List[Change]) -> "_CatalogSnapshot":
+        """
+        A new snapshot with the changes applied, leaving this one untouched. The maps are copied
+        shallowly (a C-level copy) and only the entries of changed characters are rebuilt, so a
+        batch of changes costs far less than building the snapshot from all rows again.
+        """
+        new = _CatalogSnapshot.__new__(_CatalogSnapshot)
+        new.by_id = dict(self.by_id)
+        new.by_name = dict(self.by_name)
+        new.by_folded = dict(self.by_folded)
+        new.trigrams = defaultdict(set, self.trigrams)
+        new.sorted_folded = list(self.sorted_folded)
+        copied: Set[str] = set()  # Trigram sets already copied from the old snapshot
+
+        def gram_ids(gram: str) -> Set[str]:
+            if gram not in copied:
+                new.trigrams[gram] = set(new.trigrams.get(gram, ()))
+                copied.add(gram)
+            return new.trigrams[gram]
+
+        def unindex(character_id: str) -> None:
+            old = new.by_id.pop(character_id, None)
+            if old is None:
+                return
+            folded = old["name"].casefold()
+            if new.by_name.get(old["name"]) == character_id:
+                del new.by_name[old["name"]]
+            if new.by_folded.get(folded) == character_id:
+                del new.by_folded[folded]
+                index = bisect.bisect_left(new.sorted_folded, folded)
+                if index < len(new.sorted_folded) and new.sorted_folded[index] == folded:
+                    del new.sorted_folded[index]
+            for gram in _trigrams(folded):
+                gram_ids(gram).discard(character_id)
+
+        for kind, value in changes:
+            if kind == "remove":
+                unindex(value)
+                continue
+            character_id = value["character_id"]
+            character = {**new.by_id.get(character_id, {}), **value}
+            if "name" not in character:
+                # A partial update of a character the catalog doesn't know
+                continue
+            unindex(character_id)
+            folded = character["name"].casefold()
+            new.by_id[character_id] = character
+            new.by_name[character["name"]] = character_id
+            if folded not in new.by_folded:
+                bisect.insort(new.sorted_folded, folded)
+            new.by_folded[folded] = character_id
+            for gram in _trigrams(folded):
+                gram_ids(gram).add(character_id)
+        return new
+
+
+class CharacterCatalog:
+    """
+    In-memory index of the `Virtual_Character` table.
+
+    Supports lookups by ID, exact name, case-insensitive name, name prefix (for autocomplete)
+    and fuzzy name matching on character trigrams. Code that changes characters calls
+    `upsert`/`remove` so the index stays fresh without reloading the whole table; changes are
+    collected and applied together on the next lookup. Characters changed by other processes
+    (e.g. `scripts/import_characters.py`) are picked up by `refresh`, which the bot runs every
+    CATALOG_REFRESH_SECONDS.
+
+    Reads never lock. Changes come from the event loop and from worker threads (loads, pack
+    imports), so building and swapping in a new snapshot happens under a lock: two changes
+    at once would otherwise both start from the old snapshot and one of them would be lost.
+    """
+
+    def __init__(self) -> None:
+        self._snapshot = _CatalogSnapshot([])
+        self._pending: List[Change] = []  # Changes not applied to the snapshot yet
+        self._journal: Optional[List[Change]] = None  # Changes made while a load is reading the table
+        self._lock = threading.Lock()
+        self._fingerprint: Optional[Tuple[Any, ...]] = None  # Table fingerprint at the last load
+        self._loaded_at = 0.0
+        self.loaded = False
+
+    def _current(self) -> _CatalogSnapshot:
+        """The snapshot with every change made so far applied."""
+        if self._pending:
+            with self._lock:
+                if self._pending:
+                    self._snapshot = self._snapshot.apply(self._pending)
+                    self._pending = []
+        return self._snapshot
+
+    def _change(self, changes: List[Change]) -> None:
+        with self._lock:
+            self._pending.extend(changes)
+            if self._journal is not None:
+                self._journal.extend(changes)
+
+    def _table_fingerprint(self) -> Tuple[Any, ...]:
+        # Characters are only ever added (and reassigned) by the bot and the import script, so
+        # the row count and newest creation time change whenever another process adds some
+        row = get_db_handler().fetch_one(
+            "SELECT COUNT(*) AS characters, MAX(creation_time) AS newest FROM Virtual_Character")
+        return row["characters"], row["newest"]
+
+    def load(self) -> "CharacterCatalog":
+        """(Re)load the whole catalog from the database."""
+        with self._lock:
+            self._journal = []
+        try:
+            fingerprint = self._table_fingerprint()
+            rows = get_db_handler().fetch_all(f"SELECT {CATALOG_COLUMNS} FROM Virtual_Character")
+            snapshot = _CatalogSnapshot(rows)
+        except BaseException:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            # Changes notified while the table was read may be missing from the rows
+            self._snapshot = snapshot.apply(self._journal) if self._journal else snapshot
+            self._pending = []
+            self._journal = None
+            self._fingerprint = fingerprint
+            self._loaded_at = time.monotonic()
+            self.loaded = True
+        logger.info(f"Loaded {len(rows)} characters into the catalog")
+        return self
+
+    def ensure_loaded(self) -> "CharacterCatalog":
+        """Load the catalog on first use."""
+        if not self.loaded:
+            self.load()
+        return self
+
+    def refresh(self, max_age: float = CATALOG_MAX_AGE) -> bool:
+        """
+        Reload the catalog if characters were added to the table since the last load (by
+        another process, or by this one), or if it was loaded more than `max_age` seconds ago.
+        Checking costs one aggregate query. Blocking; run it in a worker thread.
+
+        Returns:
+            True if the catalog was reloaded.
+        """
+        if self.loaded and time.monotonic() - self._loaded_at < max_age \
+                and self._table_fingerprint() == self._fingerprint:
+            return False
+        self.load()
+        return True
+
+    def replace(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Swap in a catalog built from the given rows."""
+        snapshot = _CatalogSnapshot(rows)
+        with self._lock:
+            self._snapshot = snapshot
+            self._pending = []
+            self.loaded = True
+
+    def upsert(self, *characters: Dict[str, Any]) -> None:
+        """
+        Change notification: add or update characters.
+
+        Args:
+            *characters: Character rows with at least `character_id` and `name` (only
+                `character_id` for characters already in the catalog).
+        """
+        self._change([("upsert", character) for character in characters])
+
+    def remove(self, *character_ids: str) -> None:
+        """Change notification: drop characters from the catalog."""
+        self._change([("remove", character_id) for character_id in character_ids])
+
+    def __len__(self) -> int:
+        return len(self._current().by_id)
+
+    def __contains__(self, character_id: str) -> bool:
+        return character_id in self._current().by_id
+
+    def names(self) -> Set[str]:
+        """Case-folded names of every character."""
+        return set(self._current().by_folded)
+
+    def get(self, character_id: str) -> Optional[Dict[str, Any]]:
+        """Get a character by ID."""
+        return self._current().by_id.get(character_id)
+
+    def find_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get a character by exact name, falling back to a case-insensitive match."""
+        snapshot = self._current()
+        character_id = snapshot.by_name.get(name) or snapshot.by_folded.get(name.strip().casefold())
+        return snapshot.by_id.get(character_id) if character_id else None
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Characters whose name starts with `prefix` (case-insensitive), alphabetically.
+
+        Args:
+            prefix: The typed part of the name.
+            limit: Maximum number of results.
+        """
+        snapshot = self._current()
+        folded = prefix.strip().casefold()
+        start = bisect.bisect_left(snapshot.sorted_folded, folded)
+        results = []
+        for name in snapshot.sorted_folded[start:start + limit]:
+            if not name.startswith(folded):
+                break
+            results.append(snapshot.by_id[snapshot.by_folded[name]])
+        return results
+
+    def fuzzy(self, query: str, limit: int = 5, min_score: float = 0.3) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Characters with names similar to `query`, by trigram Jaccard similarity.
+
+        Args:
+            query: The (possibly misspelled) name.
+            limit: Maximum number of results.
+            min_score: Minimum similarity in [0, 1].
+
+        Returns:
+            (character, score) pairs, best first.
+        """
+        snapshot = self._current()
+        grams = _trigrams(query.strip().casefold())
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for character_id in snapshot.trigrams.get(gram, ()):
+                shared[character_id] += 1
+
+        scored = []
+        for character_id, count in shared.items():
+            name_grams = len(_trigrams(snapshot.by_id[character_id]["name"].casefold()))
+            score = count / (len(grams) + name_grams - count)
+            if score >= min_score:
+                scored.append((snapshot.by_id[character_id], score))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+
+    def resolve(self, text: str, suggestions: int = 5) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Resolve user input to a character: an ID, an exact or case-insensitive name,
+        or a prefix matching exactly one name.
+
+        Args:
+            text: What the user typed.
+            suggestions: Maximum number of suggestions when nothing matches unambiguously.
+
+        Returns:
+            (character, []) on a match, otherwise (None, suggested characters).
+        """
+        text = text.strip()
+        character = self.get(text) or self.find_by_name(text)
+        if character:
+            return character, []
+
+        candidates = self.complete(text, limit=suggestions)
+        if len(candidates) == 1:
+            return candidates[0], []
+        if candidates:
+            return None, candidates
+        return None, [character for character, _ in self.fuzzy(text, limit=suggestions)]
+
+
+_catalog = CharacterCatalog()
+
+
+def get_character_catalog() -> CharacterCatalog:
+    """Get the process-wide character catalog (not loaded until `load`/`ensure_loaded` is called)."""
+    return _catalog
@@ -1,9 +1,54 @@
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import re
 import uuid
-from typing import Optional, List, Union, Dict
+from contextlib import asynccontextmanager
+from typing import Optional, List, Union, Dict, Any, AsyncIterator, BinaryIO, Tuple
 
-from utils.ChatContext import ChatContext
-from utils.MySQLHandler import get_db_handler, MySQLHandler
+import mysql.connector
+
+from utils.ChatContext import ChatContext, MessageHistory
+from utils.MySQLHandler import get_db_handler, MySQLHandler, UnitOfWork
 from chatgame.validations import *
+from chatgame.sharding import locate_session, remember_session
+from chatgame.catalog import CATALOG_COLUMNS, get_character_catalog
+from chatgame.retrieval import get_vector_store, index_after_commit, embed_query, relevant_message_ids
+from chatgame import sessions, prefetch, points
+
+DUPLICATE_ENTRY = 1062  # MySQL error code for a unique key violation
+
+# InnoDB full-text settings the search terms must agree with: words shorter than
+# innodb_ft_min_token_size and words on the stopword list are not indexed, so requiring
+# one of them (`+the*`) would make every search containing it return nothing
+FULLTEXT_MIN_TOKEN_SIZE = int(os.getenv("FULLTEXT_MIN_TOKEN_SIZE", "3"))
+FULLTEXT_STOPWORDS = frozenset((  # INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD
+    "a", "about", "an", "are", "as", "at", "be", "by", "com", "de", "en", "for", "from", "how", "i", "in", "is",
+    "it", "la", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "who", "will",
+    "with", "und", "www"))
+
+
+@asynccontextmanager
+async def turn() -> AsyncIterator[UnitOfWork]:
+    """
+    Run every chatgame call in the block on one pooled connection and one transaction.
+
+    Usage:
+        async with chatgame.turn():
+            user_id = await chatgame.get_user_id(discord_id)
+            ...
+
+    The writes are committed when the block exits and rolled back if it raises.
+    Keep slow work (such as LLM calls) outside the block so the connection and any
+    row locks are not held while waiting.
+
+    Yields:
+        The active unit of work.
+    """
+    with get_db_handler().unit_of_work() as unit:
+        yield unit
 
 
 async def get_user_id(discord_id: str) -> str:
@@ -16,16 +61,43 @@ async def get_user_id(discord_id: str) -> str:
     Returns:
         The user ID (UUID string).
 
+    Raises:
+        UserNotFoundError: If the user is not found in the database.
+    """
+    # Cached for a short while, also for unregistered users (an empty user ID)
+    user_id = prefetch.cached_user_id(discord_id)
+    if user_id is None:
+        db = get_db_handler()
+        result = db.fetch_one(
+            "SELECT user_id FROM User WHERE discord_id = %s", (discord_id,))
+        user_id = result["user_id"] if result else ""
+        prefetch.remember_user_id(discord_id, user_id)
+
+    if not user_id:
+        raise UserNotFoundError("User not found")
+    return user_id
+
+
+async def is_admin(user_id: str) -> bool:
+    """
+    Check whether a user is an administrator of the bot.
+
+    Args:
+        user_id: The ID of the user.
+
+    Returns:
+        True if the user's `is_admin` flag is set.
+
     Raises:
         UserNotFoundError: If the user is not found in the database.
     """
     db = get_db_handler()
     result = db.fetch_one(
-        "SELECT user_id FROM User WHERE discord_id = %s", (discord_id,))
+        "SELECT is_admin FROM User WHERE user_id = %s", (user_id,))
     if result is None:
         raise UserNotFoundError("User not found")
 
-    return result["user_id"]
+    return bool(result["is_admin"])
 
 
 async def register_user(discord_id: str, username: str) -> None:
@@ -57,72 +129,59 @@ async def register_user(discord_id: str, username: str) -> None:
 
     # Validate the user was created correctly
     validate_user_id(uid)
+    prefetch.forget_user_id(discord_id)
+
+
+def _recent_limit() -> int:
+    """Size of the recent message window. With retrieval enabled the window is short and
+    relevant older messages are added on top of it."""
+    if get_vector_store() is not None:
+        return ChatContext.chatContextRecentWindow
+    return ChatContext.chatContextMaximumMessageLength
 
 
-async def get_chat_context(session_id) -> ChatContext:
+async def load_context_parts(user_id: str, character_id: str, session_id: str) -> Dict[str, Any]:
     """
-    Get the chat context for a user and character in a particular session.
+    Load the parts of a chat context that don't depend on the latest user message.
 
     Args:
+        user_id: The ID of the session owner.
+        character_id: The ID of the session character.
         session_id: The ID of the session.
 
     Returns:
-        The ChatContext object containing all relevant session data.
-
-    Raises:
-        SessionNotFoundError: If the session is not found in the database.
+        A dictionary with `session_id`, `recent` (the recent message window, most recent
+        first), `memory`, `character_settings`, `affinity`, `user_character_settings` and
+        `authors` (user ID -> author prefix of their messages).
     """
-    db = get_db_handler()
-    validate_session_id(session_id)
-
-    # Get user_id and character_id from database for given session_id
-    result = db.fetch_one(
-        "SELECT * FROM Chat_Session WHERE session_id = %s", (session_id,))
-    if result is None:
-        raise SessionNotFoundError("Session not found")
-
-    character_id = result["character_id"]
-    user_id = result["user_id"]
+    # Sessions, messages, memory, affinity and customizations live on the user's shard
+    shard = get_db_handler().for_user(user_id)
 
-    # Get message history from database for given session_id (most recent first)
-    message_history = []
-    result = db.fetch_all(
+    # Get the recent window of message history for given session_id (most recent first)
+    recent = shard.fetch_all(
         "SELECT * FROM Message WHERE session_id = %s ORDER BY timestamp DESC LIMIT %s",
-        (session_id, ChatContext.chatContextMaximumMessageLength))
-    for message in result:
-        role = "user" if message["from_user"] else "assistant"
-        if role == "user":
-            user_id = message["from_user"]
-            user_name = await get_username(user_id)
-            message_history.append({
-                "role"   : role,
-                "content": f"{user_name}<{user_id}>\n" + message["content"]
-            })
-        else:
-            message_history.append({
-                "role"   : role,
-                "content": message["content"]
-            })
+        (session_id, _recent_limit()))
 
     # Get memory (long-term context) from database
-    result = db.fetch_one(
+    result = shard.fetch_one(
         "SELECT summary_text FROM Memory WHERE user_id = %s AND character_id = %s",
         (user_id, character_id))
     memory = result["summary_text"] if result else ""
 
-    # Get character configuration from database
-    result = db.fetch_one(
-        "SELECT settings FROM Virtual_Character WHERE character_id = %s", (character_id,))
-    character_settings = result["settings"] if result else ""
+    # Get character configuration from the catalog
+    try:
+        character_settings = (await get_character_info(character_id))["settings"] or ""
+    except CharacterNotFoundError:
+        character_settings = ""
 
     # Get affinity level (relationship value) from database
-    result = db.fetch_one(
+    result = shard.fetch_one(
         "SELECT value FROM Affinity WHERE user_id = %s AND character_id = %s",
         (user_id, character_id))
     affinity = result["value"] if result else 50  # Default affinity is 50
 
     # Get user-specific character customizations from database
-    result = db.fetch_one(
+    result = shard.fetch_one(
         "SELECT attribute, value FROM Customization WHERE user_id = %s AND character_id = %s",
         (user_id, character_id))
     user_character_settings = []
@@ -133,23 +192,148 @@ async def get_chat_context(session_id) -> ChatContext:
                 "value"    : user_settings["value"]
             })
 
+    return {
+        "session_id"             : session_id,
+        "recent"                 : recent,
+        "memory"                 : memory,
+        "character_settings"     : character_settings,
+        "affinity"               : affinity,
+        "user_character_settings": user_character_settings,
+        "authors"                : {user_id: f"{await get_username(user_id)}<{user_id}>\n"},
+    }
+
+
+async def get_chat_context(session_id, query_vector=None) -> ChatContext:
+    """
+    Get the chat context for a user and character in a particular session.
+    Parts prefetched by `prefetch_context` are reused; only the messages stored since are read.
+
+    Args:
+        session_id: The ID of the session.
+        query_vector: The latest user message embedded by `embed_query`, before the turn's
+            transaction started. Without it the message is embedded here, inside the transaction.
+
+    Returns:
+        The ChatContext object containing all relevant session data.
+
+    Raises:
+        SessionNotFoundError: If the session is not found in the database.
+    """
+    db = get_db_handler()
+
+    # Get user_id and character_id for given session_id (cached after the first lookup)
+    owner = locate_session(session_id)
+    if owner is None:
+        raise SessionNotFoundError("Session not found")
+
+    user_id, character_id = owner
+    shard = db.for_user(user_id)
+
+    parts = prefetch.cached_context(user_id, character_id, session_id)
+    prefetched = parts is not None
+    if parts is None:
+        parts = await load_context_parts(user_id, character_id, session_id)
+        recent = parts["recent"]
+    else:
+        # Add the messages stored since the prefetch (including this turn's own, uncommitted
+        # ones) to the prefetched window. Timestamps have second precision, so messages of the
+        # newest prefetched second are read again and skipped by ID.
+        recent = parts["recent"]
+        newer = shard.fetch_all(
+            "SELECT * FROM Message WHERE session_id = %s AND timestamp >= %s ORDER BY timestamp DESC LIMIT %s",
+            (session_id, recent[0]["timestamp"] if recent else datetime.datetime.min, _recent_limit()))
+        known = {message["message_id"] for message in recent}
+        recent = ([message for message in newer if message["message_id"] not in known] + recent)[:_recent_limit()]
+
+    # Get older messages of this user and character relevant to the latest user message
+    latest_user_message = next((message["content"] for message in recent if message["from_user"]), "")
+    relevant_ids = await relevant_message_ids(
+        user_id, character_id, latest_user_message, ChatContext.chatContextRetrievalTopK,
+        exclude=[message["message_id"] for message in recent], query_vector=query_vector)
+    relevant = []
+    if relevant_ids:
+        relevant = shard.fetch_all(
+            f"SELECT * FROM Message WHERE message_id IN ({', '.join(['%s'] * len(relevant_ids))})",
+            tuple(relevant_ids))
+
+    # Build the history oldest first: relevant older messages, then the recent window
+    message_history = MessageHistory(max_length=ChatContext.chatContextMaximumMessageLength)
+    authors = parts["authors"]
+    for message in sorted(relevant, key=lambda m: m["timestamp"]) + list(reversed(recent)):
+        author_id = message["from_user"]
+        if author_id:
+            if author_id not in authors:
+                authors[author_id] = f"{await get_username(author_id)}<{author_id}>\n"
+            message_history.append("user", message["content"], author=authors[author_id])
+        else:
+            message_history.append("assistant", message["content"])
+
+    # Summary of the earlier sessions, carried over when the previous one was rotated out
+    session_summary = sessions.session_summary(user_id, character_id, session_id)
+
     # Create and return chat context with all gathered information
     chat_context = ChatContext(
         user_id=user_id,
         character_id=character_id,
         message_history=message_history,
-        memory=memory,
-        affinity=affinity,
-        character_settings=character_settings,
-        user_character_settings=user_character_settings
+        memory=parts["memory"],
+        session_summary=session_summary,
+        affinity=parts["affinity"],
+        character_settings=parts["character_settings"],
+        user_character_settings=parts["user_character_settings"],
+        prefetched=prefetched
     )
 
     return chat_context
 
 
+def prefetch_context(discord_id: str) -> bool:
+    """
+    Warm the data the next chat turn of a Discord user reads, in the background: their user ID,
+    current character, active session and the context parts of that session (see
+    `load_context_parts`). Called when the user is about to chat, e.g. right after `!select`
+    or when they start typing. Results are cached for PREFETCH_TTL_SECONDS.
+
+    Args:
+        discord_id: The Discord ID of the user.
+
+    Returns:
+        True if a prefetch was started, False if one is already running for the user.
+    """
+    async def run():
+        async with turn():
+            try:
+                user_id = await get_user_id(discord_id)
+            except UserNotFoundError:
+                return
+            seen_version = prefetch.version(user_id)
+
+            character_id = await get_current_character(user_id)
+            if character_id is None:
+                return
+
+            state = sessions.cached_active_session(user_id, character_id)
+            if state is None:
+                state = sessions.load_active_session(user_id, character_id)
+            # A new session is started (and written) by the turn itself
+            if state is None or sessions.needs_rotation(state):
+                return
+            session_id = state["session_id"]
+            remember_session(session_id, user_id, character_id)
+
+            if prefetch.has_context(user_id, character_id, session_id):
+                return
+            parts = await load_context_parts(user_id, character_id, session_id)
+            prefetch.remember_context(user_id, character_id, parts, seen_version)
+
+    return prefetch.schedule(discord_id, run)
+
+
 async def get_latest_session(user_id: str, character_id: str) -> str:
     """
-    Find the latest session ID for a user and character or create a new one if none exists.
+    Find the active session ID for a user and character, or create a new one if none exists.
+    The active session is rotated out (and a new one started, carrying a summary of it) once it
+    has been idle too long or holds too many messages or tokens.
 
     Args:
         user_id: The ID of the user.
@@ -162,37 +346,71 @@ async def get_latest_session(user_id: str, character_id: str) -> str:
         UserNotFoundError: If the user is not found in the database.
         CharacterNotFoundError: If the character is not found in the database.
     """
-    db = get_db_handler()
-    validate_user_id(user_id)
-    validate_character_id(character_id)
-
-    result = db.fetch_one(
-        "SELECT session_id FROM Chat_Session WHERE user_id = %s AND character_id = %s ORDER BY start_time DESC LIMIT 1",
-        (user_id, character_id))
+    # The active session is cached per user and character, so the usual case needs no query
+    state = sessions.cached_active_session(user_id, character_id)
+    if state is None:
+        validate_user_id(user_id)
+        validate_character_id(character_id)
+        state = sessions.load_active_session(user_id, character_id)
 
-    if result is None:
+    if state is None:
         # Create a new session if none exists
         return await create_new_session(user_id, character_id)
 
-    return result['session_id']
+    if sessions.needs_rotation(state):
+        return await create_new_session(user_id, character_id, previous_session_id=state["session_id"],
+                                        previous_summary=state["summary"])
+
+    remember_session(state['session_id'], user_id, character_id)
+    return state['session_id']
 
 
-async def create_new_session(user_id: str, character_id: str) -> str:
+async def create_new_session(user_id: str, character_id: str, previous_session_id: Optional[str] = None,
+                             previous_summary: str = "") -> str:
     """
-    Create a new chat session for a user and character.
-    :param user_id:
-    :param character_id:
-    :return:
+    Create a new chat session for a user and character and make it the active one.
+
+    Args:
+        user_id: The ID of the user.
+        character_id: The ID of the character.
+        previous_session_id: The session being rotated out, if any. It is marked inactive and
+            the new session starts with a summary of it, written in the same transaction (and
+            improved in the background when SESSION_SUMMARIZER is not the default).
+        previous_summary: The summary that was carried into the previous session.
+
+    Returns:
+        The ID of the new session.
+
+    Raises:
+        UserNotFoundError: If the user is not found in the database.
+        CharacterNotFoundError: If the character is not found in the database.
     """
     db = get_db_handler()
     validate_user_id(user_id)
     validate_character_id(character_id)
+    shard = db.for_user(user_id)
+
+    # Close the previous sessions; only the newest one is active
+    shard.execute(
+        "UPDATE Chat_Session SET is_active = FALSE WHERE user_id = %s AND character_id = %s AND is_active = TRUE",
+        (user_id, character_id))
+
+    # Carry the closed session over, so this very turn's context already has its summary
+    summary, closed_messages = "", []
+    if previous_session_id is not None:
+        summary, closed_messages = await sessions.closing_summary(user_id, previous_session_id, previous_summary)
 
     # Create a new session
     sid = str(uuid.uuid4())
-    db.execute(
-        "INSERT INTO Chat_Session (session_id, user_id, character_id) VALUES (%s, %s, %s)",
-        (sid, user_id, character_id))
+    shard.execute(
+        "INSERT INTO Chat_Session (session_id, user_id, character_id, summary) VALUES (%s, %s, %s, %s)",
+        (sid, user_id, character_id, summary or None))
+    remember_session(sid, user_id, character_id)
+    sessions.remember_active_session(user_id, character_id, sid, summary)
+
+    if previous_session_id is not None:
+        sessions.schedule_summary(user_id, character_id, previous_session_id, sid, previous_summary,
+                                  closed_messages)
     return sid
 
 
@@ -214,13 +432,15 @@ async def update_affinity(user_id: str, character_id: str, affinity: int) -> Non
     validate_character_id(character_id)
 
     # Try to update existing record, if none exists, create a new one
-    rows_affected = db.execute(
+    shard = db.for_user(user_id)
+    rows_affected = shard.execute(
         "UPDATE Affinity SET value = %s WHERE user_id = %s AND character_id = %s",
         (affinity, user_id, character_id))
     if rows_affected == 0:
-        db.execute(
+        shard.execute(
             "INSERT INTO Affinity (user_id, character_id, value) VALUES (%s, %s, %s)",
             (user_id, character_id, affinity))
+    prefetch.invalidate(user_id)
 
 
 async def update_memory(user_id: str, character_id: str, memory: str) -> None:
@@ -241,13 +461,15 @@ async def update_memory(user_id: str, character_id: str, memory: str) -> None:
     validate_character_id(character_id)
 
     # Try to update existing record, if none exists, create a new one
-    rows_affected = db.execute(
+    shard = db.for_user(user_id)
+    rows_affected = shard.execute(
         "UPDATE Memory SET summary_text = %s WHERE user_id = %s AND character_id = %s",
         (memory, user_id, character_id))
     if rows_affected == 0:
-        db.execute(
+        shard.execute(
             "INSERT INTO Memory (user_id, character_id, summary_text) VALUES (%s, %s, %s)",
             (user_id, character_id, memory))
+    prefetch.invalidate(user_id)
 
 
 async def get_current_character(user_id: str) -> Optional[str]:
@@ -260,12 +482,19 @@ async def get_current_character(user_id: str) -> Optional[str]:
     Returns:
         The character ID of the most recently interacted character, or None if no interactions.
     """
+    try:
+        return prefetch.cached_current_character(user_id)
+    except KeyError:
+        pass
+
+    seen_version = prefetch.version(user_id)
     db = get_db_handler()
     result = db.fetch_one(
         "SELECT current_character FROM User WHERE user_id = %s",
         (user_id,))
     if result is None:
         return None
+    prefetch.remember_current_character(user_id, result["current_character"], seen_version)
     return result["current_character"]
 
 
@@ -289,6 +518,7 @@ async def change_current_character(user_id: str, character_id: str) -> None:
     db.execute(
         "UPDATE User SET current_character = %s WHERE user_id = %s",
         (character_id, user_id))
+    prefetch.invalidate(user_id)
 
 
 async def get_created_characters(user_id: str) -> List[str]:
@@ -329,19 +559,15 @@ async def get_character_history(user_id: str) -> List[Dict[str, str]]:
 
     for char in result:
         try:
-            validate_character_id(char["character_id"])
+            character = await get_character_info(char["character_id"])
         except CharacterNotFoundError:  # Changed from UserNotFoundError which seems wrong
             continue
 
-        character_name = db.fetch_one(
-            "SELECT name FROM Virtual_Character WHERE character_id = %s", (char["character_id"],))
-
-        if character_name:
-            c = {
-                "name"        : character_name["name"],
-                "character_id": char["character_id"]
-            }
-            chars.append(c)
+        c = {
+            "name"        : character["name"],
+            "character_id": char["character_id"]
+        }
+        chars.append(c)
 
     return chars
 
@@ -359,12 +585,52 @@ async def get_points_balance(user_id: str) -> int:
     Raises:
         UserNotFoundError: If the user is not found in the database.
     """
-    db = get_db_handler()
-    validate_user_id(user_id)
+    # The snapshot in User.points_balance plus the transfers not compacted into it yet
+    result = points.balance(user_id)
+    if result is None:
+        raise UserNotFoundError("User ID not found in database")
+    return result
 
-    result = db.fetch_one(
-        "SELECT points_balance FROM User WHERE user_id = %s", (user_id,))
-    return result["points_balance"]
+
+async def transfer_points(sender_id: str, receiver_id: str, amount: int) -> str:
+    """
+    Move points from one user to another and record the transaction.
+
+    Args:
+        sender_id: The ID of the paying user.
+        receiver_id: The ID of the receiving user.
+        amount: Number of points, positive.
+
+    Returns:
+        The ID of the transaction.
+
+    Raises:
+        UserNotFoundError: If either user is not found in the database.
+        InsufficientPointsError: If the sender's balance is lower than `amount`.
+        ValueError: If `amount` is not positive or both users are the same.
+    """
+    validate_user_id(sender_id)
+    validate_user_id(receiver_id)
+    return points.transfer(sender_id, receiver_id, amount)
+
+
+async def grant_points(user_id: str, amount: int) -> str:
+    """
+    Pay points out to a user from the System user.
+
+    Args:
+        user_id: The ID of the receiving user.
+        amount: Number of points, positive.
+
+    Returns:
+        The ID of the transaction.
+
+    Raises:
+        UserNotFoundError: If the user is not found in the database.
+        ValueError: If `amount` is not positive.
+    """
+    validate_user_id(user_id)
+    return points.transfer(points.SYSTEM_USER_ID, user_id, amount)
 
 
 async def get_points_history(origin_user_id: str) -> List[Dict[str, str]]:
@@ -383,25 +649,16 @@ async def get_points_history(origin_user_id: str) -> List[Dict[str, str]]:
     """
     db = get_db_handler()
     validate_user_id(origin_user_id)
-    history = []
 
-    result = db.fetch_all(
+    # Stream the rows straight into the result instead of materializing them twice
+    return [{
+        "sender_id"  : transaction["sender_id"],
+        "receiver_id": transaction["receiver_id"],
+        "amount"     : transaction["amount"],
+        "time"       : transaction["time"]
+    } for transaction in db.fetch_iter(
         "SELECT sender_id, receiver_id, amount, time FROM Transaction WHERE sender_id = %s ORDER BY time DESC",
-        (origin_user_id,))
-    if result is None:
-        return []
-    else:
-        for transaction in result:
-            t = {
-                "sender_id"  : transaction["sender_id"],
-                "receiver_id": transaction["receiver_id"],
-                "amount"     : transaction["amount"],
-                "time"       : transaction["time"]
-            }
-
-            history.append(t)
-
-    return history
+        (origin_user_id,))]
 
 
 async def get_character_info(character_id: str) -> Dict[str, Union[str, int]]:
@@ -417,13 +674,15 @@ async def get_character_info(character_id: str) -> Dict[str, Union[str, int]]:
     Raises:
         CharacterNotFoundError: If the character is not found in the database.
     """
-    db = get_db_handler()
-    validate_character_id(character_id)
-
-    result = db.fetch_one(
-        "SELECT * FROM Virtual_Character WHERE character_id = %s", (character_id,))
+    catalog = get_character_catalog()
+    result = catalog.get(character_id)
     if result is None:
-        raise CharacterNotFoundError("Character not found")
+        # Not in the catalog yet (e.g. created by another process), so look it up and remember it
+        result = get_db_handler().fetch_one(
+            f"SELECT {CATALOG_COLUMNS} FROM Virtual_Character WHERE character_id = %s", (character_id,))
+        if result is None:
+            raise CharacterNotFoundError("Character not found")
+        catalog.upsert(result)
 
     return {
         "name"         : result["name"],
@@ -435,7 +694,22 @@ async def get_character_info(character_id: str) -> Dict[str, Union[str, int]]:
     }
 
 
-async def create_new_message(session_id: str, content: str, author_id: str, from_user: bool) -> None:
+async def find_character(query: str, suggestions: int = 5) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Find a character by ID or name using the in-memory catalog.
+
+    Args:
+        query: A character ID, a full name (any case) or the start of a name.
+        suggestions: Maximum number of similar characters to suggest when nothing matches.
+
+    Returns:
+        (character, []) when the query identifies one character, otherwise (None, suggestions).
+    """
+    return get_character_catalog().ensure_loaded().resolve(query, suggestions=suggestions)
+
+
+async def create_new_message(session_id: str, content: str, author_id: str, from_user: bool,
+                             discord_message_id: Optional[str] = None) -> None:
     """
     Create a new message in the database.
 
@@ -443,21 +717,43 @@ async def create_new_message(session_id: str, content: str, author_id: str, from
         session_id: The ID of the chat session.
         content: The content of the message.
         from_user: Whether the message is from the user or the character.
+        discord_message_id: The ID of the Discord message this was stored from, if any.
+            Storing the same Discord message twice is rejected.
 
     Raises:
         SessionNotFoundError: If the session is not found in the database.
+        DuplicateMessageError: If a message with the same Discord message ID is already stored.
     """
     db = get_db_handler()
-    validate_session_id(session_id)
+    owner = locate_session(session_id)
+    if owner is None:
+        raise SessionNotFoundError("Session ID not found in database")
+    user_id, character_id = owner
 
     if not from_user:
         author_id = None
 
     # Insert new message into the database
     msgid = str(uuid.uuid4())
-    db.execute(
-        "INSERT INTO Message (session_id, message_id, from_user, content) VALUES (%s, %s, %s, %s)",
-        (session_id, msgid, author_id if author_id is not None else None, content))
+    try:
+        db.for_user(user_id).execute(
+            "INSERT INTO Message (session_id, message_id, from_user, content, discord_message_id) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            (session_id, msgid, author_id if author_id is not None else None, content, discord_message_id))
+    except mysql.connector.errors.IntegrityError as e:
+        if e.errno == DUPLICATE_ENTRY and discord_message_id is not None and "discord_message_id" in str(e):
+            raise DuplicateMessageError(f"Discord message {discord_message_id} is already stored") from e
+        raise
+
+    # Count the message towards the session's rotation thresholds
+    tokens = sessions.record_message(user_id, character_id, session_id, content)
+    db.for_user(user_id).execute(
+        "UPDATE Chat_Session SET message_count = message_count + 1, token_count = token_count + %s, "
+        "last_active = CURRENT_TIMESTAMP WHERE session_id = %s",
+        (tokens, session_id))
+
+    # Make the message retrievable by relevance in later turns, once committed
+    index_after_commit(user_id, character_id, msgid, content)
 
 
 async def get_username(user_id):
@@ -482,3 +778,128 @@ async def get_username(user_id):
         raise UserNotFoundError("User not found")
 
     return result["username"]
+
+
+def _fulltext_query(terms: str) -> str:
+    """
+    Boolean mode query requiring every searchable word of `terms`, with prefix matches.
+    Operator characters are dropped, and so are words the full-text index leaves out.
+    Empty if no searchable word is left.
+    """
+    words = [word for word in re.findall(r"\w+", terms)
+             if len(word) >= FULLTEXT_MIN_TOKEN_SIZE and word.casefold() not in FULLTEXT_STOPWORDS]
+    return " ".join(f"+{word}*" for word in words)
+
+
+async def search_messages(user_id: str, terms: str, page: int = 1, page_size: int = 10) -> Dict[str, Any]:
+    """
+    Full-text search over the messages of all sessions owned by a user.
+
+    Every word has to appear in a message (prefix matches allowed), except stopwords and
+    words too short for the full-text index, which are ignored; results are ordered by
+    relevance, then by recency. Uses the FULLTEXT index on `Message.content`.
+
+    Args:
+        user_id: The ID of the user whose sessions are searched.
+        terms: The search terms.
+        page: 1-based page number.
+        page_size: Number of results per page.
+
+    Returns:
+        A dictionary with the page number, a `has_more` flag and a list of `results`, each
+        containing session_id, character_id, from_user, content and timestamp.
+
+    Raises:
+        UserNotFoundError: If the user is not found in the database.
+    """
+    db = get_db_handler()
+    validate_user_id(user_id)
+
+    query = _fulltext_query(terms)
+    if not query:
+        return {"page": page, "has_more": False, "results": []}
+
+    page = max(1, page)
+    result = db.for_user(user_id).fetch_all(
+        """SELECT m.session_id, s.character_id, m.from_user, m.content, m.timestamp
+           FROM Message m
+           JOIN Chat_Session s ON s.session_id = m.session_id
+           WHERE s.user_id = %s AND MATCH (m.content) AGAINST (%s IN BOOLEAN MODE)
+           ORDER BY MATCH (m.content) AGAINST (%s IN BOOLEAN MODE) DESC, m.timestamp DESC
+           LIMIT %s OFFSET %s""",
+        (user_id, query, query, page_size + 1, (page - 1) * page_size))
+
+    return {
+        "page"    : page,
+        "has_more": len(result) > page_size,
+        "results" : [{
+            "session_id"  : message["session_id"],
+            "character_id": message["character_id"],
+            "from_user"   : message["from_user"],
+            "content"     : message["content"],
+            "timestamp"   : message["timestamp"]
+        } for message in result[:page_size]]
+    }
+
+
+async def export_user_history(user_id: str, fileobj: BinaryIO, batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Write all sessions and messages of a user as gzip-compressed JSON lines.
+
+    Each session is written as a `{"type": "session", ...}` line followed by its messages as
+    `{"type": "message", ...}` lines, oldest first. Rows are streamed from the database in
+    batches and compressed as they arrive, so memory use does not grow with the history size.
+
+    Args:
+        user_id: The ID of the user to export.
+        fileobj: Binary file object the compressed export is written to.
+        batch_size: Number of rows read from the database at a time.
+
+    Returns:
+        The number of exported sessions and messages.
+
+    Raises:
+        UserNotFoundError: If the user is not found in the database.
+    """
+    db = get_db_handler()
+    validate_user_id(user_id)
+
+    counts = {"sessions": 0, "messages": 0}
+    current_session = None
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as out:
+        for rows in db.for_user(user_id).fetch_batches(
+                """SELECT s.session_id, s.character_id, s.is_active, s.start_time, s.summary,
+                          m.message_id, m.from_user, m.content, m.timestamp
+                   FROM Chat_Session s
+                   LEFT JOIN Message m ON m.session_id = s.session_id
+                   WHERE s.user_id = %s
+                   ORDER BY s.start_time, s.session_id, m.timestamp""",
+                (user_id,), batch_size):
+            lines = []
+            for row in rows:
+                if row["session_id"] != current_session:
+                    current_session = row["session_id"]
+                    counts["sessions"] += 1
+                    lines.append({
+                        "type"        : "session",
+                        "session_id"  : row["session_id"],
+                        "character_id": row["character_id"],
+                        "is_active"   : bool(row["is_active"]),
+                        "start_time"  : row["start_time"],
+                        "summary"     : row["summary"]
+                    })
+                if row["message_id"] is not None:
+                    counts["messages"] += 1
+                    lines.append({
+                        "type"      : "message",
+                        "session_id": row["session_id"],
+                        "message_id": row["message_id"],
+                        "from_user" : row["from_user"] is not None,
+                        "content"   : row["content"],
+                        "timestamp" : row["timestamp"]
+                    })
+            out.write("".join(json.dumps(line, default=str) + "\n" for line in lines).encode())
+            # Let other handlers run between batches
+            await asyncio.sleep(0)
+
+    return counts
@@ -12,4 +12,18 @@ class SessionNotFoundError(Exception):
 
 class UserAlreadyExistsError(Exception):
     """Custom exception for user already exists in the database."""
-    pass
\ No newline at end of file
+    pass
+
+class DuplicateMessageError(Exception):
+    """Custom exception for a Discord message that was already stored in the database."""
+    pass
+
+
+class InsufficientPointsError(Exception):
+    """Custom exception for a points transfer exceeding the sender's balance."""
+    pass
+
+
+class InvalidCharacterPackError(Exception):
+    """Custom exception for a character pack that can't be read or has invalid records."""
+    pass
@@ -0,0 +1,243 @@
+import datetime
+import json
+import logging
+import os
+import re
+import uuid
+from contextlib import nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO, Tuple, Union
+
+import mysql.connector
+
+from utils.MySQLHandler import get_db_handler, run_after_commit
+from chatgame.exceptions import InvalidCharacterPackError
+from chatgame.catalog import get_character_catalog
+from chatgame.points import SYSTEM_USER_ID
+
+logger = logging.getLogger("chatgame.packs")
+
+PACK_FORMATS = {".jsonl": "jsonl", ".ndjson": "jsonl", ".yaml": "yaml", ".yml": "yaml"}
+CONFLICT_MODES = ("error", "skip", "update")
+
+REQUIRED_FIELDS = ("name", "description", "settings")
+OPTIONAL_FIELDS = ("character_id",)
+MAX_NAME_LENGTH = 100  # Virtual_Character.name is a VARCHAR(100)
+MAX_ERRORS = 20  # Problems collected before the import stops reading
+
+_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def pack_format(path: str) -> str:
+    """
+    The format of a character pack file, from its extension.
+
+    Raises:
+        InvalidCharacterPackError: If the extension is not a supported one.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in PACK_FORMATS:
+        raise InvalidCharacterPackError(f"Unsupported character pack {path}, expected one of {', '.join(PACK_FORMATS)}")
+    return PACK_FORMATS[extension]
+
+
+def read_pack(stream: TextIO, fmt: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Stream the records of a character pack without loading the whole file.
+
+    JSON Lines packs hold one character object per line (blank lines are skipped). YAML packs
+    are a stream of documents separated by `---`, each one character mapping or a list of them.
+
+    Args:
+        stream: The pack, opened as text.
+        fmt: "jsonl" or "yaml".
+
+    Yields:
+        (position, record) pairs, the position being e.g. "line 12" for error messages.
+
+    Raises:
+        InvalidCharacterPackError: If the file can't be parsed, or PyYAML is missing for a YAML pack.
+    """
+    if fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield f"line {number}", json.loads(line)
+            except json.JSONDecodeError as e:
+                raise InvalidCharacterPackError(f"line {number}: invalid JSON ({e.msg})") from e
+        return
+
+    try:
+        import yaml
+    except ImportError as e:
+        raise InvalidCharacterPackError("YAML character packs need PyYAML (pip install pyyaml)") from e
+    try:
+        for number, document in enumerate(yaml.safe_load_all(stream), 1):
+            if isinstance(document, list):
+                for index, record in enumerate(document, 1):
+                    yield f"document {number} item {index}", record
+            elif document is not None:
+                yield f"document {number}", document
+    except yaml.YAMLError as e:
+        raise InvalidCharacterPackError(f"invalid YAML: {str(e)}") from e
+
+
+def _validate(position: str, record: Any) -> Dict[str, str]:
+    """Check one record's fields, returning the cleaned character. Raises ValueError with the problem."""
+    if not isinstance(record, dict):
+        raise ValueError(f"{position}: expected an object with {', '.join(REQUIRED_FIELDS)}")
+    unknown = set(record) - set(REQUIRED_FIELDS) - set(OPTIONAL_FIELDS)
+    if unknown:
+        raise ValueError(f"{position}: unknown fields {', '.join(sorted(map(str, unknown)))}")
+
+    character = {}
+    for field in REQUIRED_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{position}: {field} must be a non-empty string")
+        character[field] = value.strip()
+    if len(character["name"]) > MAX_NAME_LENGTH:
+        raise ValueError(f"{position}: name is longer than {MAX_NAME_LENGTH} characters")
+
+    character_id = record.get("character_id")
+    if character_id is not None:
+        if not isinstance(character_id, str) or not _UUID_RE.match(character_id.lower()):
+            raise ValueError(f"{position}: character_id must be a UUID")
+        character["character_id"] = character_id.lower()
+    return character
+
+
+def import_characters(source: Union[str, TextIO], fmt: Optional[str] = None, creator_id: str = SYSTEM_USER_ID,
+                      on_conflict: str = "error", batch_size: int = 1000, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Import a character pack into `Virtual_Character`.
+
+    Records are validated while the pack is streamed: required fields, and names unique
+    (case-insensitively) within the pack and against the character catalog, using in-memory
+    sets. Valid characters are inserted with batched `executemany` calls in a single
+    transaction, so a pack is imported completely or not at all. Once committed, the catalog
+    swaps in all imported characters at once. Blocking; run it in a worker thread.
+
+    Args:
+        source: Path of a .jsonl/.yaml pack, or an open text stream (then `fmt` is required).
+        fmt: "jsonl" or "yaml"; detected from the path's extension when not given.
+        creator_id: The user recorded as creator of new characters.
+        on_conflict: What to do with characters whose name or ID already exists: "error"
+            (reject the pack), "skip" them, or "update" their description and settings.
+        batch_size: Rows per `executemany` call.
+        dry_run: Validate the whole pack without writing anything.
+
+    Returns:
+        Counts of `read`, `inserted`, `updated` and `skipped` characters.
+
+    Raises:
+        ValueError: If `on_conflict` is not supported.
+        InvalidCharacterPackError: If the pack can't be read or has invalid or conflicting
+            records; the message lists the first problems found. Nothing is imported.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"on_conflict must be one of {', '.join(CONFLICT_MODES)}")
+    if isinstance(source, str):
+        fmt = fmt or pack_format(source)
+        with open(source, encoding="utf-8") as stream:
+            try:
+                return import_characters(stream, fmt, creator_id, on_conflict, batch_size, dry_run)
+            except UnicodeDecodeError as e:
+                raise InvalidCharacterPackError("The character pack is not UTF-8 text") from e
+    if fmt not in ("jsonl", "yaml"):
+        raise InvalidCharacterPackError("The pack format must be jsonl or yaml")
+
+    catalog = get_character_catalog().ensure_loaded()
+    seen_names: Set[str] = set()
+    seen_ids: Set[str] = set()
+    errors: List[str] = []
+    imported: List[Dict[str, Any]] = []  # Rows for the catalog once committed
+    inserts: List[Tuple] = []
+    updates: List[Tuple] = []
+    result = {"read": 0, "inserted": 0, "updated": 0, "skipped": 0}
+    now = datetime.datetime.now().replace(microsecond=0)
+
+    # A dry run only needs the catalog
+    db = None if dry_run else get_db_handler()
+
+    def flush(final: bool = False) -> None:
+        if dry_run:
+            inserts.clear()
+            updates.clear()
+            return
+        if inserts and (final or len(inserts) >= batch_size):
+            try:
+                db.execute_many(
+                    "INSERT INTO Virtual_Character (character_id, name, description, settings, creator_id, "
+                    "creation_time) VALUES (%s, %s, %s, %s, %s, %s)", inserts)
+            except mysql.connector.errors.IntegrityError as e:
+                # E.g. names the database collation considers equal although they differ case-folded,
+                # or an unknown creator
+                raise InvalidCharacterPackError(f"The database rejected the characters: {e.msg}") from e
+            inserts.clear()
+        if updates and (final or len(updates) >= batch_size):
+            db.execute_many("UPDATE Virtual_Character SET description = %s, settings = %s WHERE character_id = %s",
+                            updates)
+            updates.clear()
+
+    with nullcontext() if dry_run else db.unit_of_work():
+        for position, record in read_pack(stream=source, fmt=fmt):
+            result["read"] += 1
+            try:
+                character = _validate(position, record)
+                folded = character["name"].casefold()
+                if folded in seen_names:
+                    raise ValueError(f"{position}: name {character['name']} appears twice in the pack")
+                seen_names.add(folded)
+
+                existing = catalog.find_by_name(character["name"])
+                existing_id = existing["character_id"] if existing is not None else None
+                given_id = character.get("character_id")
+                if given_id is not None:
+                    if given_id in seen_ids:
+                        raise ValueError(f"{position}: character_id {given_id} appears twice in the pack")
+                    seen_ids.add(given_id)
+                    if given_id in catalog and given_id != existing_id:
+                        raise ValueError(f"{position}: character_id {given_id} belongs to another character")
+                    if existing_id is not None and given_id != existing_id:
+                        raise ValueError(f"{position}: character {character['name']} already exists "
+                                         f"with character_id {existing_id}, not {given_id}")
+            except ValueError as e:
+                errors.append(str(e))
+                if len(errors) >= MAX_ERRORS:
+                    break
+                continue
+
+            if existing_id is not None:
+                if on_conflict == "error":
+                    errors.append(f"{position}: a character named {character['name']} already exists")
+                    if len(errors) >= MAX_ERRORS:
+                        break
+                elif on_conflict == "skip":
+                    result["skipped"] += 1
+                else:
+                    updates.append((character["description"], character["settings"], existing_id))
+                    imported.append({"character_id": existing_id, "name": character["name"],
+                                     "description": character["description"], "settings": character["settings"]})
+                    result["updated"] += 1
+            else:
+                character_id = given_id or str(uuid.uuid4())
+                inserts.append((character_id, character["name"], character["description"], character["settings"],
+                                creator_id, now))
+                imported.append({"character_id": character_id, **{f: character[f] for f in REQUIRED_FIELDS},
+                                 "creator_id": creator_id, "creation_time": now})
+                result["inserted"] += 1
+            if not errors:
+                flush()
+
+        if errors:
+            # Leaving the block with an exception rolls back everything inserted so far
+            more = " (stopped reading)" if len(errors) >= MAX_ERRORS else ""
+            raise InvalidCharacterPackError(f"{len(errors)} problems in the character pack{more}:\n" + "\n".join(errors))
+        flush(final=True)
+        if not dry_run:
+            # Runs on this worker thread; the catalog serializes it with changes made on the loop
+            run_after_commit(lambda: get_character_catalog().upsert(*imported))
+
+    logger.info(f"Imported character pack{' (dry run)' if dry_run else ''}", extra=result)
+    return result
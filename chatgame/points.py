@@ -0,0 +1,149 @@
+import logging
+import random
+import uuid
+from os import getenv
+from typing import Dict, List, Optional
+
+from utils.MySQLHandler import get_db_handler
+from chatgame.exceptions import InsufficientPointsError
+
+logger = logging.getLogger("chatgame.points")
+
+# The System user pays out every grant. Its balance is allowed to go negative: it is the
+# total of all points ever granted.
+SYSTEM_USER_ID = "00000000-0000-0000-0000-000000000000"
+
+# A balance is `User.points_balance` (the snapshot) plus the deltas of its `Points_Counter`
+# rows. Transfers add to one counter row per account instead of updating the `User` row, and
+# accounts receiving or paying out many concurrent transfers spread them over several rows,
+# so they don't queue on a single row lock. `compact` folds the deltas into the snapshot.
+HOT_ACCOUNT_SLOTS = int(getenv("POINTS_COUNTER_SLOTS", "16"))
+HOT_ACCOUNTS = {SYSTEM_USER_ID} | {user_id.strip() for user_id in getenv("POINTS_HOT_ACCOUNTS", "").split(",")
+                                   if user_id.strip()}
+
+
+def counter_slots(user_id: str) -> int:
+    """Number of counter rows the transfers of an account are spread over."""
+    return HOT_ACCOUNT_SLOTS if user_id in HOT_ACCOUNTS else 1
+
+
+def balance(user_id: str, for_update: bool = False) -> Optional[int]:
+    """
+    The exact balance of a user: the snapshot plus the deltas not compacted yet.
+
+    Args:
+        user_id: The ID of the user.
+        for_update: Read the latest committed rows and lock them (inside a unit of work), so no
+            other transfer from or compaction of the account runs until the transaction ends.
+
+    Returns:
+        The balance, or None if the user doesn't exist.
+    """
+    db = get_db_handler()
+    lock = " FOR UPDATE" if for_update else ""
+    snapshot = db.fetch_one(f"SELECT points_balance FROM User WHERE user_id = %s{lock}", (user_id,))
+    if snapshot is None:
+        return None
+    # At most `counter_slots` rows, read through the primary key
+    delta = db.fetch_one(f"SELECT COALESCE(SUM(delta), 0) AS delta FROM Points_Counter WHERE user_id = %s{lock}",
+                         (user_id,))
+    return int(snapshot["points_balance"] or 0) + int(delta["delta"])
+
+
+def transfer(sender_id: str, receiver_id: str, amount: int) -> str:
+    """
+    Move points between two users and record the transaction, in one transaction (or the
+    caller's unit of work).
+
+    Args:
+        sender_id: The ID of the paying user.
+        receiver_id: The ID of the receiving user.
+        amount: Number of points, positive.
+
+    Returns:
+        The ID of the recorded transaction.
+
+    Raises:
+        ValueError: If `amount` is not positive or both users are the same.
+        InsufficientPointsError: If the sender (other than the System user) can't cover `amount`.
+    """
+    if amount <= 0:
+        raise ValueError("Amount must be positive")
+    if sender_id == receiver_id:
+        raise ValueError("Cannot transfer points to the same user")
+
+    db = get_db_handler()
+    transaction_id = str(uuid.uuid4())
+    with db.unit_of_work():
+        # Both User rows are locked up front, in user ID order, before anything else. The
+        # foreign keys of the Transaction insert take shared locks on them, so locking only the
+        # sender's row would let A -> B and B -> A each hold one row while waiting for the other.
+        # The System user is never locked exclusively: grants only share its row, and so don't
+        # queue behind each other (its balance may go negative anyway).
+        for user_id in sorted({sender_id, receiver_id} - {SYSTEM_USER_ID}):
+            db.fetch_one("SELECT user_id FROM User WHERE user_id = %s FOR UPDATE", (user_id,))
+
+        if sender_id != SYSTEM_USER_ID:
+            # Transfers from the same account run one at a time so two can't spend the same points
+            available = balance(sender_id, for_update=True)
+            if available is None or available < amount:
+                raise InsufficientPointsError(f"Balance of {available or 0} points is lower than {amount}")
+
+        db.execute(
+            "INSERT INTO Transaction (transaction_id, sender_id, receiver_id, amount) VALUES (%s, %s, %s, %s)",
+            (transaction_id, sender_id, receiver_id, amount))
+        # Counter rows come after the User rows, also in user ID order, like in `compact`
+        for user_id, delta in sorted([(sender_id, -amount), (receiver_id, amount)]):
+            db.execute(
+                "INSERT INTO Points_Counter (user_id, slot, delta) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE delta = delta + VALUES(delta)",
+                (user_id, random.randrange(counter_slots(user_id)), delta))
+    return transaction_id
+
+
+def compact(user_id: str) -> int:
+    """
+    Fold the counter deltas of a user into the `User.points_balance` snapshot. The balance is
+    unchanged; reads of it touch fewer rows afterwards.
+
+    Returns:
+        The delta that was folded in.
+    """
+    db = get_db_handler()
+    with db.unit_of_work():
+        # Same lock order as `transfer`: the user row first, then the counter rows
+        if db.fetch_one("SELECT user_id FROM User WHERE user_id = %s FOR UPDATE", (user_id,)) is None:
+            return 0
+        row = db.fetch_one("SELECT COALESCE(SUM(delta), 0) AS delta FROM Points_Counter WHERE user_id = %s FOR UPDATE",
+                           (user_id,))
+        delta = int(row["delta"])
+        if delta:
+            db.execute("UPDATE User SET points_balance = points_balance + %s WHERE user_id = %s", (delta, user_id))
+            # Rows are zeroed rather than deleted so the next transfers update them in place
+            db.execute("UPDATE Points_Counter SET delta = 0 WHERE user_id = %s AND delta <> 0", (user_id,))
+    return delta
+
+
+def compact_all(limit: int = 1000) -> Dict[str, int]:
+    """
+    Compact the accounts with pending deltas, one transaction each so the counter rows of an
+    account are only locked briefly. Blocking; run it in a worker thread.
+
+    Args:
+        limit: Maximum number of accounts compacted in this run.
+
+    Returns:
+        `accounts` compacted and the number of `failed` ones.
+    """
+    user_ids: List[str] = [row["user_id"] for row in get_db_handler().fetch_all(
+        "SELECT DISTINCT user_id FROM Points_Counter WHERE delta <> 0 LIMIT %s", (limit,))]
+    result = {"accounts": 0, "failed": 0}
+    for user_id in user_ids:
+        try:
+            compact(user_id)
+            result["accounts"] += 1
+        except Exception as e:
+            # Left for the next run; the balance is exact either way
+            result["failed"] += 1
+            logger.warning(f"Failed to compact the points of {user_id}: {str(e)}")
+    return result
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from cachetools import LRUCache, TTLCache
+
+from utils.MySQLHandler import run_after_commit
+
+logger = logging.getLogger("chatgame.prefetch")
+
+# Prefetched entries are only trusted for a short while: they are a head start for a turn
+# that is about to happen, not a general cache
+PREFETCH_TTL = float(getenv("PREFETCH_TTL_SECONDS", "60"))
+PREFETCH_MAX_ENTRIES = int(getenv("PREFETCH_MAX_ENTRIES", "10000"))
+
+# discord_id -> user_id
+_user_ids: TTLCache = TTLCache(maxsize=PREFETCH_MAX_ENTRIES, ttl=PREFETCH_TTL)
+# user_id -> current character_id (or None)
+_current_characters: TTLCache = TTLCache(maxsize=PREFETCH_MAX_ENTRIES, ttl=PREFETCH_TTL)
+# (user_id, character_id) -> context parts, see `chatgame.chat.load_context_parts`
+_contexts: TTLCache = TTLCache(maxsize=PREFETCH_MAX_ENTRIES, ttl=PREFETCH_TTL)
+
+# user_id -> number of invalidations. A prefetch only stores its results if the user's data
+# was not written while it was reading, so it never caches a value older than a write.
+_versions: LRUCache = LRUCache(maxsize=100000)
+
+# Prefetches running in the background, by key (so a burst of typing events runs one)
+_tasks: Dict[Hashable, asyncio.Task] = {}
+
+stats = {"scheduled": 0, "completed": 0, "failed": 0, "discarded": 0, "hits": 0, "misses": 0}
+
+
+def version(user_id: str) -> int:
+    """The current invalidation count of a user, to pass back when storing prefetched data."""
+    return _versions.get(user_id, 0)
+
+
+def remember_user_id(discord_id: str, user_id: str) -> None:
+    """Cache the user ID of a Discord user."""
+    _user_ids[discord_id] = user_id
+
+
+def cached_user_id(discord_id: str) -> Optional[str]:
+    """The cached user ID of a Discord user ("" if not registered), without querying the database."""
+    return _user_ids.get(discord_id)
+
+
+def forget_user_id(discord_id: str) -> None:
+    """Drop the cached user ID of a Discord user (e.g. once they registered)."""
+    run_after_commit(lambda: _user_ids.pop(discord_id, None))
+
+
+def remember_current_character(user_id: str, character_id: Optional[str], seen_version: int) -> None:
+    """Cache the current character of a user, unless the user was invalidated since `seen_version`."""
+    if version(user_id) == seen_version:
+        _current_characters[user_id] = character_id
+
+
+def cached_current_character(user_id: str) -> Optional[str]:
+    """
+    The cached current character of a user, without querying the database.
+
+    Raises:
+        KeyError: If it is not cached (None is a valid value: no character selected).
+    """
+    return _current_characters[user_id]
+
+
+def remember_context(user_id: str, character_id: str, parts: Dict[str, Any], seen_version: int) -> None:
+    """Cache the context parts of a user and character, unless the user was invalidated since `seen_version`."""
+    if version(user_id) == seen_version:
+        _contexts[(user_id, character_id)] = parts
+    else:
+        stats["discarded"] += 1
+
+
+def cached_context(user_id: str, character_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The prefetched context parts of a session, without querying the database.
+
+    Returns:
+        The parts, or None if nothing (or another session) was prefetched.
+    """
+    parts = _contexts.get((user_id, character_id))
+    if parts is None or parts["session_id"] != session_id:
+        stats["misses"] += 1
+        return None
+    stats["hits"] += 1
+    return parts
+
+
+def has_context(user_id: str, character_id: str, session_id: str) -> bool:
+    """Whether the context parts of a session are prefetched (without counting a hit or miss)."""
+    parts = _contexts.get((user_id, character_id))
+    return parts is not None and parts["session_id"] == session_id
+
+
+def invalidate(user_id: str) -> None:
+    """
+    Drop everything prefetched for a user once the caller's writes are committed, and keep
+    prefetches that are already reading from storing what they read.
+    """
+    def forget():
+        _versions[user_id] = version(user_id) + 1
+        _current_characters.pop(user_id, None)
+        for key in [key for key in _contexts if key[0] == user_id]:
+            _contexts.pop(key, None)
+
+    run_after_commit(forget)
+
+
+def schedule(key: Hashable, prefetch: Callable[[], Awaitable[None]]) -> bool:
+    """
+    Run a prefetch in the background, unless one is already running for `key`.
+    Failures are logged and otherwise ignored: the turn simply loads cold.
+
+    Args:
+        key: Deduplication key, e.g. the Discord user ID.
+        prefetch: Coroutine function doing the prefetch.
+
+    Returns:
+        True if the prefetch was started.
+    """
+    if key in _tasks:
+        return False
+
+    async def run():
+        try:
+            await prefetch()
+            stats["completed"] += 1
+        except Exception as e:
+            stats["failed"] += 1
+            logger.warning(f"Prefetch for {key} failed: {str(e)}")
+        finally:
+            _tasks.pop(key, None)
+
+    stats["scheduled"] += 1
+    _tasks[key] = asyncio.create_task(run())
+    return True
+
+
+def snapshot() -> Dict[str, Any]:
+    """Counters and cache sizes."""
+    return {**stats, "running": len(_tasks), "contexts": len(_contexts)}
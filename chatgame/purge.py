@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import time
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import mysql.connector
+
+from utils.MySQLHandler import get_db_handler, MySQLQueryMixin
+from chatgame.exceptions import UserNotFoundError
+from chatgame.catalog import get_character_catalog
+from chatgame.retrieval import get_vector_store
+from chatgame.usage import get_usage_meter
+from chatgame.points import SYSTEM_USER_ID
+from chatgame import sessions, sharding, prefetch
+
+logger = logging.getLogger("chatgame.purge")
+
+# Rows deleted per statement: each chunk is its own short transaction, so no lock is held
+# for longer than one chunk takes
+PURGE_CHUNK_SIZE = int(getenv("PURGE_CHUNK_SIZE", "500"))
+# Fraction of the time a purge keeps the database busy: after a chunk that took t seconds it
+# pauses t * (1 / PURGE_DUTY_CYCLE - 1), so a slower database automatically gets longer breaks
+PURGE_DUTY_CYCLE = float(getenv("PURGE_DUTY_CYCLE", "0.2"))
+PURGE_MIN_PAUSE = 0.01
+# Passes over all steps before a purge gives up on rows that keep appearing (see `purge_user`)
+PURGE_MAX_PASSES = 3
+# Seconds to wait for the user's queued background writes before each pass
+PURGE_SETTLE_TIMEOUT = 60.0
+
+ER_ROW_IS_REFERENCED = 1451  # Foreign key violation deleting a parent row
+
+# Rows keyed by the user, deleted in index order: (step, table, user column, ORDER BY, on the user's shard).
+# Secondary indexes end with the primary key, so the ORDER BY follows an index in every table.
+_USER_ROWS = [
+    ("memory"               , "Memory"         , "user_id"    , "character_id"                  , True),
+    ("affinity"             , "Affinity"       , "user_id"    , "character_id"                  , True),
+    ("customization"        , "Customization"  , "user_id"    , "character_id, attribute"       , True),
+    ("interactions"         , "Interaction"    , "user_id"    , "character_id, timestamp"       , False),
+    ("transactions_sent"    , "Transaction"    , "sender_id"  , "transaction_id"                , False),
+    ("transactions_received", "Transaction"    , "receiver_id", "transaction_id"                , False),
+    ("points"               , "Points_Counter" , "user_id"    , "slot"                          , False),
+    ("usage"                , "LLM_Usage"      , "user_id"    , "recorded_at, usage_id"         , False),
+    ("usage_daily"          , "LLM_Usage_Daily", "user_id"    , "day, character_id, model"      , False),
+]
+
+# Purges run one at a time, by user ID
+_tasks: Dict[str, asyncio.Task] = {}
+_running = asyncio.Lock()
+
+# Waits for the background writes (memory/affinity actions) queued for a user, see `set_action_waiter`
+ActionWaiter = Callable[[str], Awaitable[int]]
+_action_waiter: Optional[ActionWaiter] = None
+
+stats = {"started": 0, "completed": 0, "failed": 0, "rows_deleted": 0, "chunks": 0}
+
+
+def _delete_sessions(user_id: str, limit: int, reassigned: List[str]) -> int:
+    """One chunk of the messages of the user's first session, and the session once it is empty."""
+    shard = get_db_handler().for_user(user_id)
+    session = shard.fetch_one(
+        "SELECT session_id FROM Chat_Session WHERE user_id = %s ORDER BY session_id LIMIT 1", (user_id,))
+    if session is None:
+        return 0
+    deleted = shard.execute(
+        "DELETE FROM Message WHERE session_id = %s ORDER BY message_id LIMIT %s", (session["session_id"], limit))
+    if deleted < limit:
+        deleted += shard.execute("DELETE FROM Chat_Session WHERE session_id = %s", (session["session_id"],))
+    return deleted
+
+
+def _user_rows_step(table: str, column: str, order: str, on_shard: bool) -> Callable[[str, int, List[str]], int]:
+    def delete(user_id: str, limit: int, reassigned: List[str]) -> int:
+        db = get_db_handler()
+        handler: MySQLQueryMixin = db.for_user(user_id) if on_shard else db
+        return handler.execute(f"DELETE FROM {table} WHERE {column} = %s ORDER BY {order} LIMIT %s", (user_id, limit))
+    return delete
+
+
+def _reassign_characters(user_id: str, limit: int, reassigned: List[str]) -> int:
+    """Hand the characters the user created over to the System user; other users may be chatting with them."""
+    db = get_db_handler()
+    rows = db.fetch_all("SELECT character_id FROM Virtual_Character WHERE creator_id = %s LIMIT %s", (user_id, limit))
+    if not rows:
+        return 0
+    character_ids = [row["character_id"] for row in rows]
+    db.execute(f"UPDATE Virtual_Character SET creator_id = %s WHERE character_id IN ({', '.join(['%s'] * len(rows))})",
+               (SYSTEM_USER_ID, *character_ids))
+    reassigned.extend(character_ids)
+    return len(rows)
+
+
+def _delete_user(user_id: str, limit: int, reassigned: List[str]) -> int:
+    return get_db_handler().execute("DELETE FROM User WHERE user_id = %s", (user_id,))
+
+
+# Children before the rows they reference, the User row last
+STEPS: List[Tuple[str, Callable[[str, int, List[str]], int]]] = [
+    ("sessions", _delete_sessions),
+    *[(step, _user_rows_step(table, column, order, on_shard)) for step, table, column, order, on_shard in _USER_ROWS],
+    ("characters", _reassign_characters),
+    ("user", _delete_user),
+]
+
+
+def _start_job(user_id: str) -> Dict[str, Any]:
+    """
+    Record the purge of a user, or pick up the recorded one. A new purge first moves the user
+    off their Discord ID, so they can't start new turns while their rows are being deleted
+    (and can register again right away).
+    """
+    db = get_db_handler()
+    with db.unit_of_work():
+        job = db.fetch_one("SELECT user_id, discord_id, status, step, rows_deleted FROM Purge_Job "
+                           "WHERE user_id = %s FOR UPDATE", (user_id,))
+        if job is not None:
+            if job["status"] != "done":
+                db.execute("UPDATE Purge_Job SET status = 'running', error = NULL WHERE user_id = %s", (user_id,))
+            return job
+
+        user = db.fetch_one("SELECT discord_id FROM User WHERE user_id = %s FOR UPDATE", (user_id,))
+        if user is None:
+            raise UserNotFoundError("User ID not found in database")
+        db.execute("INSERT INTO Purge_Job (user_id, discord_id) VALUES (%s, %s)", (user_id, user["discord_id"]))
+        # discord_id is unique and required; the purge marker frees the real one
+        db.execute("UPDATE User SET discord_id = %s, current_character = NULL WHERE user_id = %s",
+                   (f"purged:{user_id}", user_id))
+        return {"user_id": user_id, "discord_id": user["discord_id"], "status": "running", "step": "",
+                "rows_deleted": 0}
+
+
+def _record_progress(user_id: str, step: str, deleted: int) -> None:
+    get_db_handler().execute(
+        "UPDATE Purge_Job SET step = %s, rows_deleted = rows_deleted + %s WHERE user_id = %s", (step, deleted, user_id))
+
+
+def _finish_job(user_id: str, error: Optional[str] = None) -> None:
+    if error:
+        get_db_handler().execute("UPDATE Purge_Job SET status = 'failed', error = %s WHERE user_id = %s",
+                                 (error, user_id))
+    else:
+        # Nothing identifying the person is kept once the purge is done
+        get_db_handler().execute("UPDATE Purge_Job SET status = 'done', discord_id = '' WHERE user_id = %s",
+                                 (user_id,))
+
+
+def _forget_user(user_id: str, discord_id: str) -> None:
+    """Drop every in-process cache entry of a user. Runs on the event loop, which owns the caches."""
+    prefetch.forget_user_id(discord_id)
+    prefetch.invalidate(user_id)
+    sessions.forget_user_sessions(user_id)
+    sharding.forget_user_sessions(user_id)
+
+
+def set_action_waiter(waiter: Optional[ActionWaiter]) -> None:
+    """
+    Set the function a purge uses to wait for the background writes queued for the user
+    (e.g. memory and affinity updates of a reply that was just sent) before deleting rows.
+
+    Args:
+        waiter: Async function taking the user ID and returning the number of jobs it waited
+            for, or None to not wait.
+    """
+    global _action_waiter
+    _action_waiter = waiter
+
+
+async def _settle_user(user_id: str) -> int:
+    """
+    Let the writes still on their way for a user land, so the next pass deletes them: wait
+    for the queued actions and drop the buffered usage records.
+
+    Returns:
+        The number of actions and usage records found.
+    """
+    pending = await get_usage_meter().forget_user(user_id)
+    if _action_waiter is not None:
+        try:
+            pending += await asyncio.wait_for(_action_waiter(user_id), PURGE_SETTLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Whatever they write later is caught by the next pass or the foreign key check
+            logger.warning(f"Purge of user {user_id}: queued actions still running after {PURGE_SETTLE_TIMEOUT}s")
+            pending += 1
+    return pending
+
+
+def _is_still_referenced(error: Exception) -> bool:
+    return isinstance(error, mysql.connector.errors.IntegrityError) and error.errno == ER_ROW_IS_REFERENCED
+
+
+async def _run_steps(user_id: str, chunk_size: int, duty_cycle: float, result: Dict[str, Any]) -> None:
+    """One pass over every step, each deleting until nothing of the user is left."""
+    reassigned: List[str] = []
+    for name, step in STEPS:
+        await asyncio.to_thread(_record_progress, user_id, name, 0)
+        result["steps"].setdefault(name, 0)
+        try:
+            while True:
+                started = time.perf_counter()
+                deleted = await asyncio.to_thread(step, user_id, chunk_size, reassigned)
+                elapsed = time.perf_counter() - started
+                stats["chunks"] += 1
+                if deleted:
+                    await asyncio.to_thread(_record_progress, user_id, name, deleted)
+                    result["steps"][name] += deleted
+                    result["rows_deleted"] += deleted
+                    stats["rows_deleted"] += deleted
+                if reassigned:
+                    # Same rows with the new creator; swapped in as a whole like every catalog change
+                    catalog = get_character_catalog()
+                    catalog.upsert(*[{"character_id": character_id, "creator_id": SYSTEM_USER_ID}
+                                     for character_id in reassigned if character_id in catalog])
+                    result["characters"] += len(reassigned)
+                    reassigned.clear()
+                if not deleted:
+                    break
+                await asyncio.sleep(max(PURGE_MIN_PAUSE, elapsed * (1 / duty_cycle - 1)))
+        except Exception:
+            result["failed_step"] = name
+            raise
+
+
+async def purge_user(user_id: str, chunk_size: int = PURGE_CHUNK_SIZE,
+                     duty_cycle: float = PURGE_DUTY_CYCLE) -> Dict[str, Any]:
+    """
+    Delete a user and everything stored about them: sessions and messages, memory, affinity,
+    customizations, interactions, transactions, points counters, usage records and message
+    vectors. Characters they created are handed over to the System user.
+
+    Rows are deleted in index-ordered chunks of `chunk_size`, each in its own short transaction,
+    with pauses so the purge uses at most `duty_cycle` of the time; chat turns running at the
+    same time only ever wait for one chunk. Progress is recorded in `Purge_Job`, and calling
+    this again for an interrupted or failed purge resumes it. Don't call it inside `turn()`.
+
+    Turns that were already running when the purge started can still write rows for the user,
+    also into tables whose step has passed. So every pass runs all steps from the start (a
+    resumed purge too; steps with nothing left cost one query), after the user's queued
+    actions have landed and their buffered usage records were dropped. Another pass follows
+    while the User row is still referenced, or when more writes turned up during a pass, up
+    to PURGE_MAX_PASSES.
+
+    Args:
+        user_id: The ID of the user.
+        chunk_size: Rows deleted per statement.
+        duty_cycle: Fraction of the time spent deleting, in (0, 1].
+
+    Returns:
+        `rows_deleted` (this run), per-step `steps` counts, `characters` handed over,
+        `vector_files` deleted and the number of `passes`.
+
+    Raises:
+        ValueError: If `user_id` is the System user.
+        UserNotFoundError: If the user doesn't exist and no purge of it was recorded.
+    """
+    if user_id == SYSTEM_USER_ID:
+        raise ValueError("The System user cannot be purged")
+
+    async with _running:
+        job = await asyncio.to_thread(_start_job, user_id)
+        result: Dict[str, Any] = {"rows_deleted": 0, "steps": {}, "characters": 0, "vector_files": 0, "passes": 0}
+        if job["status"] == "done":
+            return result
+
+        stats["started"] += 1
+        _forget_user(user_id, job["discord_id"])
+        logger.info(f"Purging user {user_id}" + (f", interrupted at {job['step']}" if job["step"] else ""))
+
+        try:
+            await _settle_user(user_id)
+            while True:
+                result["passes"] += 1
+                try:
+                    await _run_steps(user_id, chunk_size, duty_cycle, result)
+                except Exception as e:
+                    if not _is_still_referenced(e) or result["passes"] >= PURGE_MAX_PASSES:
+                        raise
+                    logger.info(f"Purge of user {user_id}: rows were written meanwhile, starting over")
+                    del result["failed_step"]
+                    await _settle_user(user_id)
+                    continue
+                # Writes that turned up during the pass may have gone into tables it had already
+                # cleared; the User row being gone, another pass removes them
+                if not await _settle_user(user_id) or result["passes"] >= PURGE_MAX_PASSES:
+                    break
+        except Exception as e:
+            step = result.pop("failed_step", "")
+            stats["failed"] += 1
+            logger.warning(f"Purge of user {user_id} failed at {step}: {str(e)}")
+            await asyncio.to_thread(_finish_job, user_id, f"{step}: {str(e)}")
+            raise
+
+        store = get_vector_store()
+        if store is not None:
+            result["vector_files"] = store.drop(user_id)
+        # Again at the end: turns that were already running may have cached the user meanwhile
+        _forget_user(user_id, job["discord_id"])
+        await asyncio.to_thread(_finish_job, user_id)
+        stats["completed"] += 1
+        logger.info(f"Purged user {user_id}", extra={"rows_deleted": result["rows_deleted"],
+                                                     "passes": result["passes"]})
+        return result
+
+
+def schedule_purge(user_id: str) -> bool:
+    """
+    Purge a user in the background (see `purge_user`). Failures are logged; the purge can be
+    resumed by scheduling it again.
+
+    Returns:
+        True if the purge was started, False if one is already running or queued for the user.
+    """
+    if user_id in _tasks:
+        return False
+
+    async def run():
+        try:
+            await purge_user(user_id)
+        except Exception as e:
+            logger.warning(f"Background purge of user {user_id} failed: {str(e)}")
+        finally:
+            _tasks.pop(user_id, None)
+
+    _tasks[user_id] = asyncio.create_task(run())
+    return True
+
+
+async def resume_purges() -> int:
+    """
+    Schedule every purge that was interrupted (e.g. by a restart) or failed.
+
+    Returns:
+        The number of purges scheduled.
+    """
+    rows = await asyncio.to_thread(
+        get_db_handler().fetch_all, "SELECT user_id FROM Purge_Job WHERE status <> 'done' ORDER BY started_at")
+    return sum(schedule_purge(row["user_id"]) for row in rows)
+
+
+def purge_jobs(limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    The most recent purges.
+
+    Returns:
+        Rows with `user_id`, `discord_id`, `status`, `step`, `rows_deleted`, `error`, `started_at`
+        and `updated_at`, newest first.
+    """
+    return get_db_handler().fetch_all(
+        "SELECT user_id, discord_id, status, step, rows_deleted, error, started_at, updated_at "
+        "FROM Purge_Job ORDER BY started_at DESC LIMIT %s", (limit,))
+
+
+def snapshot() -> Dict[str, Any]:
+    """Counters and the number of running or queued purges."""
+    return {**stats, "pending": len(_tasks)}
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from os import getenv
+from typing import TYPE_CHECKING, Iterable, List, Optional, Set
+
+from utils.MySQLHandler import run_after_commit
+
+# utils.VectorIndex pulls in numpy, so it is imported when the store is first built
+if TYPE_CHECKING:
+    import numpy as np
+    from utils.VectorIndex import Embedder, VectorStore
+
+logger = logging.getLogger("chatgame.retrieval")
+
+_store: Optional["VectorStore"] = None
+_configured = False
+
+# Messages being indexed in the background (kept referenced until they finish)
+_index_tasks: Set[asyncio.Task] = set()
+
+
+def _store_from_env() -> Optional["VectorStore"]:
+    """
+    Build the vector store selected by CHAT_RETRIEVAL: "hashing" (default, offline),
+    "openai" (embeddings API) or "off".
+    """
+    mode = getenv("CHAT_RETRIEVAL", "hashing").strip().lower()
+    if mode in ("off", "false", "0", ""):
+        return None
+
+    from utils.VectorIndex import HashingEmbedder, OpenAIEmbedder, VectorStore
+    if mode == "openai":
+        import openai
+        embedder: "Embedder" = OpenAIEmbedder(openai.AsyncOpenAI(api_key=getenv("OPENAI_API_KEY")))
+    else:
+        embedder = HashingEmbedder()
+    return VectorStore(getenv("VECTOR_INDEX_DIR", "data/vectors"), embedder)
+
+
+def get_vector_store() -> Optional["VectorStore"]:
+    """
+    Get the message vector store, or None if retrieval is disabled.
+    """
+    global _store, _configured
+    if not _configured:
+        _store = _store_from_env()
+        _configured = True
+    return _store
+
+
+def set_embedder(embedder: Optional["Embedder"]) -> None:
+    """
+    Replace the embedder used for message retrieval. Passing None disables retrieval.
+    Indexes are kept per embedder, so switching embedders starts from empty indexes.
+
+    Args:
+        embedder: The embedder to use, or None.
+    """
+    from utils.VectorIndex import VectorStore
+
+    global _store, _configured
+    _store = VectorStore(getenv("VECTOR_INDEX_DIR", "data/vectors"), embedder) if embedder else None
+    _configured = True
+
+
+async def index_message(user_id: str, character_id: str, message_id: str, content: str) -> None:
+    """
+    Embed a stored message into the index of its user and character.
+    Failures are logged and ignored; a missing vector only makes the message unretrievable.
+
+    Args:
+        user_id: The ID of the session owner.
+        character_id: The ID of the session character.
+        message_id: The ID of the message.
+        content: The message text.
+    """
+    store = get_vector_store()
+    if store is None or not content:
+        return
+    try:
+        await store.add(user_id, character_id, message_id, content)
+    except Exception as e:
+        logger.warning(f"Failed to index message {message_id}: {str(e)}")
+
+
+def index_after_commit(user_id: str, character_id: str, message_id: str, content: str) -> None:
+    """
+    Index a message in the background once the caller's unit of work has committed it, so
+    the embedder (possibly an API call) never runs while the transaction holds its connection
+    and row locks, and rolled back messages are never indexed.
+
+    Args:
+        user_id: The ID of the session owner.
+        character_id: The ID of the session character.
+        message_id: The ID of the message.
+        content: The message text.
+    """
+    if get_vector_store() is None or not content:
+        return
+
+    def start():
+        task = asyncio.create_task(index_message(user_id, character_id, message_id, content))
+        _index_tasks.add(task)
+        task.add_done_callback(_index_tasks.discard)
+
+    run_after_commit(start)
+
+
+async def embed_query(query: str) -> Optional["np.ndarray"]:
+    """
+    Embed a retrieval query ahead of time, e.g. the user's message before the turn's
+    transaction starts, to pass to `relevant_message_ids`.
+
+    Returns:
+        The query vector, or None if retrieval is disabled or embedding fails.
+    """
+    store = get_vector_store()
+    if store is None or not query:
+        return None
+    try:
+        return (await store.embedder.embed([query]))[0]
+    except Exception as e:
+        logger.warning(f"Failed to embed retrieval query: {str(e)}")
+        return None
+
+
+async def relevant_message_ids(user_id: str, character_id: str, query: str, k: int,
+                               exclude: Iterable[str] = (), query_vector: Optional["np.ndarray"] = None) -> List[str]:
+    """
+    Find the IDs of the stored messages most relevant to a query.
+
+    Args:
+        user_id: The ID of the user.
+        character_id: The ID of the character.
+        query: Text to compare against (usually the latest user message).
+        k: Maximum number of results.
+        exclude: Message IDs to leave out.
+        query_vector: The query embedded by `embed_query`; without it the query is embedded here.
+
+    Returns:
+        Message IDs, most relevant first; empty if retrieval is disabled or fails.
+    """
+    store = get_vector_store()
+    if store is None or not query or k <= 0:
+        return []
+    try:
+        return await store.search(user_id, character_id, query, k, exclude, vector=query_vector)
+    except Exception as e:
+        logger.warning(f"Message retrieval failed: {str(e)}")
+        return []
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import time
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from cachetools import LRUCache
+
+from utils.MySQLHandler import get_db_handler, run_after_commit
+
+logger = logging.getLogger("chatgame.sessions")
+
+# Rotation thresholds: a new session starts after this much inactivity, or once the active
+# session holds this many messages or (estimated) tokens
+SESSION_IDLE_TIMEOUT = float(getenv("SESSION_IDLE_HOURS", "6")) * 3600
+SESSION_MAX_MESSAGES = int(getenv("SESSION_MAX_MESSAGES", "200"))
+SESSION_MAX_TOKENS = int(getenv("SESSION_MAX_TOKENS", "50000"))
+
+SUMMARY_SOURCE_MESSAGES = 50  # Latest messages of a closed session passed to the summarizer
+SUMMARY_MAX_LENGTH = 2000  # Characters kept by the default summarizer
+
+Summarizer = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+# (user_id, character_id) -> state of the active session, see `load_active_session`
+_active_sessions: LRUCache = LRUCache(maxsize=100000)
+
+# Summaries being written in the background (kept referenced until they finish)
+_summary_tasks: Set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+async def extractive_summary(previous_summary: str, messages: List[Dict[str, Any]]) -> str:
+    """
+    Default summarizer: the carried-over summary followed by the tail of the closed session,
+    one shortened line per message, cut to SUMMARY_MAX_LENGTH characters. Works offline.
+
+    Args:
+        previous_summary: Summary carried into the closed session.
+        messages: Latest messages of the closed session, oldest first.
+
+    Returns:
+        The summary to carry into the next session.
+    """
+    lines = []
+    for message in messages:
+        speaker = "User" if message["from_user"] else "Character"
+        content = " ".join(message["content"].split())
+        lines.append(f"{speaker}: {content[:200]}")
+
+    summary = "\n".join(lines)
+    if previous_summary:
+        summary = previous_summary + "\n...\n" + summary
+    # Keep the most recent part when too long
+    return summary[-SUMMARY_MAX_LENGTH:]
+
+
+_summarizer: Summarizer = extractive_summary
+
+
+def set_session_summarizer(summarizer: Optional[Summarizer]) -> None:
+    """
+    Replace the function writing the summary carried from a closed session into the next one.
+
+    Args:
+        summarizer: Async function taking the previous summary and the latest messages of the
+            closed session (oldest first) and returning the new summary, or None to restore
+            the default extractive summarizer.
+    """
+    global _summarizer
+    _summarizer = summarizer or extractive_summary
+
+
+def load_active_session(user_id: str, character_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the state of the active session of a user and character, from the cache or the database.
+
+    Args:
+        user_id: The ID of the user.
+        character_id: The ID of the character.
+
+    Returns:
+        A dictionary with `session_id`, `message_count`, `token_count`, `last_active`
+        (epoch seconds) and `summary`, or None if the pair has no active session.
+    """
+    key = (user_id, character_id)
+    state = _active_sessions.get(key)
+    if state is not None:
+        return state
+
+    result = get_db_handler().for_user(user_id).fetch_one(
+        """SELECT session_id, message_count, token_count, summary,
+                  TIMESTAMPDIFF(SECOND, COALESCE(last_active, start_time), CURRENT_TIMESTAMP) AS idle_seconds
+           FROM Chat_Session
+           WHERE user_id = %s AND character_id = %s AND is_active = TRUE
+           ORDER BY start_time DESC LIMIT 1""",
+        (user_id, character_id))
+    if result is None:
+        return None
+
+    state = _active_sessions[key] = {
+        "session_id"   : result["session_id"],
+        "message_count": result["message_count"] or 0,
+        "token_count"  : result["token_count"] or 0,
+        "last_active"  : time.time() - (result["idle_seconds"] or 0),
+        "summary"      : result["summary"] or "",
+    }
+    return state
+
+
+def remember_active_session(user_id: str, character_id: str, session_id: str, summary: str = "") -> None:
+    """
+    Cache a newly started session as the active one of its user and character, once the
+    caller's unit of work has committed it. If it rolls back, the previous state stays cached.
+    """
+    def remember():
+        _active_sessions[(user_id, character_id)] = {
+            "session_id"   : session_id,
+            "message_count": 0,
+            "token_count"  : 0,
+            "last_active"  : time.time(),
+            "summary"      : summary,
+        }
+
+    run_after_commit(remember)
+
+
+def forget_active_session(user_id: str, character_id: str) -> None:
+    """Drop the cached active session of a user and character."""
+    _active_sessions.pop((user_id, character_id), None)
+
+
+def forget_user_sessions(user_id: str) -> None:
+    """Drop the cached active sessions of a user with every character."""
+    for key in [key for key in _active_sessions if key[0] == user_id]:
+        _active_sessions.pop(key, None)
+
+
+def cached_active_session(user_id: str, character_id: str) -> Optional[Dict[str, Any]]:
+    """The cached state of the active session, without querying the database."""
+    return _active_sessions.get((user_id, character_id))
+
+
+def needs_rotation(state: Dict[str, Any]) -> bool:
+    """Whether the active session is idle or large enough to start a new one."""
+    return (time.time() - state["last_active"] > SESSION_IDLE_TIMEOUT
+            or state["message_count"] >= SESSION_MAX_MESSAGES
+            or state["token_count"] >= SESSION_MAX_TOKENS)
+
+
+def record_message(user_id: str, character_id: str, session_id: str, content: str) -> int:
+    """
+    Count a new message towards its session's rotation thresholds in the cache, once the
+    caller's unit of work has committed it (like the counters in the database).
+
+    Returns:
+        The estimated token count of the message.
+    """
+    tokens = estimate_tokens(content)
+
+    def count():
+        state = _active_sessions.get((user_id, character_id))
+        if state is not None and state["session_id"] == session_id:
+            state["message_count"] += 1
+            state["token_count"] += tokens
+            state["last_active"] = time.time()
+
+    run_after_commit(count)
+    return tokens
+
+
+async def closing_summary(user_id: str, closed_session_id: str, previous_summary: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Summarize a session being rotated out with the default extractive summarizer, inside the
+    rotating transaction. The new session is created with this summary, so the turn that
+    rotated already sees it, and it is committed (or rolled back) with the rotation.
+
+    Args:
+        user_id: The ID of the user.
+        closed_session_id: The session being rotated out.
+        previous_summary: Summary carried into the closed session.
+
+    Returns:
+        The summary, and the latest messages of the closed session (oldest first) for
+        `schedule_summary`.
+    """
+    messages = get_db_handler().for_user(user_id).fetch_all(
+        "SELECT from_user, content, timestamp FROM Message WHERE session_id = %s "
+        "ORDER BY timestamp DESC LIMIT %s",
+        (closed_session_id, SUMMARY_SOURCE_MESSAGES))
+    messages = list(reversed(messages))
+    return await extractive_summary(previous_summary, messages), messages
+
+
+def schedule_summary(user_id: str, character_id: str, closed_session_id: str, next_session_id: str,
+                     previous_summary: str, messages: List[Dict[str, Any]]) -> None:
+    """
+    With a summarizer other than the default one (e.g. the AI model), replace the extractive
+    summary the next session was created with in the background, so a slow summarizer never
+    holds up the turn (or its database connection). The task starts once the caller's unit of
+    work has committed the new session; until it finishes, or if it never runs, the session
+    keeps the extractive summary.
+
+    Args:
+        user_id: The ID of the user.
+        character_id: The ID of the character.
+        closed_session_id: The session that was rotated out.
+        next_session_id: The session that replaced it.
+        previous_summary: Summary carried into the closed session.
+        messages: The latest messages of the closed session, oldest first.
+    """
+    if _summarizer is extractive_summary:
+        return
+
+    def start():
+        task = asyncio.create_task(_write_summary(
+            user_id, character_id, closed_session_id, next_session_id, previous_summary, messages))
+        _summary_tasks.add(task)
+        task.add_done_callback(_summary_tasks.discard)
+
+    run_after_commit(start)
+
+
+async def _write_summary(user_id: str, character_id: str, closed_session_id: str, next_session_id: str,
+                         previous_summary: str, messages: List[Dict[str, Any]]) -> None:
+    try:
+        summary = await _summarizer(previous_summary, messages)
+
+        get_db_handler().for_user(user_id).execute(
+            "UPDATE Chat_Session SET summary = %s WHERE session_id = %s", (summary, next_session_id))
+        state = _active_sessions.get((user_id, character_id))
+        if state is not None and state["session_id"] == next_session_id:
+            state["summary"] = summary
+    except Exception as e:
+        # The next session keeps the extractive summary
+        logger.warning(f"Failed to summarize session {closed_session_id}: {str(e)}")
+
+
+def session_summary(user_id: str, character_id: str, session_id: str) -> str:
+    """
+    Get the summary carried into a session.
+
+    Args:
+        user_id: The ID of the session owner.
+        character_id: The ID of the session character.
+        session_id: The ID of the session.
+    """
+    state = _active_sessions.get((user_id, character_id))
+    if state is not None and state["session_id"] == session_id:
+        return state["summary"]
+
+    result = get_db_handler().for_user(user_id).fetch_one(
+        "SELECT summary FROM Chat_Session WHERE session_id = %s", (session_id,))
+    return (result["summary"] or "") if result else ""
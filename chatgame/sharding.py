@@ -0,0 +1,89 @@
+from typing import Optional, Tuple
+
+from cachetools import LRUCache
+
+from utils.MySQLHandler import get_db_handler, run_after_commit, ShardHandler
+from chatgame.exceptions import SessionNotFoundError
+
+# session_id -> (user_id, character_id). Sessions never change owner, so entries never go stale
+_session_owners: LRUCache = LRUCache(maxsize=100000)
+
+
+def remember_session(session_id: str, user_id: str, character_id: str) -> None:
+    """
+    Record the owner of a session so later lookups by session ID need no shard scan.
+    Inside a unit of work the entry is only added once it commits: the session may have been
+    created by it, and a rolled back session must not stay cached.
+
+    Args:
+        session_id: The ID of the session.
+        user_id: The ID of the user owning the session.
+        character_id: The ID of the character of the session.
+    """
+    def remember():
+        _session_owners[session_id] = (user_id, character_id)
+
+    run_after_commit(remember)
+
+
+def forget_session(session_id: str) -> None:
+    """
+    Drop a session from the owner cache (e.g. after it was deleted or moved).
+
+    Args:
+        session_id: The ID of the session.
+    """
+    _session_owners.pop(session_id, None)
+
+
+def forget_user_sessions(user_id: str) -> None:
+    """
+    Drop every cached session owned by a user (e.g. after the user was deleted).
+
+    Args:
+        user_id: The ID of the user.
+    """
+    for session_id in [session_id for session_id, owner in _session_owners.items() if owner[0] == user_id]:
+        _session_owners.pop(session_id, None)
+
+
+def locate_session(session_id: str) -> Optional[Tuple[str, str]]:
+    """
+    Find the owner of a session, asking every shard on a cache miss.
+
+    Args:
+        session_id: The ID of the session.
+
+    Returns:
+        (user_id, character_id) of the session, or None if no shard has it.
+    """
+    owner = _session_owners.get(session_id)
+    if owner is not None:
+        return owner
+
+    for shard in get_db_handler().shards:
+        result = shard.fetch_one(
+            "SELECT user_id, character_id FROM Chat_Session WHERE session_id = %s", (session_id,))
+        if result is not None:
+            remember_session(session_id, result["user_id"], result["character_id"])
+            return result["user_id"], result["character_id"]
+    return None
+
+
+def session_shard(session_id: str) -> ShardHandler:
+    """
+    Get the handler of the shard holding a session and its messages.
+
+    Args:
+        session_id: The ID of the session.
+
+    Returns:
+        The ShardHandler of the session owner.
+
+    Raises:
+        SessionNotFoundError: If no shard has the session.
+    """
+    owner = locate_session(session_id)
+    if owner is None:
+        raise SessionNotFoundError("Session ID not found in database")
+    return get_db_handler().for_user(owner[0])
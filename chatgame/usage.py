@@ -0,0 +1,258 @@
+import asyncio
+import contextvars
+import datetime
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.MySQLHandler import get_db_handler
+
+logger = logging.getLogger("chatgame.usage")
+
+# Bits of LLM_Usage.flags
+PROMPT_CACHE_HIT = 1  # The API served part of the prompt from its prompt cache
+SYSTEM_PROMPT_REUSED = 2  # The system prompt was built from the in-process cache
+CONTEXT_PREFETCHED = 4  # The chat context came from the prefetch cache
+RETRY = 8  # The turn's first request failed and this one is a retry
+# A hedged attempt whose answer was not used. If it was cancelled before answering, its prompt
+# tokens are the winner's (the request is identical) and its completion tokens 0.
+HEDGE_DISCARDED = 16
+
+# (recorded_at, user_id, character_id, model, prompt_tokens, completion_tokens, cached_tokens, latency_ms, flags)
+UsageRecord = Tuple[datetime.datetime, str, str, str, int, int, int, int, int]
+
+GROUP_COLUMNS = {"character": "character_id", "user": "user_id", "model": "model"}
+
+
+class UsageMeter:
+    """
+    Buffers per-turn usage records in memory and writes them in bulk: one multi-row insert
+    into `LLM_Usage` and one upsert of the per day/character/user totals into
+    `LLM_Usage_Daily`, in a single transaction, from a worker thread.
+
+    A flush starts once `flush_size` records are buffered, or `flush_interval` seconds after
+    the first buffered record. If the database is unavailable the records are kept and
+    retried every `flush_interval`, up to `max_buffer` records; beyond that the oldest are dropped.
+    """
+
+    def __init__(self, flush_size: int = 200, flush_interval: float = 10.0, max_buffer: int = 20000) -> None:
+        """
+        Initialize a new usage meter.
+
+        Args:
+            flush_size: Number of buffered records that triggers a flush.
+            flush_interval: Maximum seconds a record waits in the buffer.
+            max_buffer: Maximum number of buffered records.
+        """
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[UsageRecord] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._failing = False  # The last flush failed: wait for the retry timer
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "flush_errors": 0}
+
+    @property
+    def buffered(self) -> int:
+        """Number of records waiting to be written."""
+        return len(self._buffer)
+
+    def record(self, user_id: str, character_id: str, model: str, prompt_tokens: int,
+               completion_tokens: int, cached_tokens: int, latency: float, flags: int = 0) -> None:
+        """
+        Buffer the usage of one turn. Must be called from the event loop.
+
+        Args:
+            user_id: The ID of the user.
+            character_id: The ID of the character.
+            model: The model that answered.
+            prompt_tokens: Tokens in the prompt.
+            completion_tokens: Tokens in the answer.
+            cached_tokens: Prompt tokens served from the API's prompt cache.
+            latency: Request latency in seconds.
+            flags: Combination of the PROMPT_CACHE_HIT, SYSTEM_PROMPT_REUSED,
+                CONTEXT_PREFETCHED, RETRY and HEDGE_DISCARDED bits.
+        """
+        self._buffer.append((datetime.datetime.now().replace(microsecond=0), user_id, character_id, model,
+                             prompt_tokens, completion_tokens, cached_tokens, round(latency * 1000), flags))
+        self.stats["recorded"] += 1
+
+        if len(self._buffer) > self.max_buffer:
+            dropped = len(self._buffer) - self.max_buffer
+            del self._buffer[:dropped]
+            self.stats["dropped"] += dropped
+
+        if len(self._buffer) >= self.flush_size and not self._failing:
+            self._start_flush()
+        elif self._timer is None:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        # Flushes write the records of many turns: they run in an empty context, not in a copy
+        # of the turn that happened to start them (its log context would tag their log lines)
+        self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush,
+                                                            context=contextvars.Context())
+
+    def _start_flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = contextvars.Context().run(asyncio.create_task, self.flush())
+
+    async def flush(self) -> int:
+        """
+        Write every buffered record.
+
+        Returns:
+            The number of records written.
+        """
+        written = 0
+        while self._buffer:
+            batch, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(_write, batch)
+            except Exception as e:
+                # Put them back in front of newer records for the next attempt
+                self._buffer = batch + self._buffer
+                self.stats["flush_errors"] += 1
+                self._failing = True
+                logger.warning(f"Failed to write {len(batch)} usage records: {str(e)}")
+                if self._timer is None:
+                    self._schedule_flush()
+                break
+            written += len(batch)
+            self.stats["written"] += len(batch)
+            self._failing = False
+        return written
+
+    async def drain(self) -> None:
+        """Write the remaining records, e.g. before the bot exits."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self.flush()
+
+    async def forget_user(self, user_id: str) -> int:
+        """
+        Drop the buffered records of a user and wait for a flush already writing some of them,
+        e.g. before the user's usage rows are deleted.
+
+        Returns:
+            The number of records dropped.
+        """
+        kept = [record for record in self._buffer if record[1] != user_id]
+        dropped = len(self._buffer) - len(kept)
+        self._buffer = kept
+        if self._flush_task is not None and not self._flush_task.done():
+            # Records taken by the running flush can't be recalled; they are deleted after it
+            await asyncio.shield(self._flush_task)
+            # A failed flush puts its batch back
+            kept = [record for record in self._buffer if record[1] != user_id]
+            dropped += len(self._buffer) - len(kept)
+            self._buffer = kept
+        return dropped
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and buffer size."""
+        return {**self.stats, "buffered": self.buffered}
+
+
+def _rollup(batch: List[UsageRecord]) -> List[Tuple]:
+    """Per day/character/user/model totals of a batch of records."""
+    totals: Dict[Tuple, List[int]] = {}
+    for recorded_at, user_id, character_id, model, prompt, completion, cached, latency, _ in batch:
+        key = (recorded_at.date(), character_id, user_id, model)
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [1, prompt, completion, cached, latency, latency]
+        else:
+            total[0] += 1
+            total[1] += prompt
+            total[2] += completion
+            total[3] += cached
+            total[4] += latency
+            total[5] = max(total[5], latency)
+    return [key + tuple(total) for key, total in totals.items()]
+
+
+def _write(batch: List[UsageRecord]) -> None:
+    db = get_db_handler()
+    with db.unit_of_work():
+        db.execute_many(
+            "INSERT INTO LLM_Usage (recorded_at, user_id, character_id, model, prompt_tokens, completion_tokens, "
+            "cached_tokens, latency_ms, flags) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            batch)
+        db.execute_many(
+            "INSERT INTO LLM_Usage_Daily (day, character_id, user_id, model, turns, prompt_tokens, "
+            "completion_tokens, cached_tokens, latency_ms_sum, latency_ms_max) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE turns = turns + VALUES(turns), "
+            "prompt_tokens = prompt_tokens + VALUES(prompt_tokens), "
+            "completion_tokens = completion_tokens + VALUES(completion_tokens), "
+            "cached_tokens = cached_tokens + VALUES(cached_tokens), "
+            "latency_ms_sum = latency_ms_sum + VALUES(latency_ms_sum), "
+            "latency_ms_max = GREATEST(latency_ms_max, VALUES(latency_ms_max))",
+            _rollup(batch))
+
+
+def usage_report(group_by: str = "character", days: int = 7, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Heaviest characters, users or models over the last days, from the daily totals.
+
+    Args:
+        group_by: "character", "user" or "model".
+        days: Number of days, today included.
+        limit: Number of rows.
+
+    Returns:
+        Rows with `key`, `name`, `turns`, `prompt_tokens`, `completion_tokens`,
+        `cached_tokens`, `avg_latency_ms` and `max_latency_ms`, by total tokens descending.
+
+    Raises:
+        ValueError: If `group_by` is not supported.
+    """
+    column = GROUP_COLUMNS.get(group_by)
+    if column is None:
+        raise ValueError(f"Cannot group usage by {group_by}")
+    name = {
+        "character_id": "(SELECT name FROM Virtual_Character c WHERE c.character_id = d.character_id)",
+        "user_id"     : "(SELECT username FROM User u WHERE u.user_id = d.user_id)",
+        "model"       : "d.model",
+    }[column]
+
+    return get_db_handler().fetch_all(
+        f"""SELECT d.{column} AS `key`, {name} AS name, SUM(turns) AS turns,
+                   SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,
+                   SUM(cached_tokens) AS cached_tokens,
+                   ROUND(SUM(latency_ms_sum) / SUM(turns)) AS avg_latency_ms, MAX(latency_ms_max) AS max_latency_ms
+            FROM LLM_Usage_Daily d
+            WHERE day > CURRENT_DATE - INTERVAL %s DAY
+            GROUP BY d.{column}
+            ORDER BY SUM(prompt_tokens) + SUM(completion_tokens) DESC
+            LIMIT %s""",
+        (days, limit))
+
+
+def prune_usage(keep_days: int = 90) -> int:
+    """
+    Delete per-turn usage records older than `keep_days`; the daily totals are kept.
+
+    Returns:
+        The number of deleted records.
+    """
+    return get_db_handler().execute(
+        "DELETE FROM LLM_Usage WHERE recorded_at < CURRENT_TIMESTAMP - INTERVAL %s DAY", (keep_days,))
+
+
+_meter: Optional[UsageMeter] = None
+
+
+def get_usage_meter() -> UsageMeter:
+    """Get the process-wide usage meter."""
+    global _meter
+    if _meter is None:
+        _meter = UsageMeter()
+    return _meter
@@ -1,9 +1,11 @@
-from utils.MySQLHandler import MySQLHandler
+from utils.MySQLHandler import get_db_handler
 from chatgame.exceptions import *
+from chatgame.sharding import locate_session
+from chatgame.catalog import get_character_catalog
 
 def validate_user_id(user_id: str) -> bool:
     # Get the database handler instance
-    db = MySQLHandler.get_instance().initialize()
+    db = get_db_handler()
 
     # check if user id exists in database
     result = db.fetch_one(
@@ -15,8 +17,12 @@ def validate_user_id(user_id: str) -> bool:
     return True
 
 def validate_character_id(character_id: str) -> bool:
+    # known characters are answered from the in-memory catalog
+    if character_id in get_character_catalog():
+        return True
+
     # Get the database handler instance
-    db = MySQLHandler.get_instance().initialize()
+    db = get_db_handler()
 
     # check if character id exists in database
     result = db.fetch_one(
@@ -28,14 +34,8 @@ def validate_character_id(character_id: str) -> bool:
     return True
 
 def validate_session_id(session_id: str) -> bool:
-    # Get the database handler instance
-    db = MySQLHandler.get_instance().initialize()
-
-    # check if session id exists in database
-    result = db.fetch_one(
-        "SELECT session_id FROM Chat_Session WHERE session_id = %s", (session_id,))
-
-    if result is None:
+    # check if session id exists on any shard (owner lookups are cached)
+    if locate_session(session_id) is None:
         raise SessionNotFoundError("Session ID not found in database")
 
     return True
\ No newline at end of file
@@ -4,22 +4,23 @@ import sys
 from dotenv import load_dotenv
 
 import nonebot
-from nonebot.adapters.console import Adapter as ConsoleAdapter
 from nonebot.adapters.discord import Adapter as DiscordAdapter
+from nonebot.log import logger as nonebot_logger, logger_id, default_filter
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logger = logging.getLogger("main")
+from utils.StructuredLogging import configure_logging, log_handler
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging once for the whole process: records are queued and written to stdout
+# by a background thread (JSON lines by default, see LOG_FORMAT)
+configure_logging()
+logger = logging.getLogger("main")
+
+# NoneBot logs through loguru, which writes to stdout inline: send its records through the same queue
+nonebot_logger.remove(logger_id)
+nonebot_logger.add(log_handler(), level=0, filter=default_filter, format="{message}")
+
 def init_bot():
     """Initialize the NoneBot application with proper error handling"""
     try:
@@ -28,7 +29,6 @@ def init_bot():
         
         # Register the Discord adapter
         driver = nonebot.get_driver()
-        # driver.register_adapter(ConsoleAdapter)
         driver.register_adapter(DiscordAdapter)
 
         # Verify required environment variables
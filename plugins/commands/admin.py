@@ -0,0 +1,137 @@
+import asyncio
+import os
+import re
+import tempfile
+
+import aiohttp
+
+from nonebot import on_command
+from nonebot.adapters import Bot
+from nonebot.params import CommandArg
+from nonebot.adapters.discord import Message, MessageSegment, MessageEvent
+
+import chatgame
+
+# Create command handler
+admin_cmd = on_command("admin", priority=10, block=True)
+
+usage = ("Usage: !admin purge <@user|discord id|user id> | !admin purges | "
+         "!admin import [skip|update] [dry] (with a .jsonl or .yaml character pack attached)")
+
+MAX_PACK_BYTES = 50 * 1024 * 1024
+
+_MENTION_RE = re.compile(r"^<@!?(\d+)>$")
+_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+async def reply(event: MessageEvent, text: str):
+    await admin_cmd.send(
+        message=Message([
+            MessageSegment.reference(event.message_id),
+            MessageSegment.text(text)
+        ])
+    )
+
+
+@admin_cmd.handle()
+async def command_handler(bot: Bot, event: MessageEvent, args: Message = CommandArg()):
+    # Only administrators may manage users
+    try:
+        user_id = await chatgame.get_user_id(event.get_user_id())
+        allowed = await chatgame.is_admin(user_id)
+    except chatgame.UserNotFoundError:
+        allowed = False
+    if not allowed:
+        await reply(event, "This command is only available to administrators.")
+        return
+
+    words = args.extract_plain_text().split()
+    if words == ["purges"]:
+        await handle_purges(event)
+    elif words and words[0] == "import" and set(words[1:]) <= {"skip", "update", "dry"}:
+        await handle_import(event, user_id, words[1:])
+    elif len(words) == 2 and words[0] == "purge":
+        await handle_purge(event, words[1])
+    else:
+        await reply(event, usage)
+
+
+async def handle_purge(event: MessageEvent, target: str):
+    """Delete a user and all their data in the background"""
+    target = target.lower()
+    mention = _MENTION_RE.match(target)
+    try:
+        if _UUID_RE.match(target):
+            user_id = target
+        else:
+            user_id = await chatgame.get_user_id(mention.group(1) if mention else target)
+    except chatgame.UserNotFoundError:
+        await reply(event, f"No registered user {target}.")
+        return
+
+    if user_id == chatgame.points.SYSTEM_USER_ID:
+        await reply(event, "The System user cannot be purged.")
+        return
+    if chatgame.schedule_purge(user_id):
+        await reply(event, f"Purging user {user_id} in the background. Check progress with `!admin purges`.")
+    else:
+        await reply(event, f"A purge of user {user_id} is already running.")
+
+
+async def handle_purges(event: MessageEvent):
+    """Reply with the most recent purges and their progress"""
+    jobs = chatgame.purge_jobs(limit=10)
+    if not jobs:
+        await reply(event, "No user purges recorded.")
+        return
+    lines = ["Recent user purges:"]
+    for job in jobs:
+        line = f"- {job['user_id']}: {job['status']}, {job['rows_deleted']} rows deleted"
+        if job["status"] != "done" and job["step"]:
+            line += f", at {job['step']}"
+        if job["error"]:
+            line += f" ({job['error'][:200]})"
+        lines.append(line)
+    await reply(event, "\n".join(lines))
+
+
+async def handle_import(event: MessageEvent, user_id: str, options):
+    """Import the character pack attached to the message"""
+    attachments = getattr(event, "attachments", None) or []
+    if len(attachments) != 1:
+        await reply(event, "Attach one .jsonl or .yaml character pack to the command.")
+        return
+    attachment = attachments[0]
+    try:
+        fmt = chatgame.pack_format(attachment.filename)
+    except chatgame.InvalidCharacterPackError as e:
+        await reply(event, str(e))
+        return
+    if attachment.size > MAX_PACK_BYTES:
+        await reply(event, f"Character packs are limited to {MAX_PACK_BYTES // 1024 // 1024} MB.")
+        return
+
+    on_conflict = "update" if "update" in options else "skip" if "skip" in options else "error"
+    # Streamed to a temporary file and imported from there, so the pack is never held in memory
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(attachment.filename)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(attachment.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        f.write(chunk)
+        result = await asyncio.to_thread(chatgame.import_characters, path, fmt, creator_id=user_id,
+                                         on_conflict=on_conflict, dry_run="dry" in options)
+    except chatgame.InvalidCharacterPackError as e:
+        await reply(event, f"Nothing was imported.\n{str(e)[:1800]}")
+        return
+    except aiohttp.ClientError as e:
+        await reply(event, f"Could not download the character pack: {str(e)}")
+        return
+    finally:
+        os.remove(path)
+
+    verb = "Would import" if "dry" in options else "Imported"
+    await reply(event, f"{verb} {result['inserted']} new characters, updated {result['updated']} and skipped "
+                       f"{result['skipped']} of {result['read']} in the pack.")
@@ -1,35 +1,327 @@
-from nonebot import on_message, on_command
+from nonebot import on_message, on_command, on_notice, get_driver
 from nonebot.adapters import Message, Event, Bot
 
-from nonebot.adapters.discord import Message, MessageSegment, MessageEvent
+from nonebot.adapters.discord import Message, MessageSegment, MessageEvent, TypingStartEvent
+from nonebot.drivers import ReverseDriver, HTTPServerSetup, Request, Response, URL
 
 matcher = on_message(
     priority=11,
     block=False
 )
 
-from utils.chatgpt import chat, ChatContext
+from utils.chatgpt import chat, ChatContext, action_queue, get_client, openai_breaker, hedge_policy
+from utils.CircuitBreaker import CircuitOpenError, OPEN, CLOSED
+from utils import CircuitBreaker
+from utils.Metrics import REGISTRY, CONTENT_TYPE, counter, gauge, histogram, monitor_event_loop_lag, serve_metrics
+from utils.Idempotency import IdempotencyGuard
+from utils.SessionActors import SessionActorPool, MailboxFullError
+from utils.AdmissionControl import AdmissionController, OverloadedError
+from utils.StructuredLogging import log_context, bind_log_context, new_trace_id
+from functools import wraps
 import random
 import chatgame
 import asyncio
 import logging
+import os
+import time
+
+logger = logging.getLogger("plugins.chat")
+
+_warm_up_task = None
+
+
+async def _warm_up():
+    # Blocking connects and imports run in worker threads, in parallel with each other
+    try:
+        await asyncio.gather(asyncio.to_thread(chatgame.warm_up), asyncio.to_thread(get_client))
+    except Exception as e:
+        # Everything is created lazily on first use as well, so the bot keeps running
+        logger.warning(f"Warm-up failed, continuing with lazy initialization: {str(e)}")
+
+
+# Prepare the database pool, character catalog and OpenAI client in the background
+# so the Discord gateway connects at the same time instead of waiting for them
+@get_driver().on_startup
+async def start_warm_up():
+    global _warm_up_task
+    _warm_up_task = asyncio.create_task(_warm_up())
+
+
+# Runtime metrics in the Prometheus text format at /metrics: served by the driver when it can
+# serve HTTP, otherwise by a small local server on METRICS_HOST:METRICS_PORT (METRICS_PORT=0 disables it)
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(200, headers={"Content-Type": CONTENT_TYPE}, content=REGISTRY.render())
+
+
+if isinstance(get_driver(), ReverseDriver):
+    get_driver().setup_http_server(HTTPServerSetup(URL("/metrics"), "GET", "metrics", metrics_endpoint))
+
+_metrics_tasks = []
+
+
+@get_driver().on_startup
+async def start_metrics():
+    _metrics_tasks.append(asyncio.create_task(monitor_event_loop_lag()))
+    port = int(os.getenv("METRICS_PORT", "9100"))
+    if not isinstance(get_driver(), ReverseDriver) and port:
+        await serve_metrics(os.getenv("METRICS_HOST", "127.0.0.1"), port)
+
+
+# Fold the points transfers into the balance snapshots every POINTS_COMPACT_SECONDS, so balance
+# reads stay a few rows even for the System user paying out every grant
+_compaction_task = None
+
+
+async def compact_points(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await asyncio.to_thread(chatgame.points.compact_all)
+            if result["accounts"]:
+                logger.info("Compacted points counters", extra=result)
+        except Exception as e:
+            logger.warning(f"Points compaction failed: {str(e)}")
+
+
+@get_driver().on_startup
+async def start_points_compaction():
+    global _compaction_task
+    interval = float(os.getenv("POINTS_COMPACT_SECONDS", "300"))
+    if interval > 0:
+        _compaction_task = asyncio.create_task(compact_points(interval))
+
+
+# Pick up characters added to the table by other processes (e.g. the import script)
+_catalog_refresh_task = None
+
+
+async def refresh_catalog(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await asyncio.to_thread(chatgame.get_character_catalog().refresh):
+                logger.info("Reloaded the character catalog")
+        except Exception as e:
+            logger.warning(f"Character catalog refresh failed: {str(e)}")
+
+
+@get_driver().on_startup
+async def start_catalog_refresh():
+    global _catalog_refresh_task
+    interval = float(os.getenv("CATALOG_REFRESH_SECONDS", "60"))
+    if interval > 0:
+        _catalog_refresh_task = asyncio.create_task(refresh_catalog(interval))
+
+
+# User purges interrupted by a restart continue in the background
+@get_driver().on_startup
+async def start_resume_purges():
+    try:
+        resumed = await chatgame.resume_purges()
+        if resumed:
+            logger.info(f"Resuming {resumed} user purges")
+    except Exception as e:
+        logger.warning(f"Failed to resume user purges: {str(e)}")
+
+
+# Apply memory/affinity updates still queued in the background before the bot exits,
+# and write the buffered usage records
+@get_driver().on_shutdown
+async def drain_action_queue():
+    await action_queue.drain(timeout=30)
+    await chatgame.get_usage_meter().drain()
+
+
+# A user who starts typing is likely about to send a chat turn: load their context in the
+# background so the turn starts with warm caches. Unregistered users are cached as such.
+typing_matcher = on_notice(priority=11, block=False)
+
+
+@typing_matcher.handle()
+async def handle_typing(event: TypingStartEvent):
+    chatgame.prefetch_context(str(event.user_id))
+
+
+# State of the resilience components, read when metrics are scraped
+REGISTRY.register_snapshot("circuit_breaker", "Circuit breaker statistics", CircuitBreaker.snapshot, label="breaker")
+REGISTRY.register_collector(lambda: [("circuit_breaker_open", "gauge", "1 while a breaker rejects calls", [
+    ("circuit_breaker_open", (("breaker", name),), int(state["state"] != CLOSED))
+    for name, state in CircuitBreaker.snapshot().items()])])
+REGISTRY.register_snapshot("prefetch", "Context prefetch statistics", chatgame.prefetch.snapshot)
+REGISTRY.register_snapshot("user_purge", "User purge statistics", chatgame.purge.snapshot)
+REGISTRY.register_snapshot("usage_meter", "Usage metering buffer statistics",
+                           lambda: chatgame.get_usage_meter().snapshot())
+REGISTRY.register_collector(lambda: [("action_queue_pending", "gauge", "Memory/affinity updates waiting",
+                                      [("action_queue_pending", (), action_queue.pending)])])
+if hedge_policy is not None:
+    REGISTRY.register_snapshot("llm_hedging", "Hedged request statistics", hedge_policy.snapshot)
+
+
+# List of template messages in case of no response
+no_msg = [
+    "<Unable to get a response from OPENAI>",
+    "I'm having trouble processing that. Let's try again in a moment.",
+    "My apologies, I seem to be experiencing technical difficulties.",
+]
+
+# Replies sent immediately while OpenAI or the database is unavailable
+outage_msg = [
+    "I can't think straight right now... please try again in a minute.",
+    "My apologies, I'm temporarily unavailable. Let's talk again in a moment.",
+]
+
+
+# Discord message IDs handled recently. Gateway resumes can deliver the same message again,
+# which would otherwise store it twice and pay for a second LLM call.
+message_guard = IdempotencyGuard(ttl=3600)
+
+
+def deduplicated(handler):
+    """Run a message handler once per Discord message; redeliveries wait for the first run and are dropped.
+    Everything logged while handling the message carries its trace ID."""
+    @wraps(handler)
+    async def wrapper(bot: Bot, event: MessageEvent):
+        with log_context(trace_id=new_trace_id(), discord_user=event.get_user_id(),
+                         discord_message=str(event.message_id)):
+            async with message_guard.claim(event.message_id) as first:
+                if first:
+                    await handler(bot, event)
+    return wrapper
+
+
+# Turns of the same chat session run one at a time and in order, so they don't load the same
+# context and interleave replies and affinity updates. A user chats in one session at a time
+# (the one of their current character), so turns are keyed on the Discord user, which is
+# known before any database work.
+session_actors = SessionActorPool(mailbox_size=5)
+
+
+def serialized(handler):
+    """Queue a message handler behind earlier turns of the same user; rejects when too many are queued"""
+    @wraps(handler)
+    async def wrapper(bot: Bot, event: MessageEvent):
+        try:
+            async with session_actors.turn(event.get_user_id()):
+                await handler(bot, event)
+        except MailboxFullError:
+            await matcher.send(
+                message=Message([
+                    MessageSegment.reference(event.message_id),
+                    MessageSegment.text("You're sending messages faster than I can answer... please wait for my reply.")
+                ])
+            )
+    return wrapper
+
+
+# Caps how many turns run at once, overall and per guild, so a burst of messages can't exhaust
+# the database pool or pile up OpenAI calls. Turns that can't start within their deadline
+# are answered with a "busy" reply right away; the limit adapts to observed turn latency.
+admission = AdmissionController(initial_limit=16, max_limit=64, per_key_limit=8, queue_size=100, deadline=10.0)
+
+busy_msg = [
+    "I'm talking to a lot of people right now... please try again in a moment.",
+    "Too many messages at once! Give me a minute and try again.",
+]
+
+
+def admitted(handler):
+    """Run a message handler under admission control, replying "busy" when the turn is shed"""
+    @wraps(handler)
+    async def wrapper(bot: Bot, event: MessageEvent):
+        # Commands don't start a turn, keep them out of the limits and latency statistics
+        if event.content.startswith('!'):
+            return
+        try:
+            async with admission.admit(key=getattr(event, "guild_id", None)):
+                await handler(bot, event)
+        except OverloadedError as e:
+            logger.warning(f"Shedding message {event.message_id}: {e.reason}")
+            await matcher.send(
+                message=Message([
+                    MessageSegment.reference(event.message_id),
+                    MessageSegment.text(random.choice(busy_msg))
+                ])
+            )
+    return wrapper
+
+
+REGISTRY.register_snapshot("admission", "Admission control statistics", admission.snapshot)
+
+chat_turns_in_flight = gauge("chat_turns_in_flight", "Chat turns being handled")
+chat_turn_seconds = histogram("chat_turn_seconds", "Duration of chat turns, from admission to the reply")
+chat_turns = counter("chat_turns", "Chat turns handled, by whether they raised", ["outcome"])
+_turns_ok = chat_turns.labels("ok")
+_turns_error = chat_turns.labels("error")
+
+
+def measured(handler):
+    """Record the number, duration and in-flight count of message handler runs"""
+    @wraps(handler)
+    async def wrapper(bot: Bot, event: MessageEvent):
+        chat_turns_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await handler(bot, event)
+            _turns_ok.inc()
+        except BaseException:
+            _turns_error.inc()
+            raise
+        finally:
+            chat_turns_in_flight.dec()
+            chat_turn_seconds.observe(time.perf_counter() - started)
+    return wrapper
 
 
 @matcher.handle()
+@deduplicated
+@serialized
+@admitted
+@measured
 async def handle_logger(bot: Bot, event: MessageEvent):
     # Ignore messages with command prefix
     if event.content.startswith('!'):
         return
-        
-    # get the internal user id based on the event's discord user id
-    user_discord_id = event.get_user_id()
+
+    started = time.monotonic()
+    # Embedded before the transaction starts, so no connection waits on the embedder
+    query_vector = await chatgame.embed_query(event.content)
+    # Load everything the turn needs on a single connection and transaction
     try:
-        user_id = await chatgame.get_user_id(user_discord_id)
-    except chatgame.UserNotFoundError:
+        async with chatgame.turn():
+            # get the internal user id based on the event's discord user id
+            user_discord_id = event.get_user_id()
+            try:
+                user_id = await chatgame.get_user_id(user_discord_id)
+            except chatgame.UserNotFoundError:
+                return
+
+            # get current character
+            character_id = await chatgame.get_current_character(user_id)
+            if character_id is not None:
+                # get current session
+                session_id = await chatgame.get_latest_session(user_id, character_id)
+                bind_log_context(user_id=user_id, character_id=character_id, session_id=session_id)
+
+                # add user message to the session (the unique Discord message ID catches
+                # redeliveries this process doesn't remember, e.g. after a restart)
+                try:
+                    await chatgame.create_new_message(session_id, event.content, user_id, from_user=True,
+                                                      discord_message_id=str(event.message_id))
+                except chatgame.DuplicateMessageError:
+                    return
+
+                # get context from session
+                context = await chatgame.get_chat_context(session_id, query_vector=query_vector)
+    except CircuitOpenError:
+        # The database is down: answer right away instead of queueing up on it
+        await matcher.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(random.choice(outage_msg))
+            ])
+        )
         return
 
-    # get current character
-    character_id = await chatgame.get_current_character(user_id)
     if character_id is None:
         await matcher.send(
             message=Message([
@@ -39,21 +331,15 @@ async def handle_logger(bot: Bot, event: MessageEvent):
         )
         return
 
-    # get current session
-    session_id = await chatgame.get_latest_session(user_id, character_id)
-
-    # add user message to the session
-    await chatgame.create_new_message(session_id, event.content, user_id, from_user=True)
-
-    # get context from session
-    context = await chatgame.get_chat_context(session_id)
-
-    # List of template messages in case of no response
-    no_msg = [
-        "<Unable to get a response from OPENAI>",
-        "I'm having trouble processing that. Let's try again in a moment.",
-        "My apologies, I seem to be experiencing technical difficulties.",
-    ]
+    # OpenAI is down: reply right away without the typing indicator and retries
+    if openai_breaker.state == OPEN:
+        await matcher.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(random.choice(outage_msg))
+            ])
+        )
+        return
 
     # Send typing indicator
     await matcher.send(
@@ -62,11 +348,16 @@ async def handle_logger(bot: Bot, event: MessageEvent):
         ])
     )
 
+    context_ms = (time.monotonic() - started) * 1000
+
     # Try up to 3 times with exponential backoff
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            msg = await chat(context)
+            # Only the first attempt is hedged, retries are extra requests already
+            chat_started = time.monotonic()
+            msg = await chat(context, hedge=attempt == 0, retry=attempt > 0)
+            chat_ms = (time.monotonic() - chat_started) * 1000
             if msg:
                 await chatgame.create_new_message(session_id, msg, None, from_user=False)
                 await matcher.send(
@@ -74,12 +365,20 @@ async def handle_logger(bot: Bot, event: MessageEvent):
                         MessageSegment.text(msg)
                     ])
                 )
+                logger.info("Chat turn completed", extra={"attempts": attempt + 1, "timings": {
+                    "context_ms": round(context_ms, 1),
+                    "chat_ms"   : round(chat_ms, 1),
+                    "total_ms"  : round((time.monotonic() - started) * 1000, 1),
+                }})
                 return
             else:
                 # Wait briefly before retry
                 await asyncio.sleep(1 * (2 ** attempt))  # Exponential backoff
+        except CircuitOpenError:
+            # Stop retrying once a breaker opened
+            break
         except Exception as e:
-            logging.error(f"Error in chat attempt {attempt+1}: {str(e)}")
+            logger.error(f"Error in chat attempt {attempt+1}: {str(e)}")
             if attempt < max_retries - 1:
                 # Wait before retry
                 await asyncio.sleep(1 * (2 ** attempt))  # Exponential backoff
@@ -88,6 +387,7 @@ async def handle_logger(bot: Bot, event: MessageEvent):
                 break
 
     # If we get here, all attempts failed
+    logger.warning("Chat turn failed", extra={"timings": {"total_ms": round((time.monotonic() - started) * 1000, 1)}})
     await matcher.send(
         message=Message([
             MessageSegment.reference(event.message_id),
@@ -0,0 +1,134 @@
+import asyncio
+import os
+from typing import Optional
+
+from nonebot import on_command
+from nonebot.adapters import Bot
+from nonebot.params import CommandArg
+from nonebot.adapters.discord import Message, MessageSegment, MessageEvent
+
+from utils.Profiler import get_profiler, format_summary, ProfilerBusyError
+import chatgame
+
+# Create command handler
+debug_cmd = on_command("debug", priority=10, block=True)
+
+usage = "Usage: !debug profile [seconds] [nomem] | !debug usage [character|user|model] [days]"
+
+MAX_PROFILE_SECONDS = 300
+# Discord rejects larger uploads for bots in servers without boosts
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024
+
+
+@debug_cmd.handle()
+async def command_handler(bot: Bot, event: MessageEvent, args: Message = CommandArg()):
+    # Only administrators may inspect the bot process
+    try:
+        user_id = await chatgame.get_user_id(event.get_user_id())
+        allowed = await chatgame.is_admin(user_id)
+    except chatgame.UserNotFoundError:
+        allowed = False
+    if not allowed:
+        await debug_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text("This command is only available to administrators.")
+            ])
+        )
+        return
+
+    words = args.extract_plain_text().split()
+    if words and words[0] == "usage":
+        await handle_usage(event, words[1:])
+        return
+    if not words or words[0] != "profile":
+        await debug_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(usage)
+            ])
+        )
+        return
+
+    try:
+        seconds = int(words[1]) if len(words) > 1 else 30
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        await debug_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(f"Profile duration must be between 1 and {MAX_PROFILE_SECONDS} seconds.")
+            ])
+        )
+        return
+    memory = "nomem" not in words[2:]
+
+    await debug_cmd.send(
+        message=Message([
+            MessageSegment.reference(event.message_id),
+            MessageSegment.text(f"Profiling the bot for {seconds}s...")
+        ])
+    )
+    try:
+        summary = await get_profiler().profile(seconds, memory=memory)
+    except ProfilerBusyError:
+        await debug_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text("A profile is already running, please wait for it to finish.")
+            ])
+        )
+        return
+
+    # Summary in the reply; the collapsed stacks (flamegraph input) attached when small enough
+    text = format_summary(summary, top=8)
+    segments = [
+        MessageSegment.reference(event.message_id),
+        MessageSegment.text(f"```\n{text[:1800]}```\nSaved to `{summary['folded_path']}`")
+    ]
+    content = await asyncio.to_thread(read_attachment, summary["folded_path"])
+    if content is not None:
+        segments.append(MessageSegment.attachment(os.path.basename(summary["folded_path"]), content=content))
+    await debug_cmd.send(message=Message(segments))
+
+
+def read_attachment(path: str) -> Optional[bytes]:
+    """Content of a file if it is small enough to be attached, else None"""
+    if os.path.getsize(path) > MAX_ATTACHMENT_BYTES:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def handle_usage(event: MessageEvent, words):
+    """Reply with the heaviest characters, users or models by LLM tokens"""
+    group_by = words[0] if words else "character"
+    try:
+        days = int(words[1]) if len(words) > 1 else 7
+        rows = chatgame.usage_report(group_by, days=days, limit=10)
+    except ValueError:
+        await debug_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(usage)
+            ])
+        )
+        return
+
+    if not rows:
+        response = f"No usage recorded in the last {days} days."
+    else:
+        lines = [f"Top {group_by}s by tokens, last {days} days:"]
+        for row in rows:
+            lines.append(f"- {row['name'] or row['key']}: {row['turns']} turns, "
+                         f"{row['prompt_tokens']} prompt / {row['completion_tokens']} completion tokens "
+                         f"({row['cached_tokens']} cached), {row['avg_latency_ms']} ms avg, "
+                         f"{row['max_latency_ms']} ms max")
+        response = "\n".join(lines)
+    await debug_cmd.send(
+        message=Message([
+            MessageSegment.reference(event.message_id),
+            MessageSegment.text(response)
+        ])
+    )
@@ -0,0 +1,53 @@
+import tempfile
+from datetime import datetime
+
+from nonebot import on_command
+from nonebot.adapters import Bot
+from nonebot.adapters.discord import Message, MessageSegment, MessageEvent
+
+import chatgame
+
+# Create command handler
+export_cmd = on_command("export", priority=10, block=True)
+
+# Discord rejects larger uploads for bots in servers without boosts
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024
+
+
+@export_cmd.handle()
+async def command_handler(bot: Bot, event: MessageEvent):
+    try:
+        user_id = await chatgame.get_user_id(event.get_user_id())
+    except chatgame.UserNotFoundError:
+        await export_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text("User not found. Please register first.")
+            ])
+        )
+        return
+
+    # Compress into a temporary file on disk so memory use stays flat while exporting
+    with tempfile.TemporaryFile() as export_file:
+        counts = await chatgame.export_user_history(user_id, export_file)
+        size = export_file.tell()
+
+        if size > MAX_ATTACHMENT_BYTES:
+            await export_cmd.send(
+                message=Message([
+                    MessageSegment.reference(event.message_id),
+                    MessageSegment.text(f"Your export is {size / 1024 / 1024:.1f} MB, which is larger than "
+                                        f"Discord allows. Please contact an admin.")
+                ])
+            )
+            return
+
+        export_file.seek(0)
+        filename = f"chat-export-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz"
+        await export_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(f"Exported {counts['sessions']} sessions and {counts['messages']} messages."),
+                MessageSegment.attachment(filename, content=export_file.read())
+            ])
+        )
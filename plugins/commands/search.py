@@ -0,0 +1,79 @@
+import re
+
+from nonebot import on_command
+from nonebot.adapters import Bot
+from nonebot.adapters.discord import Message, MessageSegment, MessageEvent
+from nonebot.params import CommandArg
+
+import chatgame
+
+# Create command handler
+search_cmd = on_command("search", priority=10, block=True)
+
+PAGE_SIZE = 10
+SNIPPET_LENGTH = 150
+PAGE_ARG = re.compile(r"\s+(?:-p|--page)\s+(\d+)\s*$")
+
+
+def _snippet(content: str) -> str:
+    content = " ".join(content.split())
+    return content if len(content) <= SNIPPET_LENGTH else content[:SNIPPET_LENGTH - 3] + "..."
+
+
+@search_cmd.handle()
+async def command_handler(bot: Bot, event: MessageEvent, args: Message = CommandArg()):
+    # Get the search terms and optional page number (e.g. "!search pizza dog -p 2")
+    text = " " + args.extract_plain_text().strip()
+    page = 1
+    match = PAGE_ARG.search(text)
+    if match:
+        page = int(match.group(1))
+        text = text[:match.start()]
+    terms = text.strip()
+
+    if not terms:
+        await search_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text("Usage: !search <terms> [-p <page>]")
+            ])
+        )
+        return
+
+    try:
+        user_id = await chatgame.get_user_id(event.get_user_id())
+    except chatgame.UserNotFoundError:
+        await search_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text("User not found. Please register first.")
+            ])
+        )
+        return
+
+    found = await chatgame.search_messages(user_id, terms, page=page, page_size=PAGE_SIZE)
+    if not found["results"]:
+        response = f"No messages found for '{terms}'" + (f" on page {page}." if page > 1 else ".")
+    else:
+        names = {}
+        lines = [f"Messages matching '{terms}' (page {found['page']}):"]
+        for result in found["results"]:
+            character_id = result["character_id"]
+            if character_id not in names:
+                try:
+                    names[character_id] = (await chatgame.get_character_info(character_id))["name"]
+                except chatgame.CharacterNotFoundError:
+                    names[character_id] = "Unknown character"
+            author = "You" if result["from_user"] else names[character_id]
+            lines.append(f"- [{names[character_id]}, {result['timestamp']:%Y-%m-%d %H:%M}] "
+                         f"{author}: {_snippet(result['content'])}")
+        if found["has_more"]:
+            lines.append(f"More results: !search {terms} -p {found['page'] + 1}")
+        response = "\n".join(lines)
+
+    await search_cmd.send(
+        message=Message([
+            MessageSegment.reference(event.message_id),
+            MessageSegment.text(response)
+        ])
+    )
@@ -11,14 +11,14 @@ select_cmd = on_command("select", priority=10, block=True)
 
 @select_cmd.handle()
 async def command_handler(bot: Bot, event: MessageEvent, args: Message = CommandArg()):
-    # Get the character_id from message arguments
-    character_id = args.extract_plain_text().strip()
+    # Get the character name or ID from message arguments
+    query = args.extract_plain_text().strip()
     
-    if not character_id:
+    if not query:
         await select_cmd.send(
             message=Message([
                 MessageSegment.reference(event.message_id),
-                MessageSegment.text("Please provide a character ID.")
+                MessageSegment.text("Please provide a character name or ID.")
             ])
         )
         return
@@ -36,19 +36,26 @@ async def command_handler(bot: Bot, event: MessageEvent, args: Message = Command
         )
         return
 
+    # Resolve the name or ID in-process through the character catalog
+    character, suggestions = await chatgame.find_character(query)
+    if character is None:
+        response = f"Character '{query}' not found."
+        if suggestions:
+            response += " Did you mean: " + ", ".join(c["name"] for c in suggestions) + "?"
+        await select_cmd.send(
+            message=Message([
+                MessageSegment.reference(event.message_id),
+                MessageSegment.text(response)
+            ])
+        )
+        return
+
     # Try to select the character
     try:
-        await chatgame.change_current_character(user_id, character_id)
-        character = await chatgame.get_character_info(character_id)
-        if character is None:
-            await select_cmd.send(
-                message=Message([
-                    MessageSegment.reference(event.message_id),
-                    MessageSegment.text(f"Character '{character_id}' not found.")
-                ])
-            )
-            return
-        
+        await chatgame.change_current_character(user_id, character["character_id"])
+        # The user is about to chat with the character: load its session context in the background
+        chatgame.prefetch_context(user_discord_id)
+
         # Send success message if everything works
         await select_cmd.send(
             message=Message([
@@ -0,0 +1,59 @@
+"""
+Import a character pack into the database.
+
+A pack is a JSON Lines file (one character per line) or a YAML file (a list of characters,
+or one character per `---` separated document). Every character has a `name`, a
+`description` and `settings` (the prompt describing it), and optionally a `character_id`:
+
+    {"name": "Elara", "description": "A wise elven mage", "settings": "You are Elara, ..."}
+
+The pack is validated while it is read, and imported in a single transaction: if any
+record is invalid or its name is taken, nothing is imported and the problems are listed.
+A running bot picks the new characters up the next time its catalog is loaded (restart it,
+or import through `!admin import` instead).
+
+Usage:
+    python scripts/import_characters.py characters.jsonl --dry-run
+    python scripts/import_characters.py characters.yaml --on-conflict skip
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatgame.exceptions import InvalidCharacterPackError
+from chatgame.packs import CONFLICT_MODES, import_characters
+from chatgame.points import SYSTEM_USER_ID
+
+
+def main(args: argparse.Namespace) -> int:
+    started = time.perf_counter()
+    try:
+        result = import_characters(args.pack, creator_id=args.creator, on_conflict=args.on_conflict,
+                                   batch_size=args.batch, dry_run=args.dry_run)
+    except InvalidCharacterPackError as e:
+        print(f"Nothing was imported. {str(e)}", file=sys.stderr)
+        return 1
+
+    print(f"{'Would import' if args.dry_run else 'Imported'} {result['inserted']} new characters, "
+          f"updated {result['updated']} and skipped {result['skipped']} of {result['read']} "
+          f"in {time.perf_counter() - started:.1f}s.")
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Import a JSONL or YAML character pack.")
+    parser.add_argument("pack", help="path of the .jsonl or .yaml pack")
+    parser.add_argument("--on-conflict", choices=CONFLICT_MODES, default="error",
+                        help="characters whose name already exists: reject the pack (default), skip them, "
+                             "or update their description and settings")
+    parser.add_argument("--creator", default=SYSTEM_USER_ID, help="user ID recorded as creator (default System)")
+    parser.add_argument("--batch", type=int, default=1000, help="rows per insert batch")
+    parser.add_argument("--dry-run", action="store_true", help="only validate the pack")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
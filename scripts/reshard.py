@@ -0,0 +1,126 @@
+"""
+Move per-user rows between shard layouts.
+
+Reads the current layout from the environment (DATABASE_SHARDS, or the main database
+when it is unset) and a target layout from a JSON file in the same format, then moves
+every user whose shard changes. `Chat_Session`, `Message`, `Memory`, `Affinity` and
+`Customization` rows are copied with INSERT IGNORE and only then deleted from the old
+shard, so an interrupted run can simply be started again.
+
+Stop the bot while resharding and update DATABASE_SHARDS to the target layout before
+starting it again.
+
+Usage:
+    python scripts/reshard.py --target shards.json --dry-run
+    python scripts/reshard.py --target shards.json --batch 500
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mysql.connector import pooling
+
+from utils.MySQLHandler import MySQLHandler, ShardHandler, shard_index
+
+# Tables moved with a user, parents first. Message rows are selected through the user's sessions.
+USER_TABLES = ["Chat_Session", "Memory", "Affinity", "Customization"]
+MESSAGE_SELECT = ("SELECT m.* FROM Message m JOIN Chat_Session s ON s.session_id = m.session_id "
+                  "WHERE s.user_id = %s")
+MESSAGE_DELETE = "DELETE m FROM Message m JOIN Chat_Session s ON s.session_id = m.session_id WHERE s.user_id = %s"
+
+
+def location(config: Dict[str, Any]) -> Tuple[str, str, str]:
+    """Physical identity of a database, used to detect users that do not actually move."""
+    return str(config.get("host")), str(config.get("port")), str(config.get("database"))
+
+
+def build_target(db: MySQLHandler, overrides: List[Dict[str, Any]]) -> List[Tuple[ShardHandler, Tuple]]:
+    """Open a pool for every shard of the target layout."""
+    shards = []
+    for i, override in enumerate(overrides or [{}]):
+        config = {**db.config, **override}
+        pool = pooling.MySQLConnectionPool(pool_name=f"reshard_target{i}", pool_size=2, **config)
+        shards.append((ShardHandler(i, pool), location(config)))
+    return shards
+
+
+def copy_rows(target: ShardHandler, table: str, rows: List[Dict[str, Any]], batch: int) -> None:
+    if not rows:
+        return
+    columns = list(rows[0])
+    query = (f"INSERT IGNORE INTO {table} ({', '.join(columns)}) "
+             f"VALUES ({', '.join(['%s'] * len(columns))})")
+    for i in range(0, len(rows), batch):
+        target.execute_many(query, [tuple(row[c] for c in columns) for row in rows[i:i + batch]])
+
+
+def move_user(user_id: str, source: ShardHandler, target: ShardHandler, batch: int) -> int:
+    """
+    Copy a user's rows to the target shard, then delete them from the source shard.
+
+    Returns:
+        Number of rows moved
+    """
+    moved = 0
+    for table in USER_TABLES:
+        rows = source.fetch_all(f"SELECT * FROM {table} WHERE user_id = %s", (user_id,))
+        copy_rows(target, table, rows, batch)
+        moved += len(rows)
+    # Messages after sessions, so the session foreign key is satisfied on the target
+    rows = source.fetch_all(MESSAGE_SELECT, (user_id,))
+    copy_rows(target, "Message", rows, batch)
+    moved += len(rows)
+
+    source.execute(MESSAGE_DELETE, (user_id,))
+    for table in reversed(USER_TABLES):
+        source.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
+    return moved
+
+
+def main(args: argparse.Namespace) -> None:
+    db = MySQLHandler.get_instance().initialize()
+    with open(args.target) as f:
+        target_layout = json.load(f)
+
+    source_locations = [location({**db.config, **override}) for override in (db.shard_configs or [{}])]
+    target = build_target(db, target_layout)
+    print(f"Resharding {len(db.shards)} -> {len(target)} shards{' (dry run)' if args.dry_run else ''}")
+
+    last_user, users, moving, rows = "", 0, 0, 0
+    while True:
+        page = db.fetch_all("SELECT user_id FROM User WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                            (last_user, args.batch))
+        if not page:
+            break
+        for row in page:
+            user_id = row["user_id"]
+            users += 1
+            src = shard_index(user_id, len(db.shards))
+            dst = shard_index(user_id, len(target))
+            target_shard, target_location = target[dst]
+            if source_locations[src] == target_location:
+                continue
+            moving += 1
+            if not args.dry_run:
+                rows += move_user(user_id, db.shards[src], target_shard, args.batch)
+        last_user = page[-1]["user_id"]
+        print(f"  scanned {users} users, {moving} moving, {rows} rows moved")
+
+    print(f"Done: {moving}/{users} users {'would move' if args.dry_run else 'moved'}, {rows} rows.")
+    print("Set DATABASE_SHARDS to the target layout before restarting the bot.")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Move per-user rows to a new shard layout.")
+    parser.add_argument("--target", required=True, help="JSON file with the target DATABASE_SHARDS list")
+    parser.add_argument("--batch", type=int, default=500, help="users per page and rows per insert batch")
+    parser.add_argument("--dry-run", action="store_true", help="only count the users that would move")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -17,16 +17,22 @@ DROP INDEX IF EXISTS idx_virtual_character_name ON Virtual_Character;
 DROP INDEX IF EXISTS idx_transaction_sender ON Transaction;
 DROP INDEX IF EXISTS idx_transaction_receiver ON Transaction;
 DROP INDEX IF EXISTS idx_message_from_user ON Message;
+DROP INDEX IF EXISTS idx_message_id ON Message;
+DROP INDEX IF EXISTS idx_message_content ON Message;
 DROP INDEX IF EXISTS idx_interaction_time ON Interaction;
 DROP INDEX IF EXISTS idx_affinity_value ON Affinity;
 
 -- Drop tables with foreign key constraints first
+DROP TABLE IF EXISTS Purge_Job;
+DROP TABLE IF EXISTS LLM_Usage_Daily;
+DROP TABLE IF EXISTS LLM_Usage;
 DROP TABLE IF EXISTS Affinity;
 DROP TABLE IF EXISTS Customization;
 DROP TABLE IF EXISTS Memory;
 DROP TABLE IF EXISTS Interaction;
 DROP TABLE IF EXISTS Chat_Session;
 DROP TABLE IF EXISTS Message;
+DROP TABLE IF EXISTS Points_Counter;
 DROP TABLE IF EXISTS Transaction;
 DROP TABLE IF EXISTS Virtual_Character;
 DROP TABLE IF EXISTS User;
\ No newline at end of file
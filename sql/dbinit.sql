@@ -35,6 +35,18 @@ CREATE TABLE Transaction
     FOREIGN KEY (receiver_id) REFERENCES User (user_id)
 );
 
+-- Balance changes not folded into User.points_balance yet: a balance is the snapshot plus the
+-- sum of its rows. Busy accounts (the System user) spread their transfers over several slots
+-- so concurrent grants don't wait on one row lock, see chatgame/points.py
+CREATE TABLE Points_Counter
+(
+    user_id CHAR(36)         NOT NULL,
+    slot    TINYINT UNSIGNED NOT NULL,
+    delta   BIGINT           NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, slot),
+    FOREIGN KEY (user_id) REFERENCES User (user_id)
+);
+
 -- Moving Chat_Session before Message to fix circular reference
 CREATE TABLE Chat_Session
 (
@@ -43,6 +55,11 @@ CREATE TABLE Chat_Session
     character_id CHAR(36) NOT NULL,
     is_active    BOOLEAN   DEFAULT TRUE,
     start_time   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_active   TIMESTAMP NULL DEFAULT NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    token_count   INT NOT NULL DEFAULT 0,
+    summary       TEXT,
+    INDEX idx_session_active (user_id, character_id, is_active, start_time),
     FOREIGN KEY (user_id) REFERENCES User (user_id),
     FOREIGN KEY (character_id) REFERENCES Virtual_Character (character_id)
 );
@@ -54,7 +71,9 @@ CREATE TABLE Message
     from_user  CHAR(36),
     content    TEXT     NOT NULL,
     timestamp  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    discord_message_id VARCHAR(32),
     PRIMARY KEY (session_id, message_id),
+    UNIQUE KEY uq_message_discord_message_id (discord_message_id),
     FOREIGN KEY (from_user) REFERENCES User (user_id),
     FOREIGN KEY (session_id) REFERENCES Chat_Session (session_id)
 );
@@ -101,12 +120,63 @@ CREATE TABLE Affinity
     FOREIGN KEY (user_id) REFERENCES User (user_id),
     FOREIGN KEY (character_id) REFERENCES Virtual_Character (character_id)
 );
+-- One row per chat turn sent to the AI model (USAGE is a reserved word, hence the prefix)
+CREATE TABLE LLM_Usage
+(
+    usage_id          BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    recorded_at       TIMESTAMP         NOT NULL,
+    user_id           CHAR(36)          NOT NULL,
+    character_id      CHAR(36)          NOT NULL,
+    model             VARCHAR(32)       NOT NULL,
+    prompt_tokens     INT UNSIGNED      NOT NULL,
+    completion_tokens INT UNSIGNED      NOT NULL,
+    cached_tokens     INT UNSIGNED      NOT NULL DEFAULT 0,
+    latency_ms        INT UNSIGNED      NOT NULL,
+    flags             TINYINT UNSIGNED  NOT NULL DEFAULT 0, -- see chatgame/usage.py
+    INDEX idx_usage_time (recorded_at),
+    INDEX idx_usage_character_time (character_id, recorded_at),
+    INDEX idx_usage_user_time (user_id, recorded_at)
+);
+
+-- Daily totals of LLM_Usage, maintained when usage records are flushed
+CREATE TABLE LLM_Usage_Daily
+(
+    day               DATE            NOT NULL,
+    character_id      CHAR(36)        NOT NULL,
+    user_id           CHAR(36)        NOT NULL,
+    model             VARCHAR(32)     NOT NULL,
+    turns             INT UNSIGNED    NOT NULL,
+    prompt_tokens     BIGINT UNSIGNED NOT NULL,
+    completion_tokens BIGINT UNSIGNED NOT NULL,
+    cached_tokens     BIGINT UNSIGNED NOT NULL,
+    latency_ms_sum    BIGINT UNSIGNED NOT NULL,
+    latency_ms_max    INT UNSIGNED    NOT NULL,
+    PRIMARY KEY (day, character_id, user_id, model),
+    INDEX idx_usage_daily_user (user_id, day)
+);
+
+-- Progress of user deletions (chatgame/purge.py), so an interrupted purge resumes where it stopped.
+-- No foreign key: the User row is the last thing deleted.
+CREATE TABLE Purge_Job
+(
+    user_id      CHAR(36) PRIMARY KEY,
+    discord_id   VARCHAR(100)    NOT NULL,
+    status       VARCHAR(16)     NOT NULL DEFAULT 'running', -- running, failed or done
+    step         VARCHAR(32)     NOT NULL DEFAULT '',
+    rows_deleted BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    error        TEXT,
+    started_at   TIMESTAMP       NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at   TIMESTAMP       NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
 -- create index
 CREATE INDEX idx_user_discord_id ON User (discord_id);
 CREATE INDEX idx_virtual_character_name ON Virtual_Character (name);
 CREATE INDEX idx_transaction_sender ON Transaction (sender_id);
 CREATE INDEX idx_transaction_receiver ON Transaction (receiver_id);
 CREATE INDEX idx_message_from_user ON Message (from_user);
+CREATE INDEX idx_message_id ON Message (message_id);
+CREATE FULLTEXT INDEX idx_message_content ON Message (content);
 CREATE INDEX idx_interaction_time ON Interaction (timestamp);
 CREATE INDEX idx_affinity_value ON Affinity (value);
 
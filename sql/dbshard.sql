@@ -0,0 +1,62 @@
+-- Schema of a shard database, used when DATABASE_SHARDS is configured.
+-- Load it into every shard database, e.g.: mysql -h <host> -P <port> chatgame_s0 < sql/dbshard.sql
+-- User and Virtual_Character stay on the main database (sql/dbinit.sql), so the
+-- foreign keys pointing at them cannot be enforced here and are left out.
+
+CREATE TABLE Chat_Session
+(
+    session_id   CHAR(36) PRIMARY KEY,
+    user_id      CHAR(36) NOT NULL,
+    character_id CHAR(36) NOT NULL,
+    is_active    BOOLEAN   DEFAULT TRUE,
+    start_time   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_active   TIMESTAMP NULL DEFAULT NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    token_count   INT NOT NULL DEFAULT 0,
+    summary       TEXT,
+    INDEX idx_session_active (user_id, character_id, is_active, start_time)
+);
+
+CREATE TABLE Message
+(
+    session_id CHAR(36) NOT NULL,
+    message_id CHAR(36),
+    from_user  CHAR(36),
+    content    TEXT     NOT NULL,
+    timestamp  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    discord_message_id VARCHAR(32),
+    PRIMARY KEY (session_id, message_id),
+    UNIQUE KEY uq_message_discord_message_id (discord_message_id),
+    FOREIGN KEY (session_id) REFERENCES Chat_Session (session_id)
+);
+
+CREATE TABLE Memory
+(
+    user_id      CHAR(36) NOT NULL,
+    character_id CHAR(36) NOT NULL,
+    summary_text TEXT,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, character_id)
+);
+
+CREATE TABLE Customization
+(
+    user_id      CHAR(36)     NOT NULL,
+    character_id CHAR(36)     NOT NULL,
+    attribute    VARCHAR(100) NOT NULL,
+    value        VARCHAR(100),
+    PRIMARY KEY (user_id, character_id, attribute)
+);
+
+CREATE TABLE Affinity
+(
+    character_id CHAR(36) NOT NULL,
+    user_id      CHAR(36) NOT NULL,
+    value        INT CHECK (value BETWEEN 0 AND 100),
+    PRIMARY KEY (user_id, character_id)
+);
+
+CREATE INDEX idx_message_from_user ON Message (from_user);
+CREATE INDEX idx_message_id ON Message (message_id);
+CREATE FULLTEXT INDEX idx_message_content ON Message (content);
+CREATE INDEX idx_affinity_value ON Affinity (value);
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from chatgame.catalog import get_character_catalog
+from chatgame.exceptions import InvalidCharacterPackError
+from chatgame.packs import import_characters
+
+
+@pytest.fixture(autouse=True)
+def catalog():
+    # The catalog the names are checked against, without a database
+    catalog = get_character_catalog()
+    catalog.replace([{"character_id": "00000000-0000-0000-0000-000000000001", "name": "King Husky",
+                      "description": "Northeastern.", "settings": "You are King Husky."}])
+    yield catalog
+    catalog.replace([])
+    catalog.loaded = False
+
+
+def test_dry_run_reads_jsonl_and_yaml_packs():
+    jsonl = ('{"name": "Elara", "description": "A mage", "settings": "You are Elara."}\n\n'
+             '{"name": "Brutus", "description": "A warrior", "settings": "You are Brutus."}\n')
+    assert import_characters(io.StringIO(jsonl), "jsonl", dry_run=True) == {
+        "read": 2, "inserted": 2, "updated": 0, "skipped": 0}
+
+    pytest.importorskip("yaml")
+    yaml = ("name: Luna\ndescription: A fortune teller\nsettings: You are Luna.\n---\n"
+            "- name: Orion\n  description: A hunter\n  settings: You are Orion.\n")
+    assert import_characters(io.StringIO(yaml), "yaml", dry_run=True)["inserted"] == 2
+
+
+def test_invalid_and_conflicting_records_reject_the_pack():
+    pack = ('{"name": "Elara", "description": "A mage", "settings": "You are Elara."}\n'
+            '{"name": "elara", "description": "Again", "settings": "You are Elara."}\n'
+            '{"name": "king husky", "description": "Taken", "settings": "You are a husky."}\n'
+            '{"name": "Nova", "description": "", "settings": "You are Nova."}\n')
+    with pytest.raises(InvalidCharacterPackError) as error:
+        import_characters(io.StringIO(pack), "jsonl", dry_run=True)
+    message = str(error.value)
+    assert "line 2: name elara appears twice" in message
+    assert "line 3: a character named king husky already exists" in message
+    assert "line 4: description must be a non-empty string" in message
+
+    skipped = import_characters(io.StringIO(pack.splitlines()[2]), "jsonl", on_conflict="skip", dry_run=True)
+    assert skipped == {"read": 1, "inserted": 0, "updated": 0, "skipped": 1}
+
+    # Updating King Husky under an ID that isn't his would drop that ID silently
+    renamed = ('{"character_id": "00000000-0000-0000-0000-000000000002", "name": "King Husky", '
+               '"description": "Taken", "settings": "You are a husky."}')
+    with pytest.raises(InvalidCharacterPackError) as error:
+        import_characters(io.StringIO(renamed), "jsonl", on_conflict="update", dry_run=True)
+    assert "already exists with character_id 00000000-0000-0000-0000-000000000001" in str(error.value)
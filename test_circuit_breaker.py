@@ -0,0 +1,53 @@
+import pytest
+
+from utils.CircuitBreaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail(breaker):
+    with pytest.raises(ConnectionError):
+        with breaker.guard():
+            raise ConnectionError("down")
+
+
+def test_circuit_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_rate=0.5, window=10, min_calls=4, open_seconds=5, clock=clock)
+
+    for _ in range(2):
+        with breaker.guard():
+            pass
+    fail(breaker)
+    assert breaker.state == CLOSED
+    fail(breaker)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # After the open period one trial call is let through, and its success closes the breaker
+    clock.now = 5
+    assert breaker.state == HALF_OPEN
+    with breaker.guard():
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+    assert breaker.state == CLOSED
+
+
+def test_circuit_breaker_ignores_non_failures():
+    breaker = CircuitBreaker("test", min_calls=1, is_failure=lambda e: isinstance(e, ConnectionError))
+
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError("bad input")
+    assert breaker.state == CLOSED
+
+    fail(breaker)
+    assert breaker.state == OPEN
@@ -1,9 +1,10 @@
-import chatgame
+from utils.MySQLHandler import MySQLHandler
 from mysql.connector import Error
 
 def test_database_connection():
     try:
-        conn = chatgame.get_db_connection()
+        db = MySQLHandler.get_instance().initialize()
+        conn = db.pool.get_connection()
         if conn.is_connected():
             db_info = conn.get_server_info()
             print(f"Connected to MySQL Server version {db_info}")
@@ -14,7 +15,7 @@ def test_database_connection():
             print("Available databases:")
             for db in databases:
                 print(f"- {db[0]}")
-                
+
             return True
     except Error as e:
         print(f"Error while connecting to MySQL: {e}")
@@ -23,4 +24,4 @@ def test_database_connection():
         if 'conn' in locals() and conn.is_connected():
             cursor.close()
             conn.close()
-            print("MySQL connection is closed")
\ No newline at end of file
+            print("MySQL connection is closed")
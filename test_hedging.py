@@ -0,0 +1,76 @@
+import asyncio
+
+from utils.Hedging import HedgePolicy
+
+
+def test_slow_request_is_hedged_within_budget():
+    async def scenario():
+        policy = HedgePolicy(budget=1.0, burst=1.0, min_samples=3, min_delay=0.01)
+        for _ in range(3):
+            policy.record(0.01)
+
+        calls = []
+
+        async def request():
+            calls.append(len(calls))
+            # The original attempt hangs, the hedge answers quickly
+            await asyncio.sleep(10 if len(calls) == 1 else 0.01)
+            return len(calls)
+
+        result = await asyncio.wait_for(policy.run(request), timeout=1)
+        assert result == 2
+        assert policy.stats == {"requests": 1, "hedged": 1, "hedge_wins": 1}
+
+        # Out of tokens: the next slow request is not hedged
+        policy.budget = 0.0
+
+        async def slow_request():
+            await asyncio.sleep(0.05)
+            return "slow"
+
+        assert await policy.run(slow_request) == "slow"
+        assert policy.stats["hedged"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_no_hedge_before_enough_samples():
+    async def scenario():
+        policy = HedgePolicy(budget=1.0, min_samples=5)
+
+        async def request():
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        assert policy.delay() is None
+        assert await policy.run(request) == "ok"
+        assert policy.stats["hedged"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_losing_attempt_is_reported():
+    async def scenario():
+        policy = HedgePolicy(budget=1.0, burst=1.0, min_samples=3, min_delay=0.01)
+        for _ in range(3):
+            policy.record(0.01)
+
+        calls = []
+
+        async def request():
+            calls.append(len(calls))
+            await asyncio.sleep(10 if len(calls) == 1 else 0.01)
+            return "answer"
+
+        discarded = []
+        assert await policy.run(request, on_discarded=lambda *attempt: discarded.append(attempt)) == "answer"
+        # The original attempt was cancelled without answering
+        assert len(discarded) == 1 and discarded[0][0] is None and discarded[0][1] > 0
+
+        # Nothing is reported for a request that wasn't hedged
+        discarded.clear()
+        policy.budget = 0.0
+        await policy.run(request, on_discarded=lambda *attempt: discarded.append(attempt))
+        assert discarded == []
+
+    asyncio.run(scenario())
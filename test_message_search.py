@@ -0,0 +1,12 @@
+from chatgame.chat import _fulltext_query
+
+
+def test_unindexed_words_are_not_required():
+    # Stopwords and words shorter than innodb_ft_min_token_size are not in the index
+    assert _fulltext_query("Where is the dragon of Ys?") == "+dragon*"
+    assert _fulltext_query("THE Castle, at night") == "+Castle* +night*"
+    # Operator characters can't be injected
+    assert _fulltext_query('+"sword" -shield*') == "+sword* +shield*"
+    # Nothing searchable left
+    assert _fulltext_query("to be or not to be") == "+not*"
+    assert _fulltext_query("it is a an") == ""
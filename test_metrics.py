@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import urllib.request
+
+from utils.Metrics import REGISTRY, Registry, serve_metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("query_seconds", "Query latency", ["operation"], buckets=(0.1, 1.0))
+    child = latency.labels("fetch_one")
+    for value in (0.05, 0.1, 0.5, 3.0):
+        child.observe(value)
+    registry.counter("queries", "Queries").inc(2)
+
+    text = registry.render()
+    assert 'query_seconds_bucket{operation="fetch_one",le="0.1"} 2' in text
+    assert 'query_seconds_bucket{operation="fetch_one",le="1"} 3' in text
+    assert 'query_seconds_bucket{operation="fetch_one",le="+Inf"} 4' in text
+    assert 'query_seconds_count{operation="fetch_one"} 4' in text
+    assert "# TYPE queries counter" in text
+    assert "queries_total 2" in text
+
+
+def test_observations_from_threads_are_not_lost():
+    registry = Registry()
+    latency = registry.histogram("thread_seconds", "Latency observed from worker threads", buckets=(1.0,))
+    queries = registry.counter("thread_queries", "Queries counted from worker threads")
+
+    def work():
+        for _ in range(20000):
+            latency.observe(0.5)
+            queries.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    text = registry.render()
+    assert "thread_seconds_count 160000" in text
+    assert "thread_queries_total 160000" in text
+
+
+def test_local_server_serves_metrics():
+    REGISTRY.gauge("test_metrics_gauge", "Gauge set by the test").set(7)
+
+    async def scenario():
+        server = await serve_metrics("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            body = await asyncio.to_thread(
+                lambda: urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5).read().decode())
+        finally:
+            server.close()
+        return body
+
+    assert "test_metrics_gauge 7" in asyncio.run(scenario())
@@ -0,0 +1,110 @@
+import copy
+from contextlib import contextmanager
+
+import pytest
+
+from chatgame import points
+from chatgame.exceptions import InsufficientPointsError
+
+ALICE = "00000000-0000-0000-0000-00000000000a"
+BOB = "00000000-0000-0000-0000-00000000000b"
+
+
+class FakePointsDB:
+    """In-memory User, Points_Counter and Transaction tables for the queries of chatgame.points"""
+
+    def __init__(self):
+        self.balances = {points.SYSTEM_USER_ID: 0, ALICE: 0, BOB: 0}  # User.points_balance
+        self.counters = {}  # (user_id, slot) -> delta
+        self.transactions = []
+        self.locked = []  # User rows locked FOR UPDATE, in order
+
+    @contextmanager
+    def unit_of_work(self):
+        saved = copy.deepcopy((self.balances, self.counters, self.transactions))
+        try:
+            yield self
+        except BaseException:
+            self.balances, self.counters, self.transactions = saved
+            raise
+
+    def fetch_one(self, query, params=()):
+        user_id = params[0]
+        if query.startswith("SELECT user_id FROM User"):
+            self.locked.append(user_id)
+        if query.startswith("SELECT user_id FROM User") or query.startswith("SELECT points_balance FROM User"):
+            if user_id not in self.balances:
+                return None
+            return {"user_id": user_id, "points_balance": self.balances[user_id]}
+        if query.startswith("SELECT COALESCE(SUM(delta), 0)"):
+            return {"delta": sum(delta for (owner, _), delta in self.counters.items() if owner == user_id)}
+        raise AssertionError(f"Unexpected query {query}")
+
+    def fetch_all(self, query, params=()):
+        assert query.startswith("SELECT DISTINCT user_id FROM Points_Counter")
+        return [{"user_id": user_id} for user_id in sorted({owner for (owner, _), delta in self.counters.items()
+                                                            if delta})]
+
+    def execute(self, query, params=()):
+        if query.startswith("INSERT INTO Transaction"):
+            self.transactions.append(params)
+        elif query.startswith("INSERT INTO Points_Counter"):
+            user_id, slot, delta = params
+            self.counters[(user_id, slot)] = self.counters.get((user_id, slot), 0) + delta
+        elif query.startswith("UPDATE User SET points_balance"):
+            delta, user_id = params
+            self.balances[user_id] += delta
+        elif query.startswith("UPDATE Points_Counter SET delta = 0"):
+            for key in self.counters:
+                if key[0] == params[0]:
+                    self.counters[key] = 0
+        else:
+            raise AssertionError(f"Unexpected query {query}")
+        return 1
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakePointsDB()
+    monkeypatch.setattr(points, "get_db_handler", lambda: db)
+    return db
+
+
+def test_transfers_move_points_through_the_counters(db):
+    points.transfer(points.SYSTEM_USER_ID, ALICE, 100)
+    points.transfer(ALICE, BOB, 30)
+    points.transfer(BOB, ALICE, 10)
+
+    assert points.balance(ALICE) == 80
+    assert points.balance(BOB) == 20
+    # The System user pays out every grant and goes negative
+    assert points.balance(points.SYSTEM_USER_ID) == -100
+    assert len(db.transactions) == 3
+    # Both users' rows were locked first, in user ID order; never the System user's
+    assert db.locked[:1] == [ALICE] and db.locked[1:3] == [ALICE, BOB] and db.locked[3:5] == [ALICE, BOB]
+
+
+def test_insufficient_points_leave_nothing_behind(db):
+    points.transfer(points.SYSTEM_USER_ID, ALICE, 5)
+    with pytest.raises(InsufficientPointsError):
+        points.transfer(ALICE, BOB, 6)
+    assert points.balance(ALICE) == 5 and points.balance(BOB) == 0
+    assert len(db.transactions) == 1
+
+    with pytest.raises(ValueError):
+        points.transfer(ALICE, BOB, 0)
+    with pytest.raises(ValueError):
+        points.transfer(ALICE, ALICE, 1)
+
+
+def test_compaction_keeps_balances(db):
+    points.transfer(points.SYSTEM_USER_ID, ALICE, 50)
+    points.transfer(ALICE, BOB, 20)
+
+    assert points.compact(ALICE) == 30
+    assert db.balances[ALICE] == 30 and points.balance(ALICE) == 30
+
+    assert points.compact_all() == {"accounts": 2, "failed": 0}
+    assert db.balances == {points.SYSTEM_USER_ID: -50, ALICE: 30, BOB: 20}
+    assert not any(db.counters.values())
+    assert points.balance(BOB) == 20
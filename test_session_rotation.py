@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import chatgame.chat as chat
+from chatgame import sessions, sharding
+from utils.MySQLHandler import MySQLHandler
+
+USER_ID = "00000000-0000-0000-0000-0000000000aa"
+CHARACTER_ID = "00000000-0000-0000-0000-0000000000bb"
+
+
+class FakeShard:
+    """Records the statements; knows the summary of every session created and a closed session's messages"""
+
+    def __init__(self):
+        self.statements = []
+        self.summaries = {}
+        self.messages = [{"from_user": USER_ID, "content": "Where did we hide the map?", "timestamp": 2},
+                         {"from_user": None, "content": "Under the old oak tree.", "timestamp": 1}]
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        if query.startswith("INSERT INTO Chat_Session"):
+            self.summaries[params[0]] = params[3]
+        return 1
+
+    def fetch_all(self, query, params=None):
+        assert query.startswith("SELECT from_user, content, timestamp FROM Message")
+        return self.messages
+
+    def fetch_one(self, query, params=None):
+        assert query.startswith("SELECT summary FROM Chat_Session")
+        return {"summary": self.summaries[params[0]]} if params[0] in self.summaries else None
+
+
+class FakeHandler:
+    def __init__(self):
+        self.shard = FakeShard()
+
+    def for_user(self, user_id):
+        return self.shard
+
+    def unit_of_work(self):
+        # The real scope: no connection is checked out as long as no query reaches it
+        return MySQLHandler.get_instance().unit_of_work()
+
+
+@pytest.fixture
+def db(monkeypatch):
+    handler = FakeHandler()
+    monkeypatch.setattr(chat, "get_db_handler", lambda: handler)
+    monkeypatch.setattr(sessions, "get_db_handler", lambda: handler)
+    monkeypatch.setattr(chat, "validate_user_id", lambda user_id: None)
+    monkeypatch.setattr(chat, "validate_character_id", lambda character_id: None)
+    sessions.forget_user_sessions(USER_ID)
+    sharding.forget_user_sessions(USER_ID)
+    yield handler
+    sessions.forget_user_sessions(USER_ID)
+    sharding.forget_user_sessions(USER_ID)
+
+
+def test_rolled_back_rotation_keeps_the_cached_session(db):
+    async def scenario():
+        with db.unit_of_work():
+            old = await chat.create_new_session(USER_ID, CHARACTER_ID)
+            sessions.record_message(USER_ID, CHARACTER_ID, old, "Hello there")
+            # Nothing is cached before the commit
+            assert sessions.cached_active_session(USER_ID, CHARACTER_ID) is None
+        state = sessions.cached_active_session(USER_ID, CHARACTER_ID)
+        assert state["session_id"] == old and state["message_count"] == 1
+
+        with pytest.raises(RuntimeError):
+            with db.unit_of_work():
+                new = await chat.create_new_session(USER_ID, CHARACTER_ID, previous_session_id=old)
+                sessions.record_message(USER_ID, CHARACTER_ID, new, "Hello again")
+                raise RuntimeError("turn failed")
+
+        # The rotation never happened as far as the caches are concerned
+        assert sessions.cached_active_session(USER_ID, CHARACTER_ID) == state
+        assert state["message_count"] == 1
+        assert new not in sharding._session_owners
+        assert sharding._session_owners[old] == (USER_ID, CHARACTER_ID)
+        assert not sessions._summary_tasks
+
+    asyncio.run(scenario())
+
+
+def test_first_turn_after_a_rotation_sees_the_summary(db):
+    async def scenario():
+        with db.unit_of_work():
+            old = await chat.create_new_session(USER_ID, CHARACTER_ID)
+
+        with db.unit_of_work():
+            new = await chat.create_new_session(USER_ID, CHARACTER_ID, previous_session_id=old,
+                                                previous_summary="They met in the tavern.")
+            # Still inside the rotating turn, where its context is built
+            summary = sessions.session_summary(USER_ID, CHARACTER_ID, new)
+            assert summary.startswith("They met in the tavern.")
+            assert "Character: Under the old oak tree." in summary
+            assert summary.endswith("User: Where did we hide the map?")
+
+        # Written with the rotation, and cached once it committed
+        assert db.shard.summaries[new] == summary
+        assert sessions.cached_active_session(USER_ID, CHARACTER_ID)["summary"] == summary
+        # The default summarizer has nothing left to do in the background
+        assert not sessions._summary_tasks
+
+    asyncio.run(scenario())
@@ -0,0 +1,200 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Hashable, Optional, Tuple
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed because it could not start within its deadline."""
+
+    def __init__(self, reason: str, retry_after: float = 0.0) -> None:
+        super().__init__(f"Overloaded: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admission control with an adaptive concurrency limit, per-key limits and a bounded,
+    deadline-aware wait queue.
+
+    At most `limit` requests run at once, and at most `per_key_limit` per key (e.g. per
+    Discord guild). Others wait in FIFO order in a queue of at most `queue_size` entries.
+    A request is shed right away when the queue is full or when its estimated wait (from
+    the observed service time) exceeds its deadline, and shed later if it is still waiting
+    when the deadline passes.
+
+    The limit adapts to observed latency, in the style of the gradient algorithm: while the
+    short-term average latency stays close to the long-term one, the limit grows; when
+    latency rises (a saturated database pool, a slow API), the limit shrinks proportionally.
+    """
+
+    def __init__(
+            self,
+            initial_limit: int = 16,
+            min_limit: int = 2,
+            max_limit: int = 64,
+            per_key_limit: int = 8,
+            queue_size: int = 100,
+            deadline: float = 10.0,
+            tolerance: float = 1.5,
+            smoothing: float = 0.2) -> None:
+        """
+        Initialize a new admission controller.
+
+        Args:
+            initial_limit: Starting concurrency limit.
+            min_limit: Lowest the adaptive limit may go.
+            max_limit: Highest the adaptive limit may go.
+            per_key_limit: Maximum number of running requests per key.
+            queue_size: Maximum number of waiting requests.
+            deadline: Default time a request may wait before it is shed, in seconds.
+            tolerance: How much slower than the long-term latency the short-term latency may
+                get before the limit shrinks.
+            smoothing: How fast the limit moves towards its new target, in (0, 1].
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.per_key_limit = per_key_limit
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self._per_key: Dict[Hashable, int] = {}
+        self._waiters: Deque[Tuple[asyncio.Future, Optional[Hashable]]] = deque()
+        self._short_latency: Optional[float] = None  # Fast EWMA of service time
+        self._long_latency: Optional[float] = None  # Slow EWMA of service time
+        self.stats = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_estimate": 0, "shed_deadline": 0}
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests in the wait queue."""
+        return len(self._waiters)
+
+    def _can_start(self, key: Optional[Hashable]) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        return key is None or self._per_key.get(key, 0) < self.per_key_limit
+
+    def _start(self, key: Optional[Hashable]) -> None:
+        self.in_flight += 1
+        if key is not None:
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+        self.stats["admitted"] += 1
+
+    def _finish(self, key: Optional[Hashable]) -> None:
+        self.in_flight -= 1
+        if key is not None:
+            self._per_key[key] -= 1
+            if self._per_key[key] == 0:
+                del self._per_key[key]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start waiting requests, oldest first, skipping those whose key is at its limit."""
+        if not self._waiters:
+            return
+        remaining = deque()
+        while self._waiters:
+            waiter, key = self._waiters.popleft()
+            if self._can_start(key):
+                self._start(key)
+                waiter.set_result(True)
+            else:
+                remaining.append((waiter, key))
+        self._waiters = remaining
+
+    def _forget(self, waiter: asyncio.Future, key: Optional[Hashable]) -> None:
+        """Take a request that gave up out of the wait queue."""
+        waiter.cancel()
+        try:
+            self._waiters.remove((waiter, key))
+        except ValueError:
+            pass
+
+    def estimated_wait(self, position: int) -> float:
+        """Expected seconds until the request at `position` in the queue (0-based) can start."""
+        if self._short_latency is None:
+            return 0.0
+        return (position + 1) * self._short_latency / max(1.0, self.limit)
+
+    def _observe(self, latency: float) -> None:
+        """Update the latency averages and move the limit towards its new target."""
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+            return
+        self._short_latency += 0.1 * (latency - self._short_latency)
+        self._long_latency += 0.01 * (latency - self._long_latency)
+
+        gradient = max(0.5, min(1.0, self.tolerance * self._long_latency / self._short_latency))
+        target = self.limit * gradient
+        # Only grow when the limit is actually being used
+        if self.in_flight + 1 >= self.limit / 2:
+            target += math.sqrt(self.limit)
+        self.limit += self.smoothing * (target - self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, key: Optional[Hashable] = None, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Run the block once the request is admitted.
+
+        Args:
+            key: Key for the per-key limit, or None.
+            deadline: Seconds the request may wait; defaults to the controller's deadline.
+
+        Raises:
+            OverloadedError: If the request was shed.
+        """
+        deadline = self.deadline if deadline is None else deadline
+
+        if not self._waiters and self._can_start(key):
+            self._start(key)
+        else:
+            if len(self._waiters) >= self.queue_size:
+                self.stats["shed_queue_full"] += 1
+                raise OverloadedError("queue full", self.estimated_wait(len(self._waiters)))
+            estimate = self.estimated_wait(len(self._waiters))
+            if estimate > deadline:
+                self.stats["shed_estimate"] += 1
+                raise OverloadedError("expected wait exceeds deadline", estimate)
+
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((waiter, key))
+            self.stats["queued"] += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), deadline)
+            except asyncio.TimeoutError:
+                if not waiter.done():
+                    self._forget(waiter, key)
+                    self.stats["shed_deadline"] += 1
+                    raise OverloadedError("deadline passed while queued", self.estimated_wait(len(self._waiters)))
+            except BaseException:
+                # Cancelled while waiting: give the slot back if it was granted meanwhile
+                if waiter.done() and not waiter.cancelled():
+                    self._finish(key)
+                else:
+                    self._forget(waiter, key)
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._finish(key)
+            self._observe(time.monotonic() - started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current limit, load and counters."""
+        return {
+            **self.stats,
+            "limit"     : round(self.limit, 2),
+            "in_flight" : self.in_flight,
+            "waiting"   : self.waiting,
+            "latency_ms": round(self._short_latency * 1000, 1) if self._short_latency is not None else None,
+        }
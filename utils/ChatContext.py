@@ -1,4 +1,78 @@
-from typing import Optional, List, Dict, Any
+import sys
+from collections import deque
+from itertools import islice
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Union
+
+
+class ChatMessage:
+    """One message of a conversation history, stored compactly."""
+    __slots__ = ("role", "content", "author")
+
+    def __init__(self, role: str, content: str, author: str = "") -> None:
+        """
+        Initialize a new message.
+
+        Args:
+            role: "user" or "assistant" (interned, so all messages share one string per role).
+            content: The message text, kept as-is (e.g. the string read from the database).
+            author: Prefix naming the author, e.g. "name<user_id>\n" (interned, so it is shared
+                by all messages of the same author instead of being copied into every content).
+        """
+        self.role = sys.intern(role)
+        self.content = content
+        self.author = sys.intern(author) if author else ""
+
+    def to_openai(self) -> Dict[str, str]:
+        """The message in OpenAI chat format."""
+        return {"role": self.role, "content": self.author + self.content if self.author else self.content}
+
+
+class MessageHistory:
+    """
+    Bounded conversation history: a ring buffer of ChatMessage records that drops the oldest
+    message once `max_length` is reached. The OpenAI `messages` list is only built on demand.
+    """
+    __slots__ = ("_messages",)
+
+    def __init__(self, messages: Iterable[Union[ChatMessage, Dict[str, str]]] = (), max_length: int = 100) -> None:
+        """
+        Initialize a new history.
+
+        Args:
+            messages: Initial messages, oldest first, as ChatMessage records or OpenAI-style dicts.
+            max_length: Maximum number of messages kept.
+        """
+        self._messages: deque = deque(maxlen=max_length)
+        for message in messages:
+            if isinstance(message, ChatMessage):
+                self._messages.append(message)
+            else:
+                self.append(message["role"], message["content"])
+
+    def append(self, role: str, content: str, author: str = "") -> None:
+        """Add a message, dropping the oldest one if the history is full."""
+        self._messages.append(ChatMessage(role, content, author))
+
+    def clear(self) -> None:
+        """Remove all messages."""
+        self._messages.clear()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        return iter(self._messages)
+
+    def to_openai(self, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Build the OpenAI `messages` list.
+
+        Args:
+            limit: Only include the most recent `limit` messages.
+        """
+        messages = self._messages
+        start = 0 if limit is None else max(0, len(messages) - limit)
+        return [message.to_openai() for message in islice(messages, start, None)]
 
 
 class ChatContext:
@@ -6,36 +80,48 @@ class ChatContext:
 
     # Constants for context management
     chatContextMaximumMessageLength: int = 100  # Default maximum message length
+    chatContextRecentWindow: int = 20  # Most recent messages always sent when retrieval is enabled
+    chatContextRetrievalTopK: int = 8  # Relevant older messages added on top of the recent window
     DEFAULT_AFFINITY: int = 50  # Default affinity value
 
     def __init__(
             self,
             user_id: str = "",
             character_id: str = "",
-            message_history: Optional[List[Dict[str, str]]] = None,
+            message_history: Optional[Union[MessageHistory, List[Dict[str, str]]]] = None,
             memory: str = "",
+            session_summary: str = "",
             affinity: int = DEFAULT_AFFINITY,
             character_settings: str = "",
-            user_character_settings: Optional[Any] = "") -> None:
+            user_character_settings: Optional[Any] = "",
+            prefetched: bool = False) -> None:
         """
         Initialize a new chat context.
 
         Args:
             user_id: The ID of the user.
             character_id: The ID of the character.
-            message_history: The conversation history.
+            message_history: The conversation history, oldest first (a list of OpenAI-style
+                dicts is converted).
             memory: Character's memories about users.
+            session_summary: Summary of the earlier sessions with this user, carried over when
+                the previous session was rotated out.
             affinity: Character's affinity levels with users.
             character_settings: AI character's personality/settings.
             user_character_settings: User's additional character settings (appending to AI's settings).
+            prefetched: Whether the context was built from prefetched data.
         """
         self.user_id = user_id  # User ID
         self.character_id = character_id  # Character ID
-        self.message_history = message_history if message_history is not None else []  # Conversation history
+        if not isinstance(message_history, MessageHistory):
+            message_history = MessageHistory(message_history or (), self.chatContextMaximumMessageLength)
+        self.message_history = message_history  # Conversation history
         self.memory = memory  # Character's memories about users
+        self.session_summary = session_summary  # Summary of earlier sessions
         self.affinity = self._validate_affinity(affinity)  # Character's affinity levels with users
         self.character_settings = character_settings  # AI character's personality/settings
         self.user_character_settings = user_character_settings  # User's additional character settings (appending to AI's settings)
+        self.prefetched = prefetched  # Built from prefetched data (for usage metering)
     
     def _validate_affinity(self, affinity: int) -> int:
         """
@@ -55,27 +141,25 @@ class ChatContext:
             # If conversion fails, return default
             return self.DEFAULT_AFFINITY
             
-    def add_message(self, role: str, content: str) -> None:
+    def add_message(self, role: str, content: str, author: str = "") -> None:
         """
         Add a message to the conversation history.
+        The history keeps the most recent chatContextMaximumMessageLength messages.
         
         Args:
             role: The role of the message sender ("user" or "assistant")
             content: The content of the message
+            author: Optional author prefix shown before the content
         """
-        self.message_history.append({
-            "role": role,
-            "content": content
-        })
-        
-        # Trim history if it exceeds the maximum length
-        if len(self.message_history) > self.chatContextMaximumMessageLength:
-            # Keep the most recent messages
-            self.message_history = self.message_history[-self.chatContextMaximumMessageLength:]
+        self.message_history.append(role, content, author)
+
+    def openai_messages(self) -> List[Dict[str, str]]:
+        """The conversation history in OpenAI chat format, built on demand."""
+        return self.message_history.to_openai(self.chatContextMaximumMessageLength)
             
     def clear_history(self) -> None:
         """Clear the conversation history."""
-        self.message_history = []
+        self.message_history.clear()
         
     def update_memory(self, new_memory: str) -> None:
         """
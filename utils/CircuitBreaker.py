@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger("circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its circuit breaker is open."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with a sliding failure-rate window.
+
+    Closed: calls go through and their outcomes are recorded over the last `window` seconds.
+    Once at least `min_calls` were recorded and the failure rate reaches `failure_rate`, the
+    breaker opens. Open: calls fail immediately with CircuitOpenError for `open_seconds`.
+    Half-open: up to `half_open_calls` trial calls go through; a success closes the breaker,
+    a failure opens it again. Thread-safe, so it can guard code running in worker threads.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            failure_rate: float = 0.5,
+            window: float = 30.0,
+            min_calls: int = 10,
+            open_seconds: float = 15.0,
+            half_open_calls: int = 1,
+            is_failure: Callable[[BaseException], bool] = lambda e: True,
+            clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Initialize a new circuit breaker.
+
+        Args:
+            name: Name used in errors, logs and snapshots.
+            failure_rate: Fraction of failed calls in the window that opens the breaker.
+            window: Length of the sliding window in seconds.
+            min_calls: Minimum number of calls in the window before the rate is considered.
+            open_seconds: How long the breaker stays open before allowing trial calls.
+            half_open_calls: Number of concurrent trial calls allowed while half-open.
+            is_failure: Predicate deciding whether an exception counts as a dependency failure.
+                Other exceptions (e.g. bad input) count as successful calls.
+            clock: Time source, in seconds.
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.is_failure = is_failure
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()  # (time, failed)
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        """The current state: "closed", "open" or "half_open"."""
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"Circuit '{self.name}' {self._state} -> {state}")
+        self._state = state
+        self._trials = 0
+        if state == OPEN:
+            self._opened_at = self.clock()
+            self.times_opened += 1
+        self._outcomes.clear()
+
+    def before_call(self) -> None:
+        """
+        Reserve a call.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with all trial calls in flight.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return
+            retry_after = max(0.0, self._opened_at + self.open_seconds - self.clock())
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, error: Optional[BaseException] = None) -> None:
+        """
+        Record the outcome of a call reserved with `before_call`.
+
+        Args:
+            error: The exception the call failed with, or None if it succeeded.
+        """
+        failed = error is not None and self.is_failure(error)
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._transition(OPEN if failed else CLOSED)
+                return
+            if state == OPEN:
+                return
+
+            now = self.clock()
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            if failed and len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for _, f in self._outcomes if f)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._transition(OPEN)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Run the body of a `with` block (sync or async code) as one guarded call.
+
+        Raises:
+            CircuitOpenError: If the breaker does not allow the call.
+        """
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record(e)
+            raise
+        except BaseException:
+            # Cancelled: no outcome, but free the trial slot
+            self.release()
+            raise
+        self.record()
+
+    def release(self) -> None:
+        """Give back a call reserved with `before_call` without recording an outcome."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state and window statistics."""
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f in self._outcomes if f)
+            return {
+                "state"       : state,
+                "calls"       : calls,
+                "failures"    : failures,
+                "failure_rate": failures / calls if calls else 0.0,
+                "times_opened": self.times_opened,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """
+    Get the breaker registered under `name`, creating it with `kwargs` on first use.
+
+    Args:
+        name: Breaker name, e.g. "openai" or "mysql:mysql_pool".
+        **kwargs: CircuitBreaker arguments, only used when the breaker is created.
+    """
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+        return breaker
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """States of all registered breakers, keyed by name."""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+logger = logging.getLogger("hedging")
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """
+    Hedged requests: if a request has not answered within the recent p95 latency, send an
+    identical second request and use whichever answers first; the other one is cancelled.
+
+    The hedge delay adapts to a sliding window of observed latencies, clamped to
+    [`min_delay`, `max_delay`]. Extra requests are limited by a token budget: every request
+    earns `budget` tokens and a hedge costs one, so at most about `budget` (e.g. 5%) extra
+    requests are sent, with short bursts allowed up to `burst` hedges.
+    """
+
+    def __init__(
+            self,
+            quantile: float = 0.95,
+            budget: float = 0.05,
+            burst: float = 5.0,
+            window: int = 500,
+            min_samples: int = 20,
+            min_delay: float = 0.2,
+            max_delay: float = 15.0) -> None:
+        """
+        Initialize a new hedging policy.
+
+        Args:
+            quantile: Latency quantile after which a request is hedged.
+            budget: Maximum fraction of extra requests.
+            burst: Maximum number of hedges that can be saved up.
+            window: Number of recent latencies the quantile is computed from.
+            min_samples: Latencies needed before hedging starts.
+            min_delay: Lower bound of the hedge delay, in seconds.
+            max_delay: Upper bound of the hedge delay, in seconds.
+        """
+        self.quantile = quantile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._tokens = 0.0
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0}
+
+    def delay(self) -> Optional[float]:
+        """The current hedge delay in seconds, or None while too few latencies were observed."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        value = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def record(self, latency: float) -> None:
+        """Add an observed request latency, in seconds."""
+        self._latencies.append(latency)
+
+    def _take_token(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    async def run(self, request: Callable[[], Awaitable[T]],
+                  on_discarded: Optional[Callable[[Optional[T], float], None]] = None) -> T:
+        """
+        Run a request, hedging it if it is slow and the budget allows.
+
+        Args:
+            request: Factory starting one attempt of the request; called at most twice.
+            on_discarded: Called for each attempt of a hedged request whose answer is not used,
+                with its result (None if it was cancelled before answering) and its duration in
+                seconds, e.g. to account for what the extra request cost. Failed attempts are
+                not reported.
+
+        Returns:
+            The result of the first attempt that succeeds.
+
+        Raises:
+            Exception: The error of the original attempt if every attempt failed.
+        """
+        self.stats["requests"] += 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+
+        started = {}
+
+        def start() -> asyncio.Task:
+            task = asyncio.ensure_future(request())
+            started[task] = time.monotonic()
+            return task
+
+        original = start()
+        pending = {original}
+        errors = []
+        winner = None
+        try:
+            delay = self.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self._take_token():
+                    self.stats["hedged"] += 1
+                    pending.add(start())
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda t: t is not original):
+                    if task.exception() is None:
+                        winner = task
+                        self.record(time.monotonic() - started[task])
+                        if task is not original:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    errors.append((task, task.exception()))
+        finally:
+            # Cancel the slower attempt (or both, if we were cancelled ourselves)
+            for task in pending:
+                task.cancel()
+            if on_discarded is not None and len(started) > 1:
+                now = time.monotonic()
+                for task, task_started in started.items():
+                    if task is winner:
+                        continue
+                    if task in pending or task.cancelled():
+                        on_discarded(None, now - task_started)
+                    elif task.exception() is None:
+                        # Answered in the same instant as the winner
+                        on_discarded(task.result(), now - task_started)
+
+        errors.sort(key=lambda item: item[0] is not original)
+        raise errors[0][1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counters and the current hedge delay."""
+        return {**self.stats, "delay": self.delay()}
@@ -0,0 +1,62 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Hashable
+
+from cachetools import TTLCache
+
+
+class IdempotencyGuard:
+    """
+    Remembers recently processed keys (e.g. Discord message IDs) so work is done once per key.
+
+    The first caller claiming a key processes it; later callers are duplicates. A duplicate
+    arriving while the original is still running waits for it to finish. If the original
+    fails, the key is released and one of the waiting duplicates processes it instead.
+    Keys are forgotten after `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_size: int = 100000) -> None:
+        """
+        Initialize a new guard.
+
+        Args:
+            ttl: Seconds a key is remembered after it was claimed.
+            max_size: Maximum number of remembered keys; the oldest are dropped first.
+        """
+        self._outcomes: TTLCache = TTLCache(maxsize=max_size, ttl=ttl)  # key -> Future[bool]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._outcomes
+
+    @asynccontextmanager
+    async def claim(self, key: Hashable) -> AsyncIterator[bool]:
+        """
+        Claim a key for processing.
+
+        Args:
+            key: The idempotency key.
+
+        Yields:
+            True if the caller should process the key, False if it is a duplicate of a key
+            that was (or has just been) processed successfully.
+        """
+        while True:
+            outcome = self._outcomes.get(key)
+            if outcome is None:
+                break
+            # Shielded so a cancelled duplicate doesn't cancel the original's outcome
+            if await asyncio.shield(outcome):
+                yield False
+                return
+
+        outcome = asyncio.get_running_loop().create_future()
+        self._outcomes[key] = outcome
+        try:
+            yield True
+        except BaseException:
+            # Let a redelivery (or a waiting duplicate) try again
+            if self._outcomes.get(key) is outcome:
+                del self._outcomes[key]
+            outcome.set_result(False)
+            raise
+        outcome.set_result(True)
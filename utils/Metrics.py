@@ -0,0 +1,348 @@
+import asyncio
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cached query to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# A sample: (metric name, label pairs, value)
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+# A family yielded by a collector: (name, type, help, samples)
+Family = Tuple[str, str, str, List[Sample]]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Add `amount` (default 1)."""
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Per bucket (not cumulative), the last is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record one observation."""
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def read(self) -> Tuple[List[int], float]:
+        """Consistent copy of the bucket counts and the sum."""
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _Metric(ABC):
+    """A metric family: one child per combination of label values."""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    @abstractmethod
+    def _new_child(self) -> Any:
+        """A new child holding the value of one combination of label values."""
+
+    def labels(self, *values: Any) -> Any:
+        """
+        Get the child for the given label values (in `labelnames` order). Keep the result
+        around on hot paths: the lookup costs more than the observation itself.
+        """
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _label_pairs(self, key: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.labelnames, key))
+
+    @abstractmethod
+    def collect(self) -> Family:
+        """The family and the samples of every child, for the exposition."""
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Add `amount` to the counter without labels."""
+        self._default.inc(amount)
+
+    def collect(self) -> Family:
+        samples = [(self.name + "_total", self._label_pairs(key), child.value)
+                   for key, child in list(self._children.items())]
+        return self.name, self.kind, self.help, samples
+
+
+class Gauge(_Metric):
+    """A value that goes up and down."""
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def collect(self) -> Family:
+        samples = [(self.name, self._label_pairs(key), child.value) for key, child in list(self._children.items())]
+        return self.name, self.kind, self.help, samples
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. latencies in seconds) over fixed buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float) -> None:
+        """Record one observation on the histogram without labels."""
+        self._default.observe(value)
+
+    def collect(self) -> Family:
+        samples = []
+        for key, child in list(self._children.items()):
+            labels = self._label_pairs(key)
+            counts, total = child.read()
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", labels + (("le", _format_value(bound)),), cumulative))
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, cumulative))
+        return self.name, self.kind, self.help, samples
+
+
+class Registry:
+    """
+    Holds metric families and collectors, and renders them in the Prometheus text format.
+
+    Observations come from the event loop and from worker threads (database queries run in
+    `asyncio.to_thread`), so each one takes its child's lock: a read-modify-write like `+=` is
+    not atomic across threads and concurrent updates would be lost. Uncontended, an observation
+    still costs well under a microsecond.
+    Collectors compute values (pool usage, queue lengths, ...) only when metrics are scraped.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs) -> Any:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Get or create a counter. `name` is given without the `_total` suffix."""
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Get or create a gauge."""
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram."""
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """
+        Add a function called on every scrape, returning metric families as
+        (name, type, help, [(sample name, label pairs, value), ...]).
+        """
+        self._collectors.append(collector)
+
+    def register_snapshot(self, prefix: str, help: str, snapshot: Callable[[], Dict[str, Any]],
+                          label: Optional[str] = None) -> None:
+        """
+        Export the numeric values of a `snapshot()` dictionary as `<prefix>_<key>` metrics.
+
+        Args:
+            prefix: Metric name prefix.
+            help: Help text of the exported metrics.
+            snapshot: Function returning the dictionary, or with `label` a dictionary of them.
+            label: Label name for the outer keys of a nested dictionary (e.g. one per breaker).
+        """
+        def collect() -> Iterable[Family]:
+            values = snapshot()
+            rows = values.items() if label else [(None, values)]
+            families: Dict[str, List[Sample]] = {}
+            for outer, row in rows:
+                labels = ((label, str(outer)),) if label else ()
+                for key, value in row.items():
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if isinstance(value, (int, float)):
+                        families.setdefault(f"{prefix}_{key}", []).append((f"{prefix}_{key}", labels, value))
+            return [(name, "untyped", help, samples) for name, samples in families.items()]
+
+        self.register_collector(collect)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        families = [metric.collect() for metric in list(self._metrics.values())]
+        for collector in list(self._collectors):
+            try:
+                families.extend(collector())
+            except Exception as e:
+                families.append(("metrics_collector_errors", "untyped",
+                                 f"Collector failed: {type(e).__name__}", [("metrics_collector_errors", (), 1)]))
+
+        lines = []
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {_escape(help)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(value_, True)}"' for key, value_ in labels)
+                    lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{sample_name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(text: str, quotes: bool = False) -> str:
+    text = str(text).replace("\\", "\\\\").replace("\n", "\\n")
+    return text.replace('"', '\\"') if quotes else text
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# Process-wide registry used by the bot
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Get or create a counter in the process-wide registry."""
+    return REGISTRY.counter(name, help, labelnames)
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Get or create a gauge in the process-wide registry."""
+    return REGISTRY.gauge(name, help, labelnames)
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a histogram in the process-wide registry."""
+    return REGISTRY.histogram(name, help, labelnames, buckets)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """
+    Measure how late the event loop wakes up from a sleep, i.e. how long callbacks had to wait
+    for the loop because something blocked it. Runs until cancelled.
+    """
+    lag = histogram("event_loop_lag_seconds", "Delay of the event loop waking up from a sleep",
+                    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+    current = gauge("event_loop_lag_last_seconds", "Most recent event loop lag")
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        delay = max(0.0, time.perf_counter() - started - interval)
+        lag.observe(delay)
+        current.set(delay)
+
+
+async def serve_metrics(host: str = "127.0.0.1", port: int = 9100) -> asyncio.AbstractServer:
+    """
+    Serve the process-wide registry at `GET /metrics` on a minimal HTTP server, for drivers
+    that can't serve HTTP routes themselves.
+
+    Returns:
+        The started server; close it to stop serving.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Skip the headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, REGISTRY.render().encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not Found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,12 +1,200 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 import mysql.connector
 from mysql.connector import pooling
-from typing import Dict, List, Optional, Any, Union, Tuple, Callable
+from typing import Dict, List, Optional, Any, Union, Tuple, Callable, Iterator
 from functools import wraps
 from os import getenv
 from dotenv import load_dotenv
 
+from utils.CircuitBreaker import CircuitBreaker, get_breaker
+from utils.Metrics import REGISTRY, counter, histogram
+
+logger = logging.getLogger("mysql")
+
+db_query_seconds = histogram("db_query_seconds", "Duration of database calls", ["operation"])
+db_query_errors = counter("db_query_errors", "Database calls that raised", ["operation"])
+
+# Server error codes that are worth retrying: lock wait timeout, deadlock
+TRANSIENT_ERROR_CODES = {1205, 1213}
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Check whether a database error is likely to succeed when retried
+    (lost connections, exhausted pool, lock timeouts and deadlocks).
+
+    Args:
+        error: The exception to inspect
+
+    Returns:
+        True if the operation may be retried
+    """
+    if isinstance(error, (mysql.connector.errors.OperationalError,
+                          mysql.connector.errors.InterfaceError,
+                          mysql.connector.errors.PoolError)):
+        return True
+    return isinstance(error, mysql.connector.Error) and error.errno in TRANSIENT_ERROR_CODES
+
+
+def is_outage_error(error: BaseException) -> bool:
+    """
+    Check whether a database error means the server is unreachable or failing, as opposed
+    to a problem with one query or a busy pool (lock timeouts, deadlocks, pool exhausted).
+
+    Args:
+        error: The exception to inspect
+
+    Returns:
+        True if the error should count against the database circuit breaker
+    """
+    if isinstance(error, mysql.connector.errors.PoolError) or not isinstance(error, mysql.connector.Error):
+        return False
+    if error.errno is not None and 2000 <= error.errno < 3000:
+        return True  # Client errors: can't connect, server has gone away, lost connection...
+    return (isinstance(error, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError))
+            and error.errno not in TRANSIENT_ERROR_CODES)
+
+
+def pool_breaker(pool: pooling.MySQLConnectionPool) -> CircuitBreaker:
+    """The circuit breaker of a connection pool, so one failing shard doesn't block the others"""
+    return get_breaker(f"mysql:{pool.pool_name}", is_failure=is_outage_error)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach). Maps a 64-bit key to one of `buckets` buckets
+    so that growing from N to N+1 buckets only moves about 1/(N+1) of the keys.
+
+    Args:
+        key: 64-bit integer key
+        buckets: Number of buckets
+
+    Returns:
+        Bucket index in [0, buckets)
+    """
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_index(user_id: str, shard_count: int) -> int:
+    """
+    Shard a user's data lives on. Stable across processes and restarts.
+
+    Args:
+        user_id: The user ID (UUID string)
+        shard_count: Number of configured shards
+
+    Returns:
+        Shard index in [0, shard_count)
+    """
+    key = int.from_bytes(hashlib.md5(user_id.encode()).digest()[:8], "big")
+    return jump_hash(key, shard_count)
+
+
+def _checkout(pool: pooling.MySQLConnectionPool):
+    """Get a connection from the pool, reconnecting it if the server dropped it"""
+    connection = pool.get_connection()
+
+    # Validate connection is active
+    if not connection.is_connected():
+        connection.reconnect(attempts=3, delay=1)
+    return connection
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    """The running asyncio task, or None when called outside an event loop (e.g. from a thread)"""
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+class UnitOfWork:
+    """
+    A single pooled connection and open transaction shared by every query issued
+    inside a `MySQLHandler.unit_of_work()` scope.
+    The connection is checked out lazily on the first query and committed when the scope exits.
+    """
+
+    def __init__(self):
+        # Tasks spawned inside the scope inherit the context variable, but must not share
+        # the connection with the task that owns it, so the owner is recorded
+        self.owner = _current_task()
+        self.connections: Dict[str, Any] = {}  # pool name -> connection
+        self.after_commit: List[Callable[[], None]] = []  # Run once the scope has committed
+
+    def connection_for(self, pool: pooling.MySQLConnectionPool):
+        """Get (checking out on first use) this unit's connection for the given pool"""
+        connection = self.connections.get(pool.pool_name)
+        if connection is None:
+            connection = _checkout(pool)
+            connection.start_transaction()
+            self.connections[pool.pool_name] = connection
+        return connection
+
+    def commit(self) -> None:
+        """Commit the writes made so far and keep the connection for the rest of the scope"""
+        for connection in self.connections.values():
+            connection.commit()
+
+    def close(self, commit: bool = True) -> None:
+        """Commit (or roll back) and return every connection to its pool"""
+        try:
+            for connection in self.connections.values():
+                if not connection.is_connected():
+                    continue
+                if commit:
+                    connection.commit()
+                else:
+                    connection.rollback()
+        finally:
+            for connection in self.connections.values():
+                if connection.is_connected():
+                    connection.close()
+            self.connections = {}
+
+
+# Unit of work of the current request, picked up automatically by `sql_transaction`
+_current_unit: ContextVar[Optional[UnitOfWork]] = ContextVar("mysql_unit_of_work", default=None)
+
+
+def run_after_commit(callback: Callable[[], None]) -> None:
+    """
+    Run `callback` once the caller's writes are visible to other connections: when the
+    current `unit_of_work()` scope has committed, or right away outside a scope.
+    Work that touches rows written in the scope from another connection (e.g. a background
+    task) must wait for the commit, or it would block on the scope's row locks.
+
+    Args:
+        callback: Function to call without arguments
+    """
+    unit = _ambient_unit()
+    if unit is None:
+        callback()
+    else:
+        unit.after_commit.append(callback)
+
+
+def _ambient_unit() -> Optional[UnitOfWork]:
+    """The unit of work the caller is running in, if any"""
+    unit = _current_unit.get()
+    if unit is not None and unit.owner is _current_task():
+        return unit
+    return None
+
 
 def sql_transaction(func):
     """
@@ -15,19 +203,31 @@ def sql_transaction(func):
     - Commits on success
     - Rolls back on exception
     - Always closes cursor and connection
+    Inside a `unit_of_work()` scope the scope's connection is used instead, and committing,
+    rolling back and returning the connection are left to the scope.
+    Calls go through the pool's circuit breaker, which raises CircuitOpenError while the
+    database is considered down.
     """
 
     @wraps(func)
-    def wrapper(self, *args, **kwargs):
+    def transaction(self, *args, **kwargs):
+        unit = _ambient_unit()
+        if unit is not None:
+            connection = unit.connection_for(self.pool)
+            cursor = connection.cursor(dictionary=True)
+            try:
+                return func(self, cursor, connection, *args, **kwargs)
+            except mysql.connector.Error as e:
+                logger.warning(f"Database error: {e}", extra={"errno": e.errno})
+                raise e
+            finally:
+                cursor.close()
+
         connection = None
         cursor = None
         try:
-            connection = self.pool.get_connection()
-            
-            # Validate connection is active
-            if not connection.is_connected():
-                connection.reconnect(attempts=3, delay=1)
-                
+            connection = _checkout(self.pool)
+
             cursor = connection.cursor(dictionary=True)
             
             # Start transaction
@@ -41,7 +241,7 @@ def sql_transaction(func):
             return result
         except mysql.connector.Error as e:
             # Log the error
-            print(f"Database error: {e}")
+            logger.warning(f"Database error: {e}", extra={"errno": e.errno})
             # If any error occurs, rollback
             if connection and connection.is_connected():
                 connection.rollback()
@@ -58,15 +258,184 @@ def sql_transaction(func):
             if connection and connection.is_connected():
                 connection.close()
 
+    # Resolved once here so recording a call is just two attribute updates
+    duration = db_query_seconds.labels(func.__name__)
+    errors = db_query_errors.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with pool_breaker(self.pool).guard():
+                return transaction(self, *args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            duration.observe(time.perf_counter() - started)
+
     return wrapper
 
 
-class MySQLHandler:
+class MySQLQueryMixin:
+    """
+    Query methods shared by every handler that owns a connection pool (`self.pool`).
+    """
+    pool: pooling.MySQLConnectionPool
+
+    @sql_transaction
+    def execute(self, cursor, connection, query: str, params: Optional[Union[Tuple, Dict]] = None) -> int:
+        """
+        Execute a query that doesn't return data (INSERT, UPDATE, DELETE)
+
+        Args:
+            cursor: Database cursor (provided by decorator)
+            connection: Database connection (provided by decorator)
+            query: SQL query string
+            params: Parameters for the query
+
+        Returns:
+            Number of affected rows
+        """
+        cursor.execute(query, params)
+        return cursor.rowcount
+
+    @sql_transaction
+    def execute_many(self, cursor, connection, query: str, seq_params: List[Union[Tuple, Dict]]) -> int:
+        """
+        Execute a query once for every parameter set in a single transaction
+
+        Args:
+            cursor: Database cursor (provided by decorator)
+            connection: Database connection (provided by decorator)
+            query: SQL query string
+            seq_params: Sequence of parameter sets for the query
+
+        Returns:
+            Number of affected rows
+        """
+        cursor.executemany(query, seq_params)
+        return cursor.rowcount
+
+    @sql_transaction
+    def fetch_one(self, cursor, connection, query: str, params: Optional[Union[Tuple, Dict]] = None) -> Optional[
+        Dict[str, Any]]:
+        """
+        Fetch a single row from the database
+
+        Args:
+            cursor: Database cursor (provided by decorator)
+            connection: Database connection (provided by decorator)
+            query: SQL query string
+            params: Parameters for the query
+
+        Returns:
+            A dictionary with column names as keys, or None if no rows found
+        """
+        cursor.execute(query, params)
+        return cursor.fetchone()
+
+
+    @sql_transaction
+    def fetch_all(self, cursor, connection, query: str, params: Optional[Union[Tuple, Dict]] = None) -> List[
+        Dict[str, Any]]:
+        """
+        Fetch all rows from the database
+
+        Args:
+            cursor: Database cursor (provided by decorator)
+            connection: Database connection (provided by decorator)
+            query: SQL query string
+            params: Parameters for the query
+
+        Returns:
+            A list of dictionaries with column names as keys
+        """
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+    def fetch_batches(self, query: str, params: Optional[Union[Tuple, Dict]] = None,
+                      batch_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream rows from the database in batches, without loading the whole result
+
+        Rows are read from an unbuffered cursor with `fetchmany`, so only one batch is held
+        in memory at a time. The generator always uses a dedicated pooled connection (not the
+        ambient unit of work), because an unbuffered result blocks its connection until it
+        has been read completely. Close the generator (or exhaust it) to release the connection.
+
+        Args:
+            query: SQL query string
+            params: Parameters for the query
+            batch_size: Number of rows per batch
+
+        Yields:
+            Lists of up to `batch_size` dictionaries with column names as keys
+        """
+        with pool_breaker(self.pool).guard():
+            connection = _checkout(self.pool)
+        cursor = None
+        try:
+            cursor = connection.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            # Stopped early: discard the rest of the result so the connection can be reused
+            if connection.is_connected() and connection.unread_result:
+                connection.consume_results()
+            if cursor:
+                cursor.close()
+            if connection.is_connected():
+                connection.close()
+
+    def fetch_iter(self, query: str, params: Optional[Union[Tuple, Dict]] = None,
+                   batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Stream rows from the database one at a time (see `fetch_batches`)
+
+        Args:
+            query: SQL query string
+            params: Parameters for the query
+            batch_size: Number of rows fetched from the server at a time
+
+        Yields:
+            Dictionaries with column names as keys
+        """
+        batches = self.fetch_batches(query, params, batch_size)
+        try:
+            for rows in batches:
+                yield from rows
+        finally:
+            batches.close()
+
+
+class ShardHandler(MySQLQueryMixin):
+    """
+    Query handler bound to the connection pool of one shard database.
+    Obtained through `MySQLHandler.for_user()` rather than created directly.
+    """
+
+    def __init__(self, index: int, pool: pooling.MySQLConnectionPool):
+        """
+        Args:
+            index: Position of the shard in the shard list
+            pool: Connection pool of the shard database
+        """
+        self.index = index
+        self.pool = pool
+
+
+class MySQLHandler(MySQLQueryMixin):
     """
     Handler for MySQL database operations with connection pooling.
     Implemented as a singleton.
     """
     _instance = None
+    _init_lock = threading.Lock()
 
     @classmethod
     def get_instance(cls):
@@ -97,14 +466,22 @@ class MySQLHandler:
         self.pool_size = pool_size
         self.pool = None
         self.config = {}
+        self.shard_configs: List[Dict[str, Any]] = []  # Per-shard overrides of `config`
+        self.shards: List[ShardHandler] = []
 
         # Mark as initialized
         self._initialized = True
 
     def initialize(self):
-        """Initialize connection pool with configuration"""
-        self._load_config_from_env()
-        self._initialize_pool()
+        """
+        Initialize connection pool with configuration.
+        Only the first call connects; later calls (and concurrent ones) return the ready handler.
+        Use `update_config` to rebuild the pool.
+        """
+        with self._init_lock:
+            if self.pool is None:
+                self._load_config_from_env()
+                self._initialize_pool()
         return self
 
     def _load_config_from_env(self):
@@ -120,10 +497,14 @@ class MySQLHandler:
             "port"    : getenv("DATABASE_PORT", "3306"),
             "database": getenv("DATABASE_NAME", "CS5200"),
             "pool_reset_session": True,  # Reset session variables when connection returns to pool
-            "pool_recycle": 3600,        # Recycle connections after 1 hour
             "connect_timeout": 10        # Connection timeout in seconds
         }
 
+        # Optional shard databases for per-user tables, as a JSON list of overrides, e.g.
+        # [{"database": "chatgame_s0"}, {"host": "db2", "port": 3307, "database": "chatgame_s1"}]
+        shards = getenv("DATABASE_SHARDS", "").strip()
+        self.shard_configs = json.loads(shards) if shards else []
+
     def _initialize_pool(self):
         """Initialize the connection pool with current configuration"""
         if self.pool:
@@ -139,6 +520,42 @@ class MySQLHandler:
             pool_size=self.pool_size,
             **self.config
         )
+        self._initialize_shards()
+
+    def _initialize_shards(self):
+        """Create one pool per configured shard, or route everything to the main pool if none are"""
+        for shard in self.shards:
+            if shard.pool is not self.pool:
+                try:
+                    shard.pool._remove_connections()
+                except:
+                    pass
+
+        if not self.shard_configs:
+            self.shards = [ShardHandler(0, self.pool)]
+            return
+
+        self.shards = [
+            ShardHandler(i, pooling.MySQLConnectionPool(
+                pool_name=f"{self.pool_name}_shard{i}",
+                pool_size=self.pool_size,
+                **{**self.config, **overrides}
+            ))
+            for i, overrides in enumerate(self.shard_configs)
+        ]
+
+    def for_user(self, user_id: str) -> ShardHandler:
+        """
+        Get the handler of the shard holding a user's sessions, messages, memory, affinity
+        and customizations. `User` and `Virtual_Character` stay on the main database.
+
+        Args:
+            user_id: The user ID
+
+        Returns:
+            The user's ShardHandler
+        """
+        return self.shards[shard_index(user_id, len(self.shards))]
 
     def update_config(self, config: Dict[str, Any]):
         """
@@ -168,22 +585,35 @@ class MySQLHandler:
             if connection and connection.is_connected():
                 connection.close()
 
-    @sql_transaction
-    def execute(self, cursor, connection, query: str, params: Optional[Union[Tuple, Dict]] = None) -> int:
+    @contextmanager
+    def unit_of_work(self) -> Iterator[UnitOfWork]:
         """
-        Execute a query that doesn't return data (INSERT, UPDATE, DELETE)
-
-        Args:
-            cursor: Database cursor (provided by decorator)
-            connection: Database connection (provided by decorator)
-            query: SQL query string
-            params: Parameters for the query
+        Share one connection and one transaction between all queries in the scope.
+        Every `execute`/`fetch_*` call made by the current task inside the scope reuses the
+        scope's connection; the writes are committed together when the scope exits, or
+        rolled back if it exits with an exception. Nested scopes join the outer one.
 
-        Returns:
-            Number of affected rows
+        Yields:
+            The active UnitOfWork, whose `commit()` can be used as an intermediate checkpoint
         """
-        cursor.execute(query, params)
-        return cursor.rowcount
+        unit = _ambient_unit()
+        if unit is not None:
+            yield unit
+            return
+
+        unit = UnitOfWork()
+        token = _current_unit.set(unit)
+        try:
+            yield unit
+        except BaseException:
+            unit.close(commit=False)
+            raise
+        else:
+            unit.close(commit=True)
+        finally:
+            _current_unit.reset(token)
+        for callback in unit.after_commit:
+            callback()
 
     @sql_transaction
     def execute_file(self, cursor, connection, file_path):
@@ -219,60 +649,47 @@ class MySQLHandler:
                 cursor.execute(command)
 
 
-    @sql_transaction
-    def fetch_one(self, cursor, connection, query: str, params: Optional[Union[Tuple, Dict]] = None) -> Optional[
-        Dict[str, Any]]:
-        """
-        Fetch a single row from the database
-
-        Args:
-            cursor: Database cursor (provided by decorator)
-            connection: Database connection (provided by decorator)
-            query: SQL query string
-            params: Parameters for the query
-
-        Returns:
-            A dictionary with column names as keys, or None if no rows found
-        """
-        cursor.execute(query, params)
-        return cursor.fetchone()
-
-
-    @sql_transaction
-    def fetch_all(self, cursor, connection, query: str, params: Optional[Union[Tuple, Dict]] = None) -> List[
-        Dict[str, Any]]:
-        """
-        Fetch all rows from the database
-
-        Args:
-            cursor: Database cursor (provided by decorator)
-            connection: Database connection (provided by decorator)
-            query: SQL query string
-            params: Parameters for the query
-
-        Returns:
-            A list of dictionaries with column names as keys
-        """
-        cursor.execute(query, params)
-        return cursor.fetchall()
-
     # Global instance accessor - fixed to be a class method
     @classmethod
     def get_db_handler(cls) -> 'MySQLHandler':
         """
-        Get the global MySQLHandler instance
+        Get the global MySQLHandler instance, connecting on first use
 
         Returns:
             The singleton instance of MySQLHandler
         """
-        return cls.get_instance()
+        return get_db_handler()
+
+def _pool_metrics():
+    """Size and connections in use of every pool, computed when metrics are scraped"""
+    handler = MySQLHandler._instance
+    if handler is None or handler.pool is None:
+        return []
+    pools = {handler.pool.pool_name: handler.pool}
+    for shard in handler.shards:
+        pools[shard.pool.pool_name] = shard.pool
+    size, in_use = [], []
+    for name, pool in pools.items():
+        labels = (("pool", name),)
+        size.append(("db_pool_size", labels, pool.pool_size))
+        # Idle connections wait in the pool's queue
+        in_use.append(("db_pool_in_use", labels, pool.pool_size - pool._cnx_queue.qsize()))
+    return [("db_pool_size", "gauge", "Connections in the pool", size),
+            ("db_pool_in_use", "gauge", "Connections checked out of the pool", in_use)]
+
+
+REGISTRY.register_collector(_pool_metrics)
+
 
 # This function can also be used outside the class if needed
 def get_db_handler() -> MySQLHandler:
     """
-    Get the global MySQLHandler instance
+    Get the global MySQLHandler instance, connecting on first use
 
     Returns:
         The singleton instance of MySQLHandler
     """
-    return MySQLHandler.get_instance()
+    handler = MySQLHandler.get_instance()
+    if handler.pool is None:
+        handler.initialize()
+    return handler
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+    pass
+
+
+class _StackSampler(threading.Thread):
+    """Background thread recording the Python stack of every other thread at a fixed interval."""
+
+    def __init__(self, interval: float) -> None:
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()  # "thread;outer;...;inner" -> samples
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self.stacks[_collapse(names.get(ident, str(ident)), frame)] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ";" separates frames and the last space separates the count in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _collapse(thread_name: str, frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(labels))
+
+
+def _task_location(task: asyncio.Task) -> str:
+    """Coroutine of a task and where it is currently suspended."""
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", type(coro).__name__)
+    stack = task.get_stack(limit=1)
+    if stack:
+        frame = stack[-1]
+        return f"{name} @ {os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+    return name
+
+
+class Profiler:
+    """
+    On-demand profiler for the running bot process.
+
+    While a profile runs, a thread samples the stacks of all threads, the event loop's tasks
+    are snapshotted every second, and (optionally) tracemalloc records allocations. Nothing is
+    installed outside of a profile: no hooks, no thread, so there is no overhead when it is off.
+    """
+
+    def __init__(self, output_dir: str = "data/profiles") -> None:
+        """
+        Initialize a new profiler.
+
+        Args:
+            output_dir: Where profile files are written.
+        """
+        self.output_dir = output_dir
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        """Whether a profile is running."""
+        return self._lock.locked()
+
+    async def profile(self, duration: float, interval: float = 0.005, memory: bool = True,
+                      top: int = 10) -> Dict[str, Any]:
+        """
+        Profile the process for `duration` seconds.
+
+        Args:
+            duration: Seconds to profile.
+            interval: Seconds between stack samples.
+            memory: Whether to trace allocations with tracemalloc (slows the process down while
+                profiling).
+            top: Number of entries in each summary list.
+
+        Returns:
+            A summary with `samples`, `stack_samples` (thread stacks recorded over all samples),
+            `top_functions` (self samples), `top_stacks`,
+            `tasks` (task counts by suspension point), `top_allocations`, and the paths of
+            the written `folded_path` (collapsed stacks, for flamegraph.pl or speedscope) and
+            `summary_path`.
+
+        Raises:
+            ProfilerBusyError: If a profile is already running.
+        """
+        if self._lock.locked():
+            raise ProfilerBusyError("A profile is already running")
+
+        async with self._lock:
+            started_tracing = memory and not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(10)
+            sampler = _StackSampler(interval)
+            sampler.start()
+            tasks: Counter = Counter()
+            task_snapshots = 0
+            started = time.monotonic()
+            try:
+                while time.monotonic() - started < duration:
+                    current = asyncio.current_task()
+                    for task in asyncio.all_tasks():
+                        if task is not current:
+                            tasks[_task_location(task)] += 1
+                    task_snapshots += 1
+                    await asyncio.sleep(min(1.0, max(0.0, duration - (time.monotonic() - started))))
+            finally:
+                sampler.stop()
+                allocations = []
+                if memory and tracemalloc.is_tracing():
+                    snapshot = tracemalloc.take_snapshot()
+                    allocations = [(str(stat.traceback[0]), stat.size, stat.count)
+                                   for stat in snapshot.statistics("lineno")[:top]]
+                if started_tracing:
+                    tracemalloc.stop()
+
+            # The files can be large: write them off the event loop
+            return await asyncio.to_thread(self._write, sampler, tasks, task_snapshots, allocations,
+                                           time.monotonic() - started, top)
+
+    def _write(self, sampler: _StackSampler, tasks: Counter, task_snapshots: int,
+               allocations: List[Tuple[str, int, int]], elapsed: float, top: int) -> Dict[str, Any]:
+        self_samples: Counter = Counter()
+        for stack, count in sampler.stacks.items():
+            self_samples[stack.rsplit(";", 1)[-1]] += count
+
+        summary = {
+            "duration"       : round(elapsed, 1),
+            "samples"        : sampler.samples,
+            "stack_samples"  : sum(sampler.stacks.values()),
+            "top_functions"  : self_samples.most_common(top),
+            "top_stacks"     : sampler.stacks.most_common(top),
+            "tasks"          : [(location, round(count / max(1, task_snapshots), 1))
+                                for location, count in tasks.most_common(top)],
+            "top_allocations": allocations,
+        }
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}")
+        summary["folded_path"] = base + ".folded"
+        summary["summary_path"] = base + ".txt"
+        with open(summary["folded_path"], "w") as f:
+            for stack, count in sampler.stacks.items():
+                f.write(f"{stack} {count}\n")
+        with open(summary["summary_path"], "w") as f:
+            f.write(format_summary(summary, top=top))
+        return summary
+
+
+def format_summary(summary: Dict[str, Any], top: int = 10) -> str:
+    """Human-readable text of a profile summary."""
+    lines = [f"Profiled {summary['duration']}s, {summary['samples']} samples", "", "Top functions (self samples):"]
+    total = max(1, summary["stack_samples"])
+    for label, count in summary["top_functions"][:top]:
+        lines.append(f"  {count:6d} {100 * count / total:5.1f}%  {label}")
+    lines += ["", "Tasks (average count by suspension point):"]
+    for location, count in summary["tasks"][:top]:
+        lines.append(f"  {count:6.1f}  {location}")
+    if summary["top_allocations"]:
+        lines += ["", "Top allocations during the profile:"]
+        for location, size, count in summary["top_allocations"][:top]:
+            lines.append(f"  {size / 1024:9.1f} KiB {count:7d} blocks  {location}")
+    return "\n".join(lines) + "\n"
+
+
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Profiler:
+    """Get the process-wide profiler."""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(os.getenv("PROFILE_DIR", "data/profiles"))
+    return _profiler
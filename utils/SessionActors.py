@@ -0,0 +1,74 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable
+
+
+class MailboxFullError(Exception):
+    """Raised when too many turns are already queued for the same key."""
+    pass
+
+
+class _Actor:
+    """Mailbox of one key: a FIFO lock plus the number of turns running or waiting on it."""
+    __slots__ = ("lock", "pending")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class SessionActorPool:
+    """
+    Serializes turns per key (e.g. per chat session) while different keys run in parallel.
+
+    Each key gets an actor whose mailbox is a FIFO lock: turns for the same key run one at
+    a time, in arrival order. Turns run in the caller's own task, so context variables
+    (such as NoneBot's current bot and event) stay intact. An actor is dropped as soon as
+    its last turn finishes, so idle keys cost nothing, and a full mailbox rejects new turns
+    instead of letting them pile up.
+    """
+
+    def __init__(self, mailbox_size: int = 5) -> None:
+        """
+        Initialize a new actor pool.
+
+        Args:
+            mailbox_size: Maximum number of turns running or waiting per key.
+        """
+        self.mailbox_size = mailbox_size
+        self._actors: Dict[Hashable, _Actor] = {}
+
+    def __len__(self) -> int:
+        """Number of keys with turns running or waiting."""
+        return len(self._actors)
+
+    def pending(self, key: Hashable) -> int:
+        """Number of turns running or waiting for `key`."""
+        actor = self._actors.get(key)
+        return actor.pending if actor else 0
+
+    @asynccontextmanager
+    async def turn(self, key: Hashable) -> AsyncIterator[None]:
+        """
+        Wait until all earlier turns for `key` are done, then run the block.
+
+        Args:
+            key: The key to serialize on.
+
+        Raises:
+            MailboxFullError: If `mailbox_size` turns are already running or waiting for `key`.
+        """
+        actor = self._actors.get(key)
+        if actor is None:
+            actor = self._actors[key] = _Actor()
+        if actor.pending >= self.mailbox_size:
+            raise MailboxFullError(f"Too many turns queued for {key}")
+
+        actor.pending += 1
+        try:
+            async with actor.lock:
+                yield
+        finally:
+            actor.pending -= 1
+            if actor.pending == 0:
+                del self._actors[key]
@@ -0,0 +1,231 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import sys
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from os import getenv
+from typing import Any, Dict, Iterator, Optional
+
+# Fields describing the current request (trace ID, user, session, ...), added to every record
+_log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+_configure_lock = threading.Lock()
+
+
+def new_trace_id() -> str:
+    """A new random trace ID."""
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    Add fields to every record logged inside the block (including from tasks started in it).
+
+    Usage:
+        with log_context(trace_id=new_trace_id(), discord_user=discord_id):
+            ...
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def current_log_context() -> Dict[str, Any]:
+    """The fields of the current log context, e.g. to restore them in a job run elsewhere with `log_context`."""
+    return _log_context.get()
+
+
+def bind_log_context(**fields: Any) -> None:
+    """Add fields to the current log context, until the enclosing `log_context` block ends."""
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto records. Runs in the caller's thread, before the record is queued."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records at INFO level and below; warnings and errors are always
+    kept. Records with a trace ID are sampled by trace, so a sampled turn is logged completely.
+    """
+
+    def __init__(self, rate: float = 1.0, rates: Optional[Dict[str, float]] = None) -> None:
+        """
+        Initialize a new sampling filter.
+
+        Args:
+            rate: Fraction of INFO and lower records kept.
+            rates: Per-logger rates overriding `rate`, applied to the logger and its children.
+        """
+        super().__init__()
+        self.rate = rate
+        self.rates = rates or {}
+        self.dropped = 0
+
+    def _rate_for(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return self.rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0:
+            return True
+
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id is not None:
+            key = zlib.crc32(str(trace_id).encode())
+        else:
+            key = zlib.crc32(f"{record.created}{record.lineno}".encode())
+        if key % 10000 < rate * 10000:
+            return True
+        self.dropped += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with context and `extra=` fields as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts"    : self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level" : record.levelname,
+            "logger": record.name,
+            "msg"   : record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or key.startswith("_"):
+                continue
+            if key == "extra" and isinstance(value, dict):
+                # Records forwarded from loguru carry their bound fields as one dictionary
+                entry.update(value)
+            else:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback here, where the arguments are still valid, but
+        # leave the formatting itself to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(
+        level: Optional[str] = None,
+        json_format: Optional[bool] = None,
+        sample_rate: Optional[float] = None,
+        sample_rates: Optional[Dict[str, float]] = None,
+        queue_size: int = 10000) -> None:
+    """
+    Route all standard logging through a queue to a background thread writing to stdout,
+    so logging never blocks the event loop on I/O. Only the first call has an effect.
+
+    Args:
+        level: Root log level, defaults to LOG_LEVEL (INFO).
+        json_format: Write JSON lines instead of text, defaults to LOG_FORMAT=json (the default).
+        sample_rate: Fraction of INFO and lower records kept, defaults to LOG_SAMPLE_RATE (1.0).
+        sample_rates: Per-logger sample rates, defaults to LOG_SAMPLE_RATES
+            ("logger=rate,logger=rate").
+        queue_size: Maximum number of records waiting to be written; more are dropped.
+    """
+    global _listener, _handler
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        level = level or getenv("LOG_LEVEL", "INFO")
+        if json_format is None:
+            json_format = getenv("LOG_FORMAT", "json").lower() == "json"
+        if sample_rate is None:
+            sample_rate = float(getenv("LOG_SAMPLE_RATE", "1.0"))
+        if sample_rates is None:
+            sample_rates = {}
+            for item in getenv("LOG_SAMPLE_RATES", "").split(","):
+                if "=" in item:
+                    name, rate = item.split("=", 1)
+                    sample_rates[name.strip()] = float(rate)
+
+        output = logging.StreamHandler(sys.stdout)
+        if json_format:
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+        log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        handler = _NonBlockingQueueHandler(log_queue)
+        handler.addFilter(ContextFilter())
+        handler.addFilter(SamplingFilter(sample_rate, sample_rates))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level.upper())
+        _handler = handler
+
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def log_handler() -> Optional[QueueHandler]:
+    """The queueing handler set up by `configure_logging`, e.g. to route other logging libraries through it."""
+    return _handler
+
+
+def stop_logging() -> None:
+    """Write the records still queued and stop the background thread."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -0,0 +1,181 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from utils.MySQLHandler import is_transient_error
+from utils.StructuredLogging import current_log_context, log_context
+
+logger = logging.getLogger("task_queue")
+
+# (key, function, arguments, log context of the submitter)
+Job = Tuple[Hashable, Callable[..., Awaitable[Any]], Tuple[Any, ...], Dict[str, Any]]
+
+
+class KeyedTaskQueue:
+    """
+    Bounded background task queue with per-key ordering.
+
+    Jobs are spread over a fixed set of workers by hashing their key, so jobs sharing a key
+    always run on the same worker, one at a time and in submission order, while jobs with
+    different keys run concurrently. Jobs failing with a transient database error are retried
+    with exponential backoff.
+    """
+
+    def __init__(
+            self,
+            name: str = "tasks",
+            workers: int = 4,
+            max_size: int = 1000,
+            max_retries: int = 3,
+            retry_delay: float = 0.5,
+            is_retryable: Callable[[BaseException], bool] = is_transient_error) -> None:
+        """
+        Initialize a new task queue. Workers are started lazily on the first submitted job.
+
+        Args:
+            name: Name used in log messages.
+            workers: Number of worker coroutines.
+            max_size: Maximum number of pending jobs across all workers.
+            max_retries: Number of retries for a job failing with a retryable error.
+            retry_delay: Delay before the first retry, doubled on every further retry.
+            is_retryable: Predicate deciding whether an exception is worth retrying.
+        """
+        self.name = name
+        self.worker_count = max(1, workers)
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.is_retryable = is_retryable
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._keys: Dict[Hashable, int] = {}  # key -> jobs queued or running
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting to be processed."""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self) -> None:
+        """Start the worker coroutines on the running event loop."""
+        if self._workers:
+            return
+        per_worker = max(1, self.max_size // self.worker_count)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.worker_count)]
+        # Workers start from an empty context rather than a copy of the first submitter's
+        # (its log context, unit of work, ...); each job gets its own submitter's log context
+        self._workers = [contextvars.Context().run(asyncio.create_task, self._worker(queue),
+                                                   name=f"{self.name}-worker-{i}")
+                         for i, queue in enumerate(self._queues)]
+        self._closed = False
+
+    async def submit(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args: Any) -> None:
+        """
+        Queue `func(*args)` to run in the background after all earlier jobs with the same key.
+        Waits for free space if the queue is full. Once the queue is shutting down, the job is
+        run inline instead so it is not lost.
+
+        Args:
+            key: Ordering key, e.g. (user_id, character_id).
+            func: Coroutine function to run.
+            *args: Arguments passed to `func`.
+        """
+        self._keys[key] = self._keys.get(key, 0) + 1
+        if self._closed:
+            try:
+                await self._run((key, func, args, current_log_context()))
+            finally:
+                self._job_done(key)
+            return
+        self.start()
+        try:
+            await self._queues[hash(key) % self.worker_count].put((key, func, args, current_log_context()))
+        except BaseException:
+            self._job_done(key)
+            raise
+
+    async def wait_idle(self, match: Callable[[Hashable], bool], timeout: Optional[float] = None,
+                        poll_interval: float = 0.05) -> int:
+        """
+        Wait until no job whose key matches is queued or running, e.g. before deleting the rows
+        the jobs of a user would write.
+
+        Args:
+            match: Predicate selecting the keys to wait for.
+            timeout: Maximum number of seconds to wait.
+            poll_interval: Seconds between checks.
+
+        Returns:
+            The number of matching jobs that were pending when called.
+
+        Raises:
+            asyncio.TimeoutError: If matching jobs are still pending after `timeout` seconds.
+        """
+        def matching() -> int:
+            return sum(count for key, count in self._keys.items() if match(key))
+
+        pending = matching()
+
+        async def poll():
+            while matching():
+                await asyncio.sleep(poll_interval)
+
+        if pending:
+            await asyncio.wait_for(poll(), timeout)
+        return pending
+
+    def _job_done(self, key: Hashable) -> None:
+        count = self._keys.get(key, 0) - 1
+        if count > 0:
+            self._keys[key] = count
+        else:
+            self._keys.pop(key, None)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting jobs, wait for everything already queued to finish, then stop the workers.
+
+        Args:
+            timeout: Maximum number of seconds to wait for pending jobs.
+        """
+        self._closed = True
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.name}: shutting down with {self.pending} unprocessed jobs")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+        # Jobs still queued were dropped with the workers
+        self._keys = {}
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            job = await queue.get()
+            try:
+                with log_context(**job[3]):
+                    await self._run(job)
+            finally:
+                self._job_done(job[0])
+                queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        _, func, args, _ = job
+        for attempt in range(self.max_retries + 1):
+            try:
+                await func(*args)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt < self.max_retries and self.is_retryable(e):
+                    logger.info(f"{self.name}: retrying {func.__name__} after transient error: {str(e)}")
+                    await asyncio.sleep(self.retry_delay * (2 ** attempt))
+                    continue
+                logger.error(f"{self.name}: {func.__name__} failed: {str(e)}", exc_info=True)
+                return
@@ -0,0 +1,241 @@
+import glob
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from cachetools import LRUCache
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_SEARCH_CHUNK_ROWS = 65536  # Rows converted to float32 at a time while scoring
+
+
+class Embedder(ABC):
+    """Turns texts into L2-normalized float32 vectors of a fixed dimension."""
+
+    dim: int = 0
+    name: str = ""
+
+    @abstractmethod
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts: The texts to embed.
+
+        Returns:
+            Array of shape (len(texts), dim), one normalized row per text.
+        """
+
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedder using the hashing trick over words and word bigrams.
+    Cheap and deterministic; captures lexical overlap rather than meaning.
+    """
+
+    def __init__(self, dim: int = 256) -> None:
+        """
+        Args:
+            dim: Number of hash buckets (vector dimension).
+        """
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Iterable[str]:
+        words = _TOKEN_RE.findall(text.lower())
+        yield from words
+        yield from (f"{a} {b}" for a, b in zip(words, words[1:]))
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            # Low bits pick the bucket, one more bit picks the sign to reduce collision bias
+            vector[digest % self.dim] += 1.0 if (digest >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed_one(text) for text in texts])
+
+
+class OpenAIEmbedder(Embedder):
+    """Embedder backed by the OpenAI embeddings API."""
+
+    def __init__(self, client, model: str = "text-embedding-3-small", dim: int = 256) -> None:
+        """
+        Args:
+            client: An `openai.AsyncOpenAI` client.
+            model: Embedding model name.
+            dim: Requested vector dimension.
+        """
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"{model}-{dim}"
+
+    async def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        response = await self.client.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorIndex:
+    """
+    Append-only vector index for one (user, character) pair.
+
+    Vectors are stored as float16 rows in `<base>.vec` and read back through a memory map,
+    so an index costs almost no resident memory until it is searched. Message IDs are kept
+    one per line in `<base>.ids`, in the same order as the rows.
+    """
+
+    def __init__(self, base_path: str, dim: int) -> None:
+        """
+        Args:
+            base_path: Path of the index files without extension.
+            dim: Vector dimension.
+        """
+        self.dim = dim
+        self.vec_path = base_path + ".vec"
+        self.ids_path = base_path + ".ids"
+        self.ids: List[str] = []
+        self._matrix: Optional[np.memmap] = None
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path) as f:
+                self.ids = f.read().split()
+            self._repair()
+
+    def _repair(self) -> None:
+        """Realign the two files if an append was interrupted between them"""
+        row_bytes = 2 * self.dim
+        size = os.path.getsize(self.vec_path) if os.path.exists(self.vec_path) else 0
+        self.ids = self.ids[:size // row_bytes]
+        if size != len(self.ids) * row_bytes:
+            with open(self.vec_path, "r+b") as f:
+                f.truncate(len(self.ids) * row_bytes)
+            with open(self.ids_path, "w") as f:
+                f.write("".join(f"{i}\n" for i in self.ids))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray) -> None:
+        """
+        Append vectors to the index.
+
+        Args:
+            ids: Message IDs, one per row.
+            vectors: Array of shape (len(ids), dim).
+        """
+        if not len(ids):
+            return
+        with open(self.vec_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+        with open(self.ids_path, "a") as f:
+            f.write("".join(f"{i}\n" for i in ids))
+        self.ids.extend(ids)
+        self._matrix = None  # Remap on next search
+
+    def search(self, query: np.ndarray, k: int, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """
+        Find the rows most similar to a query vector (cosine similarity).
+
+        Args:
+            query: Normalized query vector.
+            k: Maximum number of results.
+            exclude: Message IDs to leave out (e.g. those already in the recent window).
+
+        Returns:
+            (message_id, score) pairs, best first.
+        """
+        if not self.ids or k <= 0:
+            return []
+        if self._matrix is None or self._matrix.shape[0] != len(self.ids):
+            self._matrix = np.memmap(self.vec_path, dtype=np.float16, mode="r", shape=(len(self.ids), self.dim))
+
+        query = query.astype(np.float32)
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), _SEARCH_CHUNK_ROWS):
+            chunk = self._matrix[start:start + _SEARCH_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+        excluded = set(exclude)
+        wanted = min(len(scores), k + len(excluded))
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top if self.ids[i] not in excluded][:k]
+
+
+class VectorStore:
+    """Directory of per-(user, character) vector indexes with an LRU of open indexes."""
+
+    def __init__(self, directory: str, embedder: Embedder, max_open: int = 1024) -> None:
+        """
+        Args:
+            directory: Where index files are kept; a subdirectory per embedder is used.
+            embedder: Embedder used for both messages and queries.
+            max_open: Maximum number of indexes kept open.
+        """
+        self.directory = directory
+        self.embedder = embedder
+        self._open: LRUCache = LRUCache(maxsize=max_open)
+
+    def index(self, user_id: str, character_id: str) -> VectorIndex:
+        """Get (opening if necessary) the index of a user and character."""
+        key = (user_id, character_id)
+        index = self._open.get(key)
+        if index is None:
+            path = os.path.join(self.directory, self.embedder.name)
+            os.makedirs(path, exist_ok=True)
+            index = VectorIndex(os.path.join(path, f"{user_id}_{character_id}"), self.embedder.dim)
+            self._open[key] = index
+        return index
+
+    async def add(self, user_id: str, character_id: str, message_id: str, text: str) -> None:
+        """Embed a message and append it to its index."""
+        vectors = await self.embedder.embed([text])
+        self.index(user_id, character_id).add([message_id], vectors)
+
+    async def search(self, user_id: str, character_id: str, query: str, k: int,
+                     exclude: Iterable[str] = (), vector: Optional[np.ndarray] = None) -> List[str]:
+        """
+        Find the messages most relevant to a query text.
+
+        Args:
+            vector: The query already embedded by this store's embedder, if available.
+
+        Returns:
+            Message IDs, most relevant first.
+        """
+        index = self.index(user_id, character_id)
+        if not len(index):
+            return []
+        if vector is None:
+            vector = (await self.embedder.embed([query]))[0]
+        return [message_id for message_id, _ in index.search(vector, k, exclude)]
+
+    def drop(self, user_id: str) -> int:
+        """
+        Close and delete every index of a user, for all characters and embedders.
+
+        Returns:
+            The number of files deleted.
+        """
+        for key in [key for key in self._open if key[0] == user_id]:
+            self._open.pop(key, None)
+        removed = 0
+        pattern = os.path.join(glob.escape(self.directory), "*", glob.escape(user_id) + "_*")
+        for path in glob.glob(pattern):
+            if path.endswith((".vec", ".ids")):
+                os.remove(path)
+                removed += 1
+        return removed
@@ -3,28 +3,71 @@ import os
 import time
 from functools import lru_cache
 
-import openai
 from enum import Enum
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Tuple
 
 from chatgame import update_memory, update_affinity
+from chatgame.sessions import set_session_summarizer
+from chatgame.purge import set_action_waiter
+from chatgame import usage
 from utils.ChatContext import ChatContext
+from utils.CircuitBreaker import CircuitOpenError, get_breaker
+from utils.Hedging import HedgePolicy
+from utils.Metrics import counter, histogram
+from utils.MySQLHandler import is_transient_error
+from utils.TaskQueue import KeyedTaskQueue
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("chatgpt")
 
-# Initialize OpenAI client with API key from environment variables
-client = openai.AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    timeout=30.0,  # 30 second timeout
-)
+CHAT_MODEL = "gpt-4o-mini"
+
+# OpenAI client, created on first use: importing `openai` alone takes about half a second
+_client = None
+
+
+def get_client():
+    """
+    Get the OpenAI client, creating it with the API key from environment variables on first use.
+    The startup hook calls this from a worker thread so the import cost stays off the event loop.
+    """
+    global _client
+    if _client is None:
+        import openai
+        _client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=30.0,  # 30 second timeout
+        )
+    return _client
+
+
+def _is_openai_outage(error: BaseException) -> bool:
+    """Errors that count against the OpenAI circuit breaker: timeouts, connection errors, 429s and 5xx."""
+    import openai
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+# Fails chat requests fast while OpenAI keeps timing out or erroring
+openai_breaker = get_breaker("openai", is_failure=_is_openai_outage, min_calls=5, open_seconds=30.0)
+
+# Optional hedged requests (OPENAI_HEDGING=on): when a request is slower than the recent p95,
+# an identical one is sent and the first answer wins, spending at most ~5% extra requests
+hedge_policy = HedgePolicy(quantile=0.95, budget=0.05) \
+    if os.getenv("OPENAI_HEDGING", "off").strip().lower() in ("on", "true", "1") else None
+
+# Background queue applying memory/affinity actions after the reply has been sent.
+# Keyed by (user_id, character_id) so consecutive updates for the same pair apply in order.
+action_queue = KeyedTaskQueue(name="actions", workers=4, max_size=1000)
+# A user's purge waits for their queued actions, so it deletes what they write
+set_action_waiter(lambda user_id: action_queue.wait_idle(lambda key: key[0] == user_id))
+
+llm_request_seconds = histogram("llm_request_seconds", "Duration of chat requests to the AI model, including hedges")
+llm_requests = counter("llm_requests", "Chat requests to the AI model by outcome", ["outcome"])
 
 
 class ActionType(str, Enum):
@@ -47,7 +90,8 @@ class ChatResponse(BaseModel):
 
 # Cache for character settings to reduce redundant operations
 @lru_cache(maxsize=100)
-def _get_system_prompts(character_settings: str, user_character_settings: str, memory: str, affinity: str) -> List[Dict[str, str]]:
+def _get_system_prompts(character_settings: str, user_character_settings: str, memory: str, affinity: str,
+                        session_summary: str = "") -> List[Dict[str, str]]:
     """
     Create system prompts from context.
     This function is cached to avoid recreating the same prompts.
@@ -57,6 +101,7 @@ def _get_system_prompts(character_settings: str, user_character_settings: str, m
         user_character_settings: User character settings data
         memory: Memory data
         affinity: Affinity data
+        session_summary: Summary of the earlier chat sessions with the user
         
     Returns:
         List of system prompt messages
@@ -92,6 +137,9 @@ def _get_system_prompts(character_settings: str, user_character_settings: str, m
 
                 The following field contains the affinity of the user. You should use this information to adjust your responses to the user.
                 {affinity}
+
+                The following field summarizes your earlier conversations with the user. Continue naturally from it.
+                {session_summary}
             """
         },
     ]
@@ -100,7 +148,9 @@ def _get_system_prompts(character_settings: str, user_character_settings: str, m
 async def _process_actions(user_id: str, character_id: str, actions: List[Action]) -> None:
     """
     Process actions requested by the AI model.
-    
+    Transient database errors are re-raised so the action queue can retry the batch;
+    the updates are idempotent, so re-applying earlier actions is harmless.
+
     Args:
         user_id: User ID
         character_id: Character ID
@@ -113,60 +163,159 @@ async def _process_actions(user_id: str, character_id: str, actions: List[Action
             elif action.type == ActionType.memory:
                 await update_memory(user_id, character_id, action.value)
         except Exception as e:
+            if is_transient_error(e):
+                raise
             logger.warning(f"Failed to update {action.type}: {str(e)}")
 
 
-async def chat(context: ChatContext) -> Optional[str]:
+async def chat(context: ChatContext, hedge: bool = True, retry: bool = False) -> Optional[str]:
     """
     Send a chat request to the AI model and process the response.
 
     Args:
         context: ChatContext containing conversation history and character state
+        hedge: Whether the request may be hedged when hedging is enabled. Retries pass False,
+            since a retry already is a second request.
+        retry: Whether this is a retry of the turn's request (recorded in the usage records).
 
     Returns:
         The AI's response text or None if the request failed
+
+    Raises:
+        CircuitOpenError: If OpenAI is considered down and the request was not sent.
     """
     start_time = time.time()
     
     # Construct system prompts to guide the AI's behavior
+    prompt_cache_hits = _get_system_prompts.cache_info().hits
     system_prompt = _get_system_prompts(
         context.character_settings,
-        context.user_character_settings,
+        str(context.user_character_settings),  # Stringified, the prompt cache needs hashable arguments
         context.memory,
-        str(context.affinity)
+        str(context.affinity),
+        context.session_summary
     )
+    system_prompt_reused = _get_system_prompts.cache_info().hits > prompt_cache_hits
+
+    # Prepare the messages - the history keeps only the most recent ones
+    message_history = context.openai_messages()
 
-    # Prepare the messages - limit history if too long
-    message_history = context.message_history
-    if len(message_history) > ChatContext.chatContextMaximumMessageLength:
-        # Keep the most recent messages
-        message_history = message_history[-ChatContext.chatContextMaximumMessageLength:]
+    client = get_client()
+    import openai
 
     try:
         # Send request to OpenAI API with structured response format
-        completion = await client.beta.chat.completions.parse(
-            messages=system_prompt + message_history,
-            model="gpt-4o-mini",
-            response_format=ChatResponse
-        )
+        def request():
+            return client.beta.chat.completions.parse(
+                messages=system_prompt + message_history,
+                model=CHAT_MODEL,
+                response_format=ChatResponse
+            )
+
+        flags = ((usage.SYSTEM_PROMPT_REUSED if system_prompt_reused else 0)
+                 | (usage.CONTEXT_PREFETCHED if context.prefetched else 0)
+                 | (usage.RETRY if retry else 0))
+        discarded = []  # (completion or None, latency) of the hedged attempts that lost
+        with openai_breaker.guard():
+            request_started = time.perf_counter()
+            if hedge and hedge_policy is not None:
+                completion = await hedge_policy.run(request, on_discarded=lambda *attempt: discarded.append(attempt))
+            else:
+                completion = await request()
+            request_latency = time.perf_counter() - request_started
+            llm_request_seconds.observe(request_latency)
+
+        _meter_usage(context, completion, request_latency, flags)
+        # The losing attempt was paid for as well
+        for lost, latency in discarded:
+            _meter_usage(context, lost, latency, flags | usage.HEDGE_DISCARDED,
+                         prompt_tokens=getattr(getattr(completion, "usage", None), "prompt_tokens", 0))
 
         response = completion.choices[0].message.parsed
         if response:
-            # Process any actions requested by the AI in a separate task to not block response
-            await _process_actions(context.user_id, context.character_id, response.actions)
+            # Process any actions requested by the AI in the background to not block response
+            await action_queue.submit(
+                (context.user_id, context.character_id),
+                _process_actions, context.user_id, context.character_id, response.actions)
 
         # Log timing for performance monitoring
         elapsed_time = time.time() - start_time
         logger.info(f"Chat request completed in {elapsed_time:.2f}s")
+        llm_requests.labels("ok").inc()
         
         return str(response.message)
+    except CircuitOpenError:
+        llm_requests.labels("circuit_open").inc()
+        raise
     except openai.APITimeoutError:
+        llm_requests.labels("timeout").inc()
         logger.error("OpenAI API request timed out")
     except openai.RateLimitError:
+        llm_requests.labels("rate_limited").inc()
         logger.error("OpenAI API rate limit exceeded")
     except openai.APIError as e:
+        llm_requests.labels("api_error").inc()
         logger.error(f"OpenAI API error: {str(e)}")
     except Exception as e:
+        llm_requests.labels("error").inc()
         logger.error(f"Unexpected error in chat: {str(e)}", exc_info=True)
 
     return None
+
+
+def _meter_usage(context: ChatContext, completion, latency: float, flags: int, prompt_tokens: int = 0) -> None:
+    """
+    Buffer the token usage and latency of a completion for the usage tables.
+    Without a completion (a cancelled hedge attempt) `prompt_tokens` sent and no answer are recorded.
+    """
+    if completion is None:
+        if prompt_tokens:
+            usage.get_usage_meter().record(context.user_id, context.character_id, CHAT_MODEL,
+                                           prompt_tokens, 0, 0, latency, flags)
+        return
+    counts = getattr(completion, "usage", None)
+    if counts is None:
+        return
+    details = getattr(counts, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+    if cached_tokens:
+        flags |= usage.PROMPT_CACHE_HIT
+    usage.get_usage_meter().record(
+        context.user_id, context.character_id, getattr(completion, "model", None) or CHAT_MODEL,
+        counts.prompt_tokens, counts.completion_tokens, cached_tokens, latency, flags)
+
+
+async def summarize_session(previous_summary: str, messages: List[Dict]) -> str:
+    """
+    Summarize a closed chat session with the AI model, for the next session's context.
+    Enabled with SESSION_SUMMARIZER=openai.
+
+    Args:
+        previous_summary: Summary carried into the closed session
+        messages: Latest messages of the closed session, oldest first
+
+    Returns:
+        The summary text
+    """
+    transcript = "\n".join(
+        f"{'User' if message['from_user'] else 'Character'}: {message['content']}" for message in messages)
+    with openai_breaker.guard():
+        completion = await get_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Summarize this role-play conversation in at most 150 words, keeping names, facts "
+                               "about the user and open plot threads. Merge in the earlier summary if given."
+                },
+                {
+                    "role": "user",
+                    "content": f"Earlier summary:\n{previous_summary or '(none)'}\n\nConversation:\n{transcript}"
+                },
+            ]
+        )
+    return completion.choices[0].message.content or previous_summary
+
+
+if os.getenv("SESSION_SUMMARIZER", "extractive").strip().lower() == "openai":
+    set_session_summarizer(summarize_session)